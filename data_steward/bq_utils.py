@@ -8,6 +8,7 @@ from datetime import datetime
 from io import open
 
 # Third party imports
+import numpy
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
@@ -17,6 +18,7 @@ import common
 import gcs_utils
 import resources
 from constants import bq_utils as bq_consts
+from utils import client_cache
 
 socket.setdefaulttimeout(bq_consts.SOCKET_TIMEOUT)
 
@@ -129,7 +131,12 @@ def get_validation_results_dataset_id():
 
 
 def create_service():
-    return build('bigquery', 'v2', cache={})
+    """
+    Get the BigQuery service for the current thread, building it on first use
+    """
+    return client_cache.get(('bigquery', 'v2'),
+                            lambda: build('bigquery', 'v2', cache={}),
+                            per_thread=True)
 
 
 def get_table_id(hpo_id, table_name):
@@ -357,6 +364,101 @@ def sleeper(poll_interval):
     return
 
 
+class JobTracker(object):
+    """
+    Waits on BigQuery jobs, checking the state of all outstanding jobs at once
+
+    A single service is reused for the lifetime of the tracker and the state of
+    all outstanding jobs is fetched with one batch request per poll. The latest
+    job resource (including any errors) is kept for every tracked job so
+    callers need not request it again once the job is done.
+    """
+
+    def __init__(self, project_id=None, bq_service=None):
+        """
+        :param project_id: project the jobs run in (app ID by default)
+        :param bq_service: BigQuery service to use (built on first use by default)
+        """
+        self._project_id = project_id
+        self._bq_service = bq_service
+        self._start_times = dict()
+        # job_id -> latest job resource
+        self.job_resources = dict()
+        # job_id -> seconds between tracking the job and observing it done
+        self.wait_times = dict()
+
+    @property
+    def project_id(self):
+        if self._project_id is None:
+            self._project_id = app_identity.get_application_id()
+        return self._project_id
+
+    @property
+    def bq_service(self):
+        if self._bq_service is None:
+            self._bq_service = create_service()
+        return self._bq_service
+
+    def track(self, job_ids):
+        """
+        Start measuring the wait time of jobs which are not yet tracked
+
+        :param job_ids: list of job_id strings
+        """
+        now = time.time()
+        for job_id in job_ids:
+            self._start_times.setdefault(job_id, now)
+
+    def poll(self, job_ids):
+        """
+        Refresh the job resources of the specified jobs
+
+        :param job_ids: list of job_id strings
+        :return: list of the jobs which are not done
+        """
+        self.track(job_ids)
+        job_resources = get_jobs_details(job_ids,
+                                         project_id=self.project_id,
+                                         bq_service=self.bq_service)
+        now = time.time()
+        incomplete_job_ids = []
+        for job_id in job_ids:
+            job_resource = job_resources.get(job_id)
+            if job_resource is not None:
+                self.job_resources[job_id] = job_resource
+            if job_resource is not None and job_resource['status'][
+                    'state'] == 'DONE':
+                self.wait_times.setdefault(job_id,
+                                           now - self._start_times[job_id])
+            else:
+                incomplete_job_ids.append(job_id)
+        return incomplete_job_ids
+
+    def wait(self, job_ids, retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT):
+        """
+        Implements exponential backoff to wait for jobs to complete
+
+        :param job_ids: list of job_id strings
+        :param retry_count: max number of iterations for exponent
+        :return: list of jobs that failed to complete or empty list if all completed
+        """
+        job_ids = list(job_ids)
+        self.track(job_ids)
+        poll_interval = 1
+        for _ in range(retry_count):
+            logging.info(
+                f'Waiting {poll_interval} seconds for completion of job(s): {job_ids}'
+            )
+            sleeper(poll_interval)
+            job_ids = self.poll(job_ids)
+            if not job_ids:
+                return job_ids
+            if poll_interval < bq_consts.MAX_POLL_INTERVAL:
+                poll_interval *= 2
+        logging.info(f'Job(s) {job_ids} failed to complete')
+        return job_ids
+
+
 def wait_on_jobs(job_ids, retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT):
     """
     Implements exponential backoff to wait for jobs to complete
@@ -364,20 +466,7 @@ def wait_on_jobs(job_ids, retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT):
     :param retry_count: max number of iterations for exponent
     :return: list of jobs that failed to complete or empty list if all completed
     """
-    job_ids = list(job_ids)
-    poll_interval = 1
-    for _ in range(retry_count):
-        logging.info(
-            f'Waiting {poll_interval} seconds for completion of job(s): {job_ids}'
-        )
-        sleeper(poll_interval)
-        job_ids = [job_id for job_id in job_ids if not job_status_done(job_id)]
-        if not job_ids:
-            return job_ids
-        if poll_interval < bq_consts.MAX_POLL_INTERVAL:
-            poll_interval *= 2
-    logging.info(f'Job(s) {job_ids} failed to complete')
-    return job_ids
+    return JobTracker().wait(job_ids, retry_count)
 
 
 def get_job_details(job_id):
@@ -392,6 +481,44 @@ def get_job_details(job_id):
         jobId=job_id).execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
 
 
+def get_jobs_details(job_ids, project_id=None, bq_service=None):
+    """
+    Get the job resources corresponding to several job_ids using batch requests
+
+    Jobs whose resource could not be retrieved are logged and left out of the
+    result so that they may be requested again later.
+
+    :param job_ids: list of job_id strings
+    :param project_id: project the jobs run in (app ID by default)
+    :param bq_service: BigQuery service to use (a new one by default)
+    :returns: dict mapping job_id to its job resource
+    """
+    job_ids = list(job_ids)
+    if bq_service is None:
+        bq_service = create_service()
+    if project_id is None:
+        project_id = app_identity.get_application_id()
+
+    job_resources = dict()
+
+    def collect(request_id, response, exception):
+        job_id = job_ids[int(request_id)]
+        if exception is not None:
+            logging.warning(
+                f'Failed to get details of job {job_id}: {exception}')
+        else:
+            job_resources[job_id] = response
+
+    for start in range(0, len(job_ids), bq_consts.BATCH_REQUEST_MAX_SIZE):
+        batch = bq_service.new_batch_http_request(callback=collect)
+        end = start + bq_consts.BATCH_REQUEST_MAX_SIZE
+        for index, job_id in enumerate(job_ids[start:end], start):
+            batch.add(bq_service.jobs().get(projectId=project_id, jobId=job_id),
+                      request_id=str(index))
+        batch.execute()
+    return job_resources
+
+
 def query(q,
           use_legacy_sql=False,
           destination_table_id=None,
@@ -599,28 +726,89 @@ def large_response_to_rowlist(query_response):
     Convert a query response to a list of dictionary objects
 
     This automatically uses the pageToken feature to iterate through a
-    large result set.  Use cautiously.
+    large result set.  Use cautiously.  Prefer `iter_query_rows` to avoid
+    holding the whole result set in memory.
 
     :param query_response: the query response object to iterate
     :return: list of dictionaries
     """
-    bq_service = create_service()
-    app_id = app_identity.get_application_id()
+    return list(iter_query_rows(query_response))
+
 
+def iter_query_rows(query_response):
+    """
+    Iterate over the rows of a query response, one page at a time
+
+    Subsequent pages are only requested once the rows of the previous page
+    have been consumed.
+
+    :param query_response: the query response object to iterate
+    :return: generator of dictionaries, one per row
+    """
+    transform_row = None
+    for page in _iter_query_pages(query_response):
+        if transform_row is None:
+            transform_row = _compile_schema(_get_schema_fields(page))
+        for row in page.get(bq_consts.ROWS, []):
+            yield transform_row(row)
+
+
+def iter_query_batches(query_response, as_dataframe=False):
+    """
+    Iterate over the rows of a query response as column-oriented batches
+
+    Each page of the response becomes one batch.  Integer, float and boolean
+    columns without nulls are returned as arrays of the corresponding numpy
+    type; all other columns are returned as arrays of objects.
+
+    :param query_response: the query response object to iterate
+    :param as_dataframe: if True, yield a pandas DataFrame for each batch
+    :return: generator of dicts mapping column names to numpy arrays, or of
+        DataFrames if as_dataframe is True
+    """
+    fields = None
+    converters = None
+    for page in _iter_query_pages(query_response):
+        if converters is None:
+            fields = _get_schema_fields(page)
+            converters = [_compile_field(field) for field in fields]
+        rows = page.get(bq_consts.ROWS, [])
+        columns = dict()
+        for index, field in enumerate(fields):
+            convert = converters[index]
+            values = [convert(row['f'][index]['v']) for row in rows]
+            columns[field['name']] = _to_array(values, field)
+        if as_dataframe:
+            # pandas is only needed by callers asking for DataFrames
+            import pandas
+            yield pandas.DataFrame(columns,
+                                   columns=[field['name'] for field in fields])
+        else:
+            yield columns
+
+
+def _iter_query_pages(query_response):
+    """
+    Iterate over the pages of a query response
+
+    :param query_response: the query response object, i.e. the first page
+    :return: generator of query response objects, one per page
+    """
+    yield query_response
     page_token = query_response.get(bq_consts.PAGE_TOKEN)
+    if not page_token:
+        return
+
+    bq_service = create_service()
+    app_id = app_identity.get_application_id()
     job_ref = query_response.get(bq_consts.JOB_REFERENCE)
     job_id = job_ref.get(bq_consts.JOB_ID)
-
-    result_list = response2rows(query_response)
     while page_token:
         next_grouping = bq_service.jobs() \
             .getQueryResults(projectId=app_id, jobId=job_id, pageToken=page_token) \
             .execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
         page_token = next_grouping.get(bq_consts.PAGE_TOKEN)
-        intermediate_rows = response2rows(next_grouping)
-        result_list.extend(intermediate_rows)
-
-    return result_list
+        yield next_grouping
 
 
 def response2rows(r):
@@ -631,76 +819,111 @@ def response2rows(r):
     :return: list of dict
     """
     rows = r.get(bq_consts.ROWS, [])
-    schema = r.get(bq_consts.SCHEMA, {bq_consts.FIELDS: None})[bq_consts.FIELDS]
-    return [_transform_row(row, schema) for row in rows]
+    transform_row = _compile_schema(_get_schema_fields(r))
+    return [transform_row(row) for row in rows]
 
 
-def _recurse_on_row(col_dict, nested_value):
+def _get_schema_fields(r):
     """
-    Apply the schema specified by the given dict to the nested value by recursing on it.
+    Get the list of field dicts describing the schema of a query response
 
-        :param col_dict: the schema to apply to the nested value.
-        :param nested_value: A value nested in a BigQuery row.
-        :returns: Union[dict, list] objects from applied schema.
-        """
+    :param r: a query response object
+    :return: list of field dicts, empty if the response has no schema
+    """
+    return r.get(bq_consts.SCHEMA,
+                 {bq_consts.FIELDS: None})[bq_consts.FIELDS] or []
 
-    row_value = None
 
-    # Multiple nested records
-    if col_dict['mode'] == 'REPEATED' and isinstance(nested_value, list):
-        row_value = [
-            _transform_row(record['v'], col_dict['fields'])
-            for record in nested_value
-        ]
+def _to_bool(value):
+    return value in ('True', 'true', 'TRUE')
 
-    # A single nested record
-    else:
-        row_value = _transform_row(nested_value, col_dict['fields'])
 
-    return row_value
+_TYPE_CONVERTERS = {
+    'INTEGER': int,
+    'INT64': int,
+    'FLOAT': float,
+    'FLOAT64': float,
+    'BOOLEAN': _to_bool,
+    'BOOL': _to_bool,
+    'TIMESTAMP': float
+}
+
+_NUMPY_DTYPES = {
+    'INTEGER': 'int64',
+    'INT64': 'int64',
+    'FLOAT': 'float64',
+    'FLOAT64': 'float64',
+    'BOOLEAN': 'bool',
+    'BOOL': 'bool',
+    'TIMESTAMP': 'float64'
+}
 
 
-def _transform_row(row, schema):
+def _compile_field(field):
     """
-    Apply the given schema to the given BigQuery data row. Adapted from https://goo.gl/dWszQJ.
+    Get a function which converts a raw cell value according to a schema field
 
-    :param row: A single BigQuery row to transform
-    :param schema: The BigQuery table schema to apply to the row, specifically
-        the list of field dicts.
-    :returns: Row as a dict
+    :param field: a field dict with keys name, type, mode and (for records) fields
+    :return: function taking the raw cell value and returning the typed value
     """
+    if field['type'] in ('RECORD', 'STRUCT'):
+        # Recurse on nested records
+        convert_item = _compile_schema(field['fields'])
+    else:
+        convert_item = _TYPE_CONVERTERS.get(field['type'], lambda value: value)
+    repeated = field.get('mode') == 'REPEATED'
 
-    log = {}
+    def convert(value):
+        if value is None:
+            return None
+        # Multiple values, each wrapped as {'v': value}
+        if repeated and isinstance(value, list):
+            return [
+                None if item['v'] is None else convert_item(item['v'])
+                for item in value
+            ]
+        return convert_item(value)
 
-    # Match each schema column with its associated row value
-    for index, col_dict in enumerate(schema):
-        col_name = col_dict['name']
-        row_value = row['f'][index]['v']
+    return convert
 
-        if row_value is None:
-            log[col_name] = None
-            continue
 
-        # Recurse on nested records
-        if col_dict['type'] == 'RECORD':
-            row_value = _recurse_on_row(col_dict, row_value)
+def _compile_schema(schema):
+    """
+    Get a function which applies a schema to a BigQuery data row
 
-        # Otherwise just cast the value
-        elif col_dict['type'] == 'INTEGER':
-            row_value = int(row_value)
+    The schema is inspected once so that converting each row only applies the
+    converter of each column. Adapted from https://goo.gl/dWszQJ.
 
-        elif col_dict['type'] == 'FLOAT':
-            row_value = float(row_value)
+    :param schema: The BigQuery table schema to apply to rows, specifically
+        the list of field dicts.
+    :returns: function taking a single BigQuery row and returning it as a dict
+    """
+    columns = [(index, field['name'], _compile_field(field))
+               for index, field in enumerate(schema)]
 
-        elif col_dict['type'] == 'BOOLEAN':
-            row_value = row_value in ('True', 'true', 'TRUE')
+    def transform_row(row):
+        cells = row['f']
+        return {
+            name: convert(cells[index]['v']) for index, name, convert in columns
+        }
+
+    return transform_row
 
-        elif col_dict['type'] == 'TIMESTAMP':
-            row_value = float(row_value)
 
-        log[col_name] = row_value
+def _to_array(values, field):
+    """
+    Convert a column of values to a numpy array
 
-    return log
+    :param values: list of typed values of the column
+    :param field: the schema field of the column
+    :return: numpy array, of object type if the column has nulls or non-scalar values
+    """
+    dtype = _NUMPY_DTYPES.get(field['type'])
+    if dtype is None or field.get('mode') == 'REPEATED' or None in values:
+        array = numpy.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    return numpy.array(values, dtype=dtype)
 
 
 def list_all_table_ids(dataset_id=None):
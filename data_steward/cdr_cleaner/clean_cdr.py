@@ -11,6 +11,8 @@ import logging
 
 # Project imports
 import cdr_cleaner.clean_cdr_engine as clean_engine
+import cdr_cleaner.query_planner as query_planner
+import cdr_cleaner.run_manifest as run_manifest
 import cdr_cleaner.cleaning_rules.backfill_pmi_skip_codes as back_fill_pmi_skip
 import cdr_cleaner.cleaning_rules.clean_years as clean_years
 import cdr_cleaner.cleaning_rules.domain_alignment as domain_alignment
@@ -203,6 +205,33 @@ DEID_CLEAN_CLEANING_CLASSES = [
     (CleanMappingExtTables,)
 ]
 
+# legacy cleaning functions which generate their queries without reading the
+# dataset, so their queries can be generated before earlier rules ran
+STATIC_QUERY_FUNCTIONS = [
+    id_dedup.get_id_deduplicate_queries,
+    clean_years.get_year_of_birth_queries,
+    neg_ages.get_negative_ages_queries,
+    bad_end_dates.get_bad_end_date_queries,
+    drug_refills_supply.get_days_supply_refills_queries,
+    remove_records_with_wrong_date.get_remove_records_with_wrong_date_queries,
+    invalid_procedure_source.get_remove_invalid_procedure_source_queries,
+    maps_to_value_vocab_update.get_maps_to_value_ppi_vocab_update_queries,
+    back_fill_pmi_skip.get_run_pmi_fix_queries,
+    remove_multiple_race_answers.
+    get_remove_multiple_race_ethnicity_answers_queries,
+    negative_ppi.get_update_ppi_queries,
+    round_ppi_values.get_round_ppi_values_queries,
+    update_family_history.get_update_family_history_qa_queries,
+    extreme_measurements.get_drop_extreme_measurement_queries,
+    drop_mult_meas.get_drop_multiple_measurement_queries,
+    drop_participants_without_ppi_or_ehr.get_queries,
+    no_data_30days_after_death.no_data_30_days_after_death,
+    valid_death_dates.get_valid_death_date_queries,
+    drop_duplicate_states.get_drop_duplicate_states_queries,
+    fill_source_value.get_fill_freetext_source_value_fields_queries,
+    repopulate_person.get_repopulate_person_post_deid_queries,
+]
+
 DATA_STAGE_RULES_MAPPING = {
     DataStage.EHR.value: EHR_CLEANING_CLASSES,
     DataStage.UNIONED.value: UNIONED_EHR_CLEANING_CLASSES,
@@ -232,6 +261,39 @@ def get_parser():
         type=DataStage,
         choices=list([s for s in DataStage if s is not DataStage.UNSPECIFIED]),
         help='Specify the dataset')
+    engine_parser.add_argument(
+        '-w',
+        '--max_workers',
+        dest='max_workers',
+        action='store',
+        type=int,
+        default=1,
+        help=('Maximum number of queries to run at the same time.  Queries '
+              'not depending on each other run concurrently if more than 1'))
+    engine_parser.add_argument(
+        '--manifest_path',
+        dest='manifest_path',
+        action='store',
+        help=('File recording the outcome of each query of the run.  '
+              'Defaults to a file named after the dataset in the temp folder'))
+    engine_parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help=('Skip the queries the manifest records as completed by a '
+              'previous run on the same dataset'))
+    engine_parser.add_argument(
+        '--fuse',
+        dest='fuse',
+        action='store_true',
+        help=('Fuse chains of queries rewriting the same table into one '
+              'query per chain'))
+    engine_parser.add_argument(
+        '--plan_output',
+        dest='plan_output',
+        action='store',
+        help=('Dry run the queries without executing them and write the '
+              'bytes each would process to this csv or json file'))
     return engine_parser
 
 
@@ -342,10 +404,25 @@ if __name__ == '__main__':
             **kwargs)
         for query in query_list:
             LOGGER.info(query)
+    elif args.plan_output:
+        clean_engine.add_console_logging(args.console_log)
+        query_planner.plan_dataset(project_id=args.project_id,
+                                   dataset_id=args.dataset_id,
+                                   sandbox_dataset_id=args.sandbox_dataset_id,
+                                   rules=rules,
+                                   output_filepath=args.plan_output,
+                                   **kwargs)
     else:
         clean_engine.add_console_logging(args.console_log)
+        manifest_path = args.manifest_path or run_manifest.get_manifest_path(
+            args.project_id, args.dataset_id)
         clean_engine.clean_dataset(project_id=args.project_id,
                                    dataset_id=args.dataset_id,
                                    sandbox_dataset_id=args.sandbox_dataset_id,
                                    rules=rules,
+                                   max_workers=args.max_workers,
+                                   manifest_path=manifest_path,
+                                   resume=args.resume,
+                                   fuse=args.fuse,
+                                   static_rules=STATIC_QUERY_FUNCTIONS,
                                    **kwargs)
@@ -1,14 +1,17 @@
 # Python imports
 import inspect
 import logging
+import re
 from concurrent.futures import TimeoutError as TOError
+from fnmatch import fnmatch
 
 # Third party imports
 import google.cloud.bigquery as gbq
 from google.cloud.exceptions import GoogleCloudError
 
 # Project imports
-from utils import bq
+from utils import bq, task_graph
+from cdr_cleaner.run_manifest import RunManifest
 from cdr_cleaner.cleaning_rules.base_cleaning_rule import BaseCleaningRule
 from constants import bq_utils as bq_consts
 from constants.cdr_cleaner import clean_cdr as cdr_consts
@@ -16,6 +19,27 @@ from constants.cdr_cleaner import clean_cdr_engine as ce_consts
 
 LOGGER = logging.getLogger(__name__)
 
+# matches a [project.]dataset.table reference once quotes are removed
+TABLE_REFERENCE_PATTERN = re.compile(
+    r'(?<![\w.*-])([a-z_][\w-]*(?:[.:][\w*-]+){1,3})')
+# matches the target of a statement which modifies or creates a table
+WRITE_STATEMENT_PATTERN = re.compile(
+    r'\b(?:update|delete(?:\s+from)?|insert(?:\s+into)?|merge(?:\s+into)?|'
+    r'truncate\s+table|(?:create|drop)(?:\s+or\s+replace)?'
+    r'(?:\s+temp|\s+temporary)?\s+(?:table|view)'
+    r'(?:\s+if(?:\s+not)?\s+exists)?)\s+'
+    r'([a-z_][\w-]*(?:[.:][\w*-]+){1,3})')
+METADATA_TABLES = ['information_schema', '__tables__', '__tables_summary__']
+LEADING_COMMENTS_PATTERN = re.compile(r'^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*',
+                                      re.DOTALL)
+SELECT_STATEMENT_PATTERN = re.compile(r'\(*\s*(?:select|with)\b')
+# functions whose results may differ between two evaluations of a query, e.g.
+# ROW_NUMBER without a total order keeps an arbitrary copy of duplicate rows
+NONDETERMINISTIC_FUNCTION_PATTERN = re.compile(
+    r'\b(?:row_number|rank|dense_rank|percent_rank|cume_dist|ntile|'
+    r'first_value|last_value|nth_value|lag|lead|any_value|array_agg|'
+    r'string_agg|rand|generate_uuid)\s*\(', re.IGNORECASE)
+
 
 def add_console_logging(add_handler=True):
     """
@@ -39,7 +63,16 @@ def add_console_logging(add_handler=True):
         logging.getLogger('').addHandler(handler)
 
 
-def clean_dataset(project_id, dataset_id, sandbox_dataset_id, rules, **kwargs):
+def clean_dataset(project_id,
+                  dataset_id,
+                  sandbox_dataset_id,
+                  rules,
+                  max_workers=1,
+                  manifest_path=None,
+                  resume=False,
+                  fuse=False,
+                  static_rules=(),
+                  **kwargs):
     """
     Run the assigned cleaning rules and return list of BQ job objects
 
@@ -47,11 +80,40 @@ def clean_dataset(project_id, dataset_id, sandbox_dataset_id, rules, **kwargs):
     :param dataset_id: identifies the dataset to clean
     :param sandbox_dataset_id: identifies the sandbox dataset to store backup rows
     :param rules: a list of cleaning rule objects/functions as tuples
+    :param max_workers: maximum number of queries to run at the same time;
+        rules are applied one query at a time in list order if 1 or less
+    :param manifest_path: path of the file recording the outcome of each
+        query, no manifest is kept if not set
+    :param resume: if True, skip the queries the manifest records as completed
+        by a previous run on the same dataset
+    :param fuse: if True, fuse chains of queries rewriting the same table
+        into one query per chain
+    :param static_rules: legacy cleaning functions which generate their
+        queries without reading the dataset, so their queries can be
+        generated ahead when scheduling or fusing queries
     :param kwargs: keyword arguments a cleaning rule may require
     :return all_jobs: List of BigQuery job objects
     """
     # Set up client
     client = bq.get_client(project_id=project_id)
+    manifest = None
+    if manifest_path is not None:
+        manifest = RunManifest(manifest_path,
+                               project_id,
+                               dataset_id,
+                               resume=resume)
+
+    if max_workers > 1 or fuse:
+        return schedule_rules(client,
+                              project_id,
+                              dataset_id,
+                              sandbox_dataset_id,
+                              rules,
+                              max_workers,
+                              manifest=manifest,
+                              fuse=fuse,
+                              static_rules=static_rules,
+                              **kwargs)
 
     all_jobs = []
     for rule_index, rule in enumerate(rules):
@@ -64,7 +126,7 @@ def clean_dataset(project_id, dataset_id, sandbox_dataset_id, rules, **kwargs):
             f"{rule_index+1}/{len(rules)}")
         setup_function(client)
         query_list = query_function()
-        jobs = run_queries(client, query_list, rule_info)
+        jobs = run_queries(client, query_list, rule_info, manifest=manifest)
         LOGGER.info(
             f"For clean rule {rule_info[cdr_consts.MODULE_NAME]}, {len(jobs)} jobs "
             f"were run successfully for {len(query_list)} queries")
@@ -72,6 +134,387 @@ def clean_dataset(project_id, dataset_id, sandbox_dataset_id, rules, **kwargs):
     return all_jobs
 
 
+def get_table_accesses(query_dict):
+    """
+    Get the tables a query may read and the tables it modifies
+
+    References are normalized to lower case `dataset.table` names.  The
+    references are over-approximated, e.g. a qualified column may be taken
+    for a table, which can only add ordering constraints between queries.
+
+    :param query_dict: dictionary for the query
+    :return: tuple of the set of referenced tables and the set of tables the
+        query writes to, the latter being a subset of the former
+    """
+    query = query_dict.get(cdr_consts.QUERY, '').lower()
+    query = re.sub(r'[`\[\]]', '', query)
+    writes = {
+        _normalize_table_reference(reference)
+        for reference in WRITE_STATEMENT_PATTERN.findall(query)
+    }
+    if query_dict.get(cdr_consts.DESTINATION_TABLE) is not None:
+        writes.add(f'{query_dict[cdr_consts.DESTINATION_DATASET]}.'
+                   f'{query_dict[cdr_consts.DESTINATION_TABLE]}'.lower())
+    references = {
+        _normalize_table_reference(reference)
+        for reference in TABLE_REFERENCE_PATTERN.findall(query)
+    }
+    return references | writes, writes
+
+
+def _normalize_table_reference(reference):
+    """
+    Get the `dataset.table` name of a table reference
+
+    Metadata views and tables of a dataset refer to all of its tables.
+
+    :param reference: [project.]dataset.table reference
+    :return: normalized reference
+    """
+    parts = re.split(r'[.:]', reference)
+    for i, part in enumerate(parts):
+        if part in METADATA_TABLES and i > 0:
+            return f'{parts[i - 1]}.*'
+    return '.'.join(parts[-2:])
+
+
+def _tables_overlap(tables, other_tables):
+    """
+    Determine if a table of one set may be the same as a table of another
+
+    :param tables: set of `dataset.table` names, possibly with wildcards
+    :param other_tables: set of `dataset.table` names, possibly with wildcards
+    :return: True if the sets may refer to a common table, False otherwise
+    """
+    return any(
+        fnmatch(table, other_table) or fnmatch(other_table, table)
+        for table in tables
+        for other_table in other_tables)
+
+
+def get_query_dependencies(accesses):
+    """
+    Get the queries each query must wait for to preserve sequential results
+
+    A query depends on an earlier query if either of them writes to a table
+    the other one references.
+
+    :param accesses: list of (references, writes) tuples of queries in the
+        order they are applied sequentially
+    :return: list whose i-th item is the set of indexes of the earlier
+        queries the i-th query depends on
+    """
+    return [_get_conflicting_queries(accesses, i) for i in range(len(accesses))]
+
+
+def _get_conflicting_queries(accesses, i):
+    """
+    Get the earlier queries whose order relative to the i-th query matters
+
+    :param accesses: list of (references, writes) tuples of queries
+    :param i: index of the query
+    :return: set of indexes of conflicting queries before the i-th query
+    """
+    return {j for j in range(i) if _queries_conflict(accesses[i], accesses[j])}
+
+
+def _queries_conflict(accesses, other_accesses):
+    """
+    Determine if the order of two queries matters
+
+    :param accesses: (references, writes) tuple of a query
+    :param other_accesses: (references, writes) tuple of another query
+    :return: True if either query writes to a table the other one references
+    """
+    references, writes = accesses
+    other_references, other_writes = other_accesses
+    return (_tables_overlap(writes, other_references) or
+            _tables_overlap(other_writes, references))
+
+
+def _is_prepared_independently(clazz, static_rules=()):
+    """
+    Determine if a rule's queries can be generated before earlier rules ran
+
+    Cleaning rule classes generate their query specs without reading the
+    dataset, unless they set `reads_dataset_in_setup`.  Legacy cleaning
+    functions may read the dataset while generating their queries, unless
+    they are known not to.
+
+    :param clazz: Clean rule class or old style clean function
+    :param static_rules: legacy cleaning functions which generate their
+        queries without reading the dataset
+    :return: True if the rule is a static function or a class which does not
+        read the dataset in setup_rule
+    """
+    if clazz in static_rules:
+        return True
+    if not (inspect.isclass(clazz) and issubclass(clazz, BaseCleaningRule)):
+        return False
+    return not clazz.reads_dataset_in_setup
+
+
+def _strip_leading_comments(query):
+    return LEADING_COMMENTS_PATTERN.sub('', query, count=1)
+
+
+def _get_fusable_destination(query_dict, accesses):
+    """
+    Get the table a query rewrites, if it can be fused with other queries
+
+    Standard SQL SELECT queries which only write their results to their
+    destination table with WRITE_TRUNCATE can be fused.
+
+    :param query_dict: dictionary for the query
+    :param accesses: (references, writes) tuple of the query
+    :return: `dataset.table` name of the destination or None
+    """
+    if (query_dict.get(cdr_consts.DESTINATION_TABLE) is None or
+            query_dict.get(cdr_consts.DISPOSITION) != bq_consts.WRITE_TRUNCATE
+            or query_dict.get(cdr_consts.LEGACY_SQL, False)):
+        return None
+    query = _strip_leading_comments(query_dict[cdr_consts.QUERY]).lower()
+    if not SELECT_STATEMENT_PATTERN.match(query):
+        return None
+    destination = (f'{query_dict[cdr_consts.DESTINATION_DATASET]}.'
+                   f'{query_dict[cdr_consts.DESTINATION_TABLE]}')
+    _, writes = accesses
+    if writes != {destination.lower()}:
+        return None
+    return destination
+
+
+def compose_queries(query, next_query, destination):
+    """
+    Compose two queries rewriting the same table into a single query
+
+    References to the table in the second query are replaced by a CTE named
+    after the table, holding the results of the first query.  BigQuery does
+    not materialize CTEs and evaluates the first query again for each
+    reference, so the queries are only composed if the second query reads
+    the table once and the first query is deterministic.
+
+    :param query: query whose results replace the table
+    :param next_query: query reading the table, run after the first one
+    :param destination: `dataset.table` name of the table both queries rewrite
+    :return: the composed query or None if the queries cannot be composed
+    """
+    dataset, table = destination.split('.')
+    if NONDETERMINISTIC_FUNCTION_PATTERN.search(query):
+        return None
+    next_query = _strip_leading_comments(next_query)
+    if (next_query.lower().startswith('with recursive') or re.search(
+            rf'\b{re.escape(table)}\s+as\s*\(', next_query, re.IGNORECASE)):
+        return None
+    table_reference_pattern = re.compile(
+        rf'(?<![\w.-])`?(?:[\w-]+[.:])?{re.escape(dataset)}\.'
+        rf'{re.escape(table)}`?(?![\w*-])', re.IGNORECASE)
+    next_query, count = table_reference_pattern.subn(table, next_query)
+    references, _ = get_table_accesses({cdr_consts.QUERY: next_query})
+    if count != 1 or destination.lower() in references:
+        return None
+
+    query = query.strip().rstrip(';')
+    if next_query.lower().startswith('with'):
+        return f'WITH {table} AS (\n{query}\n),\n{next_query[4:].lstrip()}'
+    return f'WITH {table} AS (\n{query}\n)\n{next_query}'
+
+
+def fuse_queries(tasks, accesses, depends_on):
+    """
+    Fuse chains of queries rewriting the same table into one query per chain
+
+    A query joins the chain of an earlier query rewriting the same table if
+    it reads that table and none of the queries between them conflicts with
+    it or is one of its explicit dependencies, and the queries can be
+    composed, see `compose_queries`.  The fused query runs in place of the
+    first query of its chain, so the results are the same as running the
+    queries one by one.
+
+    :param tasks: list of (query_dict, rule_info, query_no, query_count)
+        tuples in the order they are applied sequentially
+    :param accesses: list of (references, writes) tuples of the queries
+    :param depends_on: list whose i-th item is the set of indexes of the
+        queries the i-th query explicitly depends on
+    :return: tuple of the tasks, accesses and explicit dependencies after
+        fusing the queries.  The rule_info of fused queries lists the fused
+        rules and queries under the `fused_queries` key.
+    """
+    chains = dict()
+    chain_queries = dict()
+    open_chains = dict()
+    for j, (query_dict, _, _, _) in enumerate(tasks):
+        destination = _get_fusable_destination(query_dict, accesses[j])
+        if destination is None:
+            continue
+        head = open_chains.get(destination)
+        if head is not None and not any(k in depends_on[j] or _queries_conflict(
+                accesses[k], accesses[j])
+                                        for k in range(head + 1, j)
+                                        if k not in chains[head]):
+            fused_query = compose_queries(chain_queries[head],
+                                          query_dict[cdr_consts.QUERY],
+                                          destination)
+            if fused_query is not None:
+                chains[head].append(j)
+                chain_queries[head] = fused_query
+                continue
+        chains[j] = [j]
+        chain_queries[j] = query_dict[cdr_consts.QUERY]
+        open_chains[destination] = j
+
+    heads = {i: head for head, chain in chains.items() for i in chain}
+    new_index = dict()
+    fused_count = 0
+    for i in range(len(tasks)):
+        head = heads.get(i, i)
+        if head < i:
+            new_index[i] = new_index[head]
+        else:
+            new_index[i] = fused_count
+            fused_count += 1
+
+    fused_tasks, fused_accesses, fused_depends_on = [], [], []
+    for i, task in enumerate(tasks):
+        if heads.get(i, i) != i:
+            continue
+        chain = chains.get(i, [i])
+        if len(chain) > 1:
+            query_dict, rule_info, query_no, query_count = task
+            query_dict = dict(query_dict)
+            query_dict[cdr_consts.QUERY] = chain_queries[i]
+            rule_info = dict(rule_info)
+            rule_info[ce_consts.FUSED_QUERIES] = [
+                f'{tasks[k][1][cdr_consts.MODULE_NAME]}.'
+                f'{tasks[k][1][cdr_consts.FUNCTION_NAME]} query {tasks[k][2]}'
+                for k in chain
+            ]
+            LOGGER.info(f'Fused {len(chain)} queries rewriting '
+                        f'{query_dict[cdr_consts.DESTINATION_TABLE]}: '
+                        f'{rule_info[ce_consts.FUSED_QUERIES]}')
+            task = (query_dict, rule_info, query_no, query_count)
+        fused_tasks.append(task)
+        fused_accesses.append((set().union(*[accesses[k][0] for k in chain]),
+                               set().union(*[accesses[k][1] for k in chain])))
+        fused_depends_on.append(
+            {new_index[j] for k in chain for j in depends_on[k]} -
+            {new_index[i]})
+    return fused_tasks, fused_accesses, fused_depends_on
+
+
+def _run_scheduled_queries(client,
+                           segment,
+                           max_workers,
+                           manifest=None,
+                           fuse=False):
+    """
+    Run the queries of rules concurrently in an order respecting their dependencies
+
+    :param client: BigQuery client
+    :param segment: list of (clazz, rule_info, query_list) tuples of rules
+        in list order
+    :param max_workers: maximum number of queries to run at the same time
+    :param manifest: RunManifest recording the outcome of each query, if any
+    :param fuse: if True, fuse chains of queries rewriting the same table
+    :return: list of BigQuery job objects in the order of the queries, except
+        for the queries skipped as already completed
+    """
+    tasks, depends_on = [], []
+    rule_task_indexes = dict()
+    for clazz, rule_info, query_list in segment:
+        rule_depends_on = set()
+        if inspect.isclass(clazz):
+            query_function = rule_info[cdr_consts.QUERY_FUNCTION]
+            for depends_on_class in query_function.__self__.depends_on_classes:
+                rule_depends_on.update(
+                    rule_task_indexes.get(depends_on_class, []))
+        rule_task_indexes[clazz] = []
+        for query_no, query_dict in enumerate(query_list):
+            rule_task_indexes[clazz].append(len(tasks))
+            tasks.append((query_dict, rule_info, query_no, len(query_list)))
+            depends_on.append(rule_depends_on)
+    accesses = [get_table_accesses(query_dict) for query_dict, *_ in tasks]
+    if fuse:
+        tasks, accesses, depends_on = fuse_queries(tasks, accesses, depends_on)
+    dependencies = [
+        _get_conflicting_queries(accesses, i) | depends_on[i]
+        for i in range(len(tasks))
+    ]
+
+    LOGGER.info(f'Running {len(tasks)} queries using up to {max_workers} '
+                f'concurrent jobs')
+    jobs = task_graph.run_tasks(
+        tasks,
+        dependencies,
+        lambda task: run_query(client, *task, manifest=manifest),
+        max_workers=max_workers)
+    return [job for job in jobs if job is not None]
+
+
+def schedule_rules(client,
+                   project_id,
+                   dataset_id,
+                   sandbox_dataset_id,
+                   rules,
+                   max_workers,
+                   manifest=None,
+                   fuse=False,
+                   static_rules=(),
+                   **kwargs):
+    """
+    Run the queries of cleaning rules concurrently where their order does not matter
+
+    Queries run concurrently unless one writes to a table the other one
+    references, and a class rule's queries wait for the queries of the
+    classes it `depends_on`.  Rules which may read the dataset to generate
+    their queries, i.e. legacy functions not listed as static and classes
+    with a setup_rule, wait for all the queries of the rules before them in
+    the list.  The final dataset is thus the same as when applying rules
+    sequentially.
+
+    :param client: BigQuery client
+    :param project_id: identifies the project
+    :param dataset_id: identifies the dataset to clean
+    :param sandbox_dataset_id: identifies the sandbox dataset to store backup rows
+    :param rules: a list of cleaning rule objects/functions as tuples
+    :param max_workers: maximum number of queries to run at the same time
+    :param manifest: RunManifest recording the outcome of each query, if any
+    :param fuse: if True, fuse chains of queries rewriting the same table
+    :param static_rules: legacy cleaning functions which generate their
+        queries without reading the dataset
+    :param kwargs: keyword arguments a cleaning rule may require
+    :return: list of BigQuery job objects in sequential order
+    """
+    all_jobs = []
+    segment = []
+    for rule_index, rule in enumerate(rules):
+        clazz = rule[0]
+        if segment and not _is_prepared_independently(clazz, static_rules):
+            all_jobs.extend(
+                _run_scheduled_queries(client,
+                                       segment,
+                                       max_workers,
+                                       manifest=manifest,
+                                       fuse=fuse))
+            segment = []
+        query_function, setup_function, rule_info = infer_rule(
+            clazz, project_id, dataset_id, sandbox_dataset_id, **kwargs)
+
+        LOGGER.info(
+            f"Scheduling cleaning rule {rule_info[cdr_consts.MODULE_NAME]} "
+            f"{rule_index+1}/{len(rules)}")
+        setup_function(client)
+        segment.append((clazz, rule_info, query_function()))
+    if segment:
+        all_jobs.extend(
+            _run_scheduled_queries(client,
+                                   segment,
+                                   max_workers,
+                                   manifest=manifest,
+                                   fuse=fuse))
+    return all_jobs
+
+
 def generate_job_config(project_id, query_dict):
     """
     Generates BigQuery job_configuration object
@@ -97,53 +540,102 @@ def generate_job_config(project_id, query_dict):
     return job_config
 
 
-def run_queries(client, query_list, rule_info):
+def run_queries(client, query_list, rule_info, manifest=None):
     """
     Runs queries from the list of query_dicts
 
     :param client: BigQuery client
     :param query_list: list of query_dicts generated by a cleaning rule
     :param rule_info: contains information about the query function
+    :param manifest: RunManifest recording the outcome of each query, if any
     :return: integers indicating the number of queries that succeeded and failed
     """
     query_count = len(query_list)
-    jobs = []
-    for query_no, query_dict in enumerate(query_list):
-        try:
-            LOGGER.info(
-                ce_consts.QUERY_RUN_MESSAGE_TEMPLATE.render(
-                    query_no=query_no, query_count=query_count, **rule_info))
-            job_config = generate_job_config(client.project, query_dict)
-
-            module_short_name = rule_info[cdr_consts.MODULE_NAME].split(
-                '.')[-1][:10]
-            query_job = client.query(query=query_dict.get(cdr_consts.QUERY),
-                                     job_config=job_config,
-                                     job_id_prefix=f'{module_short_name}_')
-            jobs.append(query_job)
-            LOGGER.info(f'Running {query_job.job_id}')
-            # wait for job to complete
-            query_job.result()
-            if query_job.errors:
-                raise RuntimeError(
-                    ce_consts.FAILURE_MESSAGE_TEMPLATE.render(
-                        client.project, query_job, **rule_info, **query_dict))
-            LOGGER.info(
-                ce_consts.SUCCESS_MESSAGE_TEMPLATE.render(
-                    project_id=client.project,
-                    query_job=query_job,
-                    query_no=query_no,
-                    query_count=query_count,
-                    **rule_info))
-        except (GoogleCloudError, TOError) as exp:
-            LOGGER.exception(
+    jobs = [
+        run_query(client,
+                  query_dict,
+                  rule_info,
+                  query_no,
+                  query_count,
+                  manifest=manifest)
+        for query_no, query_dict in enumerate(query_list)
+    ]
+    return [job for job in jobs if job is not None]
+
+
+def run_query(client,
+              query_dict,
+              rule_info,
+              query_no,
+              query_count,
+              manifest=None):
+    """
+    Runs a query from a list of query_dicts and waits for it to complete
+
+    :param client: BigQuery client
+    :param query_dict: query_dict generated by a cleaning rule
+    :param rule_info: contains information about the query function
+    :param query_no: index of the query in the list of the rule
+    :param query_count: number of queries in the list of the rule
+    :param manifest: RunManifest recording the outcome of each query, if any
+    :return: the completed BigQuery job object or None if the manifest
+        records the query as completed by a previous run
+    """
+    if manifest is not None and manifest.is_completed(rule_info, query_no,
+                                                      query_dict):
+        LOGGER.info(
+            ce_consts.SKIP_MESSAGE_TEMPLATE.render(query_no=query_no,
+                                                   query_count=query_count,
+                                                   **rule_info))
+        return None
+    query_job = None
+    try:
+        LOGGER.info(
+            ce_consts.QUERY_RUN_MESSAGE_TEMPLATE.render(query_no=query_no,
+                                                        query_count=query_count,
+                                                        **rule_info))
+        job_config = generate_job_config(client.project, query_dict)
+
+        module_short_name = rule_info[cdr_consts.MODULE_NAME].split(
+            '.')[-1][:10]
+        query_job = client.query(query=query_dict.get(cdr_consts.QUERY),
+                                 job_config=job_config,
+                                 job_id_prefix=f'{module_short_name}_')
+        LOGGER.info(f'Running {query_job.job_id}')
+        # wait for job to complete
+        query_job.result()
+        if query_job.errors:
+            _record(manifest, rule_info, query_no, query_dict, query_job,
+                    ce_consts.STATUS_FAILED)
+            raise RuntimeError(
                 ce_consts.FAILURE_MESSAGE_TEMPLATE.render(
                     project_id=client.project,
+                    query_job=query_job,
                     **rule_info,
-                    **query_dict,
-                    exception=exp))
-            raise exp
-    return jobs
+                    **query_dict))
+        LOGGER.info(
+            ce_consts.SUCCESS_MESSAGE_TEMPLATE.render(project_id=client.project,
+                                                      query_job=query_job,
+                                                      query_no=query_no,
+                                                      query_count=query_count,
+                                                      **rule_info))
+    except (GoogleCloudError, TOError) as exp:
+        _record(manifest, rule_info, query_no, query_dict, query_job,
+                ce_consts.STATUS_FAILED)
+        LOGGER.exception(
+            ce_consts.FAILURE_MESSAGE_TEMPLATE.render(project_id=client.project,
+                                                      **rule_info,
+                                                      **query_dict,
+                                                      exception=exp))
+        raise exp
+    _record(manifest, rule_info, query_no, query_dict, query_job,
+            ce_consts.STATUS_DONE)
+    return query_job
+
+
+def _record(manifest, rule_info, query_no, query_dict, query_job, status):
+    if manifest is not None:
+        manifest.record(rule_info, query_no, query_dict, query_job, status)
 
 
 def get_rule_args(clazz):
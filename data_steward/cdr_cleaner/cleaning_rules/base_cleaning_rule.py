@@ -115,7 +115,10 @@ class BaseCleaningRule(AbstractBaseCleaningRule):
     """
     string_list = List[str]
     cleaning_class_list = List[AbstractBaseCleaningRule]
-    TABLE_COUNT_QUERY = ''' SELECT COALESCE(COUNT(*), 0) AS row_count FROM `{dataset}.{table}` '''
+    TABLE_COUNTS_QUERY = ''' SELECT table_id, row_count FROM `{project}.{dataset}.__TABLES__` '''
+    # set to True by rules whose setup_rule reads or loads tables, so that
+    # their queries are only generated after the earlier rules ran
+    reads_dataset_in_setup = False
 
     def __init__(self,
                  issue_numbers: string_list = None,
@@ -170,6 +173,8 @@ class BaseCleaningRule(AbstractBaseCleaningRule):
         self._issue_urls = issue_urls if issue_urls else []
         self._depends_on_classes = depends_on if depends_on else []
         self._affected_tables = affected_tables
+        # row counts of the tables of each dataset, see get_table_counts
+        self._table_counts = dict()
 
         super().__init__()
 
@@ -351,18 +356,34 @@ class BaseCleaningRule(AbstractBaseCleaningRule):
         """
         Method to get the row counts of the list of tables
 
+        The counts of all the tables of a dataset are read from its metadata
+        with a single query, without scanning the tables, and are kept until
+        clear_table_counts is called.
+
         :param dataset: dataset identifier
         :param client: big query client that has been instantiated
         :param tables: list of tables
         :return: returns a dictionary with table name as key and row count as value
                 counts_dict -> {'measurement' : 100000000, 'observation': 2000000000000}
+                tables which do not exist have a row count of 0
+        """
+        if dataset not in self._table_counts:
+            query = self.TABLE_COUNTS_QUERY.format(project=self._project_id,
+                                                   dataset=dataset)
+            self._table_counts[dataset] = {
+                row['table_id']: row['row_count']
+                for row in client.query(query).result()
+            }
+        dataset_counts = self._table_counts[dataset]
+        return {table: dataset_counts.get(table, 0) for table in tables}
+
+    def clear_table_counts(self):
+        """
+        Forget the row counts read by get_table_counts
+
+        Called once a rule's queries ran, so the counts are read again.
         """
-        counts_dict = dict()
-        for table in tables:
-            query = self.TABLE_COUNT_QUERY.format(dataset=dataset, table=table)
-            count = client.query(query).to_dataframe()
-            counts_dict[table] = count['row_count'][0]
-        return counts_dict
+        self._table_counts.clear()
 
     def validate_delete_rule(self, dataset, sandbox_dataset, sandbox_tables,
                              tables_affected, initial_counts, client):
@@ -378,10 +399,11 @@ class BaseCleaningRule(AbstractBaseCleaningRule):
         :return: returns success message when the validation is success full else
         raises a RuntimeError.
         """
-        final_row_counts = self.get_table_counts(dataset, tables_affected,
-                                                 client)
+        self.clear_table_counts()
+        final_row_counts = self.get_table_counts(client, dataset,
+                                                 tables_affected)
         sandbox_row_counts = self.get_table_counts(
-            sandbox_dataset, list(sandbox_tables.values()), client)
+            client, sandbox_dataset, list(sandbox_tables.values()))
 
         for k, v in initial_counts.items():
             if v == final_row_counts[k] + sandbox_row_counts[sandbox_tables[k]]:
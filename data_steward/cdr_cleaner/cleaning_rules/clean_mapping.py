@@ -71,6 +71,7 @@ class CleanMappingExtTables(BaseCleaningRule):
     Ensures each domain mapping table only contains records for domain tables
     that exist after the dataset has been fully cleaned.
     """
+    reads_dataset_in_setup = True
 
     def __init__(self, project_id, dataset_id, sandbox_dataset_id):
         """
@@ -244,6 +244,7 @@ WHERE NOT EXISTS
 
 
 class PpiBranching(BaseCleaningRule):
+    reads_dataset_in_setup = True
 
     def __init__(self, project_id, dataset_id, sandbox_dataset_id):
         desc = (
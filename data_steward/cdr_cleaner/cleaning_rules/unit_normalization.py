@@ -144,6 +144,7 @@ class UnitNormalization(BaseCleaningRule):
     """
     Units for labs/measurements will be normalized..
     """
+    reads_dataset_in_setup = True
 
     def __init__(self, project_id, dataset_id, sandbox_dataset_id):
         """
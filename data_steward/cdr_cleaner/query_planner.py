@@ -0,0 +1,186 @@
+"""
+Estimates how much data each query of a cleaning stage will scan.
+
+Every query a stage would run is submitted as a BigQuery dry run, which
+validates it and reports the bytes it would process without running it or
+incurring costs.  The estimates are written to a csv or json report, with the
+heaviest queries flagged, to review a stage before a production run.
+
+Queries reading tables that an earlier rule of the stage creates cannot be
+estimated before the stage runs, their dry run error is reported instead.
+"""
+# Python imports
+import csv
+import json
+import logging
+import os
+
+# Third party imports
+from google.cloud.exceptions import GoogleCloudError
+
+# Project imports
+import cdr_cleaner.clean_cdr_engine as engine
+import constants.cdr_cleaner.clean_cdr as cdr_consts
+import constants.cdr_cleaner.query_planner as planner_consts
+from utils import bq
+
+LOGGER = logging.getLogger(__name__)
+
+
+def dry_run_query(client, query_dict):
+    """
+    Get the number of bytes a query would process
+
+    :param client: BigQuery client
+    :param query_dict: dictionary for the query
+    :return: number of bytes the query would process
+    """
+    job_config = engine.generate_job_config(client.project, query_dict)
+    job_config.dry_run = True
+    job_config.use_query_cache = False
+    query_job = client.query(query=query_dict.get(cdr_consts.QUERY),
+                             job_config=job_config)
+    return query_job.total_bytes_processed
+
+
+def get_plan(client,
+             project_id,
+             dataset_id,
+             sandbox_dataset_id,
+             rules,
+             heavy_count=planner_consts.DEFAULT_HEAVY_COUNT,
+             **kwargs):
+    """
+    Dry run every query of the cleaning rules
+
+    The rules' setup is not run, so nothing is loaded or modified.
+
+    :param client: BigQuery client
+    :param project_id: identifies the project
+    :param dataset_id: identifies the dataset to clean
+    :param sandbox_dataset_id: identifies the sandbox dataset to store backup rows
+    :param rules: a list of cleaning rule objects/functions as tuples
+    :param heavy_count: number of queries processing the most bytes to flag
+    :param kwargs: keyword arguments a cleaning rule may require
+    :return: list of dictionaries describing each query in the order they run
+    """
+    plan = []
+    for rule in rules:
+        clazz = rule[0]
+        query_function, _, rule_info = engine.infer_rule(
+            clazz, project_id, dataset_id, sandbox_dataset_id, **kwargs)
+        for query_no, query_dict in enumerate(query_function()):
+            item = {
+                planner_consts.RULE: clazz.__name__,
+                planner_consts.MODULE: rule_info[cdr_consts.MODULE_NAME],
+                planner_consts.FUNCTION: rule_info[cdr_consts.FUNCTION_NAME],
+                planner_consts.QUERY_NO: query_no,
+                planner_consts.DESTINATION: None,
+                planner_consts.BYTES_PROCESSED: None,
+                planner_consts.GIGABYTES_PROCESSED: None,
+                planner_consts.HEAVY: False,
+                planner_consts.ERROR: None,
+                planner_consts.SQL: query_dict.get(cdr_consts.QUERY,
+                                                   '').strip()
+            }
+            if query_dict.get(cdr_consts.DESTINATION_TABLE) is not None:
+                item[planner_consts.DESTINATION] = (
+                    f'{query_dict[cdr_consts.DESTINATION_DATASET]}.'
+                    f'{query_dict[cdr_consts.DESTINATION_TABLE]}')
+            try:
+                total_bytes = dry_run_query(client, query_dict)
+            except GoogleCloudError as exp:
+                LOGGER.warning(f'Unable to dry run query {query_no} of '
+                               f'{clazz.__name__}: {exp}')
+                item[planner_consts.ERROR] = str(exp)
+            else:
+                item[planner_consts.BYTES_PROCESSED] = total_bytes
+                item[planner_consts.GIGABYTES_PROCESSED] = round(
+                    total_bytes / 2**30, 3)
+            plan.append(item)
+
+    estimated = [
+        item for item in plan
+        if item[planner_consts.BYTES_PROCESSED] is not None
+    ]
+    estimated.sort(key=lambda item: item[planner_consts.BYTES_PROCESSED],
+                   reverse=True)
+    for item in estimated[:heavy_count]:
+        item[planner_consts.HEAVY] = True
+    return plan
+
+
+def write_plan(output_filepath, plan):
+    """
+    Write a plan to a csv or json file, depending on the file extension
+
+    :param output_filepath: the filepath of a csv or json file
+    :param plan: list of dictionaries describing each query
+    :raises RuntimeError: if the file is neither a csv nor a json file
+    """
+    if output_filepath.endswith(planner_consts.CSV):
+        with open(output_filepath, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile,
+                                    planner_consts.REPORT_FIELDS,
+                                    delimiter=',',
+                                    lineterminator=os.linesep,
+                                    quoting=csv.QUOTE_ALL)
+            writer.writeheader()
+            for item in plan:
+                writer.writerow(item)
+    elif output_filepath.endswith(planner_consts.JSON):
+        with open(output_filepath, 'w') as json_file:
+            json.dump(plan, json_file, indent=2)
+    else:
+        raise RuntimeError(
+            f'This file is neither a csv nor a json file: {output_filepath}.')
+
+
+def log_plan(plan):
+    """
+    Log the total bytes a plan processes and its heaviest queries
+
+    :param plan: list of dictionaries describing each query
+    """
+    total_bytes = sum(
+        item[planner_consts.BYTES_PROCESSED] or 0 for item in plan)
+    failed = [item for item in plan if item[planner_consts.ERROR] is not None]
+    LOGGER.info(f'{len(plan)} queries would process {total_bytes} bytes, '
+                f'{len(failed)} queries could not be estimated')
+    for item in plan:
+        if item[planner_consts.HEAVY]:
+            LOGGER.info(f'{item[planner_consts.RULE]} query '
+                        f'{item[planner_consts.QUERY_NO]} would process '
+                        f'{item[planner_consts.GIGABYTES_PROCESSED]} GiB')
+
+
+def plan_dataset(project_id,
+                 dataset_id,
+                 sandbox_dataset_id,
+                 rules,
+                 output_filepath,
+                 heavy_count=planner_consts.DEFAULT_HEAVY_COUNT,
+                 **kwargs):
+    """
+    Dry run the cleaning rules on a dataset and write a report of their costs
+
+    :param project_id: identifies the project
+    :param dataset_id: identifies the dataset to clean
+    :param sandbox_dataset_id: identifies the sandbox dataset to store backup rows
+    :param rules: a list of cleaning rule objects/functions as tuples
+    :param output_filepath: the filepath of a csv or json file
+    :param heavy_count: number of queries processing the most bytes to flag
+    :param kwargs: keyword arguments a cleaning rule may require
+    :return: list of dictionaries describing each query
+    """
+    client = bq.get_client(project_id=project_id)
+    plan = get_plan(client,
+                    project_id,
+                    dataset_id,
+                    sandbox_dataset_id,
+                    rules,
+                    heavy_count=heavy_count,
+                    **kwargs)
+    log_plan(plan)
+    write_plan(output_filepath, plan)
+    return plan
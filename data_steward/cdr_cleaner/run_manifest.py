@@ -0,0 +1,142 @@
+"""
+Keeps track of the queries a cleaning run completed so a failed run can resume.
+
+Every query the engine runs is recorded in a JSON lines manifest with the rule
+which generated it, its index in the rule's query list, the job id, its
+destination, a hash of its SQL and whether it succeeded.  A resumed run skips
+the queries recorded as done against the same dataset instead of repeating
+them.
+"""
+# Python imports
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+# Project imports
+from constants.cdr_cleaner import clean_cdr as cdr_consts
+from constants.cdr_cleaner import clean_cdr_engine as ce_consts
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_manifest_path(project_id, dataset_id):
+    """
+    Get the default manifest location of a cleaning run
+
+    :param project_id: identifies the project
+    :param dataset_id: identifies the dataset to clean
+    :return: path of the manifest file
+    """
+    return ce_consts.MANIFEST_FILENAME.format(project_id=project_id,
+                                              dataset_id=dataset_id)
+
+
+def get_sql_hash(query_dict):
+    """
+    Get a hash of the SQL of a query
+
+    :param query_dict: dictionary for the query
+    :return: hex digest of the SQL
+    """
+    query = query_dict.get(cdr_consts.QUERY, '')
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def get_destination(query_dict):
+    """
+    Get the destination table of a query, if any
+
+    :param query_dict: dictionary for the query
+    :return: `dataset.table` name of the destination or None
+    """
+    if query_dict.get(cdr_consts.DESTINATION_TABLE) is None:
+        return None
+    return (f'{query_dict[cdr_consts.DESTINATION_DATASET]}.'
+            f'{query_dict[cdr_consts.DESTINATION_TABLE]}')
+
+
+class RunManifest:
+    """
+    Records the outcome of the queries of a cleaning run in a local file
+    """
+
+    def __init__(self, path, project_id, dataset_id, resume=False):
+        """
+        Start a new manifest or continue the one of a previous run
+
+        :param path: path of the manifest file
+        :param project_id: identifies the project
+        :param dataset_id: identifies the dataset to clean
+        :param resume: if True, the queries completed by a previous run on
+            the same dataset are skipped, otherwise the manifest is restarted
+        """
+        self.path = path
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self._lock = threading.Lock()
+        self._completed = set()
+        if resume and os.path.exists(path):
+            with open(path) as manifest_file:
+                for line in manifest_file:
+                    record = json.loads(line)
+                    if (record[ce_consts.MANIFEST_STATUS]
+                            == ce_consts.STATUS_DONE and
+                            record[ce_consts.MANIFEST_PROJECT_ID] == project_id
+                            and record[ce_consts.MANIFEST_DATASET_ID]
+                            == dataset_id):
+                        self._completed.add(self._get_key(record))
+            LOGGER.info(f'Resuming from {len(self._completed)} completed '
+                        f'queries recorded in {path}')
+        else:
+            open(path, 'w').close()
+
+    @staticmethod
+    def _get_key(record):
+        return (record[ce_consts.MANIFEST_RULE],
+                record[ce_consts.MANIFEST_QUERY_NO],
+                record[ce_consts.MANIFEST_DESTINATION],
+                record[ce_consts.MANIFEST_SQL_HASH])
+
+    def _get_record(self, rule_info, query_no, query_dict):
+        return {
+            ce_consts.MANIFEST_PROJECT_ID: self.project_id,
+            ce_consts.MANIFEST_DATASET_ID: self.dataset_id,
+            ce_consts.MANIFEST_RULE: f'{rule_info[cdr_consts.MODULE_NAME]}.'
+                                     f'{rule_info[cdr_consts.FUNCTION_NAME]}',
+            ce_consts.MANIFEST_QUERY_NO: query_no,
+            ce_consts.MANIFEST_DESTINATION: get_destination(query_dict),
+            ce_consts.MANIFEST_SQL_HASH: get_sql_hash(query_dict)
+        }
+
+    def is_completed(self, rule_info, query_no, query_dict):
+        """
+        Determine if a previous run completed the same query
+
+        :param rule_info: contains information about the query function
+        :param query_no: index of the query in the list of the rule
+        :param query_dict: dictionary for the query
+        :return: True if the query can be skipped, False otherwise
+        """
+        record = self._get_record(rule_info, query_no, query_dict)
+        return self._get_key(record) in self._completed
+
+    def record(self, rule_info, query_no, query_dict, query_job, status):
+        """
+        Append the outcome of a query to the manifest
+
+        :param rule_info: contains information about the query function
+        :param query_no: index of the query in the list of the rule
+        :param query_dict: dictionary for the query
+        :param query_job: BigQuery job of the query, if it was created
+        :param status: STATUS_DONE or STATUS_FAILED
+        """
+        record = self._get_record(rule_info, query_no, query_dict)
+        record[ce_consts.MANIFEST_JOB_ID] = getattr(query_job, 'job_id', None)
+        record[ce_consts.MANIFEST_STATUS] = status
+        record[ce_consts.MANIFEST_TIMESTAMP] = datetime.utcnow().isoformat()
+        with self._lock:
+            with open(self.path, 'a') as manifest_file:
+                manifest_file.write(json.dumps(record) + '\n')
@@ -2,6 +2,8 @@
 SOCKET_TIMEOUT = 600000
 BQ_DEFAULT_RETRY_COUNT = 10
 MAX_POLL_INTERVAL = 500
+# Maximum number of calls in a single batch request (API limit is 1000)
+BATCH_REQUEST_MAX_SIZE = 100
 # Maximum results returned by list_tables (API has a low default value)
 LIST_TABLES_MAX_RESULTS = 10000
 DATE_FORMAT = '%Y%m%d'
@@ -8,6 +8,7 @@ PROJECT_ID = 'project_id'
 DATASET_ID = 'dataset_id'
 SANDBOX_DATASET_ID = 'sandbox_dataset_id'
 CLEAN_ENGINE_REQUIRED_PARAMS = [PROJECT_ID, DATASET_ID, SANDBOX_DATASET_ID]
+FUSED_QUERIES = 'fused_queries'
 
 QUERY_RUN_MESSAGE = '''
 Clean rule {{module_name}}.{{function_name}} query {{query_no+1}}/{{query_count}}"
@@ -21,6 +22,12 @@ Successfully executed query {{query_no+1}}/{{query_count}} for {{module_name}} w
 
 SUCCESS_MESSAGE_TEMPLATE = JINJA_ENV.from_string(SUCCESS_MESSAGE)
 
+SKIP_MESSAGE = '''
+Skipping query {{query_no+1}}/{{query_count}} for {{module_name}} completed by a previous run
+'''
+
+SKIP_MESSAGE_TEMPLATE = JINJA_ENV.from_string(SKIP_MESSAGE)
+
 FAILURE_MESSAGE = """
 The failed query was generated from the below module:
     module_name={{module_name}}
@@ -51,3 +58,17 @@ The failed query ran with the following configuration:
 """
 
 FAILURE_MESSAGE_TEMPLATE = JINJA_ENV.from_string(FAILURE_MESSAGE)
+
+MANIFEST_FILENAME = os.path.join(tempfile.gettempdir(),
+                                 '{project_id}.{dataset_id}.manifest.jsonl')
+MANIFEST_PROJECT_ID = 'project_id'
+MANIFEST_DATASET_ID = 'dataset_id'
+MANIFEST_RULE = 'rule'
+MANIFEST_QUERY_NO = 'query_no'
+MANIFEST_JOB_ID = 'job_id'
+MANIFEST_DESTINATION = 'destination'
+MANIFEST_SQL_HASH = 'sql_hash'
+MANIFEST_STATUS = 'status'
+MANIFEST_TIMESTAMP = 'timestamp'
+STATUS_DONE = 'DONE'
+STATUS_FAILED = 'FAILED'
@@ -0,0 +1,23 @@
+"""
+Constants for the dry-run planner of cleaning stages.
+"""
+RULE = 'rule'
+MODULE = 'module'
+FUNCTION = 'function'
+QUERY_NO = 'query_no'
+DESTINATION = 'destination'
+BYTES_PROCESSED = 'total_bytes_processed'
+GIGABYTES_PROCESSED = 'total_gigabytes_processed'
+HEAVY = 'heavy'
+ERROR = 'error'
+SQL = 'sql'
+
+REPORT_FIELDS = [
+    RULE, MODULE, FUNCTION, QUERY_NO, DESTINATION, BYTES_PROCESSED,
+    GIGABYTES_PROCESSED, HEAVY, ERROR, SQL
+]
+
+# number of queries flagged as the heaviest of a stage
+DEFAULT_HEAVY_COUNT = 10
+CSV = '.csv'
+JSON = '.json'
@@ -1 +1,6 @@
 MAX_AGE = 89
+
+# polling intervals and timeout, in seconds, when waiting for BigQuery jobs
+JOB_POLL_INITIAL_SECONDS = 1
+JOB_POLL_MAX_SECONDS = 30
+JOB_TIMEOUT_SECONDS = 6 * 60 * 60
@@ -21,5 +21,17 @@ SELECT *
 FROM `{{project_id}}.{{dataset_id}}.INFORMATION_SCHEMA.COLUMNS`
 """
 
+# Timing counters of compiled templates
+COMPILES = 'compiles'
+COMPILE_SECONDS = 'compile_seconds'
+CACHE_HITS = 'cache_hits'
+RENDERS = 'renders'
+RENDER_SECONDS = 'render_seconds'
+TEMPLATE_STAT_KEYS = [
+    COMPILES, COMPILE_SECONDS, CACHE_HITS, RENDERS, RENDER_SECONDS
+]
+# maximum number of unnamed templates kept compiled, least recently used first
+MAX_UNNAMED_TEMPLATES = 256
+
 TABLE_NAME = 'table_name'
 COLUMN_NAME = 'column_name'
@@ -10,6 +10,9 @@ LOCATION = 'location'
 LOCATION_ID = 'location_id'
 FACT_RELATIONSHIP = 'fact_relationship'
 
+# Maximum number of tables created, mapped or loaded at the same time
+DEFAULT_MAX_WORKERS = 10
+
 CONCEPT_CONSTANT_FACTOR = 1000000000000
 
 # Starting factor to create ID space for person to observation mapped record
@@ -28,3 +31,34 @@ GENDER_CONSTANT_FACTOR = 1 * CONCEPT_CONSTANT_FACTOR
 RACE_CONSTANT_FACTOR = 2 * CONCEPT_CONSTANT_FACTOR
 DOB_CONSTANT_FACTOR = 3 * CONCEPT_CONSTANT_FACTOR
 ETHNICITY_CONSTANT_FACTOR = 4 * CONCEPT_CONSTANT_FACTOR
+
+# Incremental union state, one row per submitted HPO table
+UNION_STATE_TABLE = '_union_state'
+HPO_ID = 'hpo_id'
+TABLE_NAME = 'table_name'
+ID_OFFSET = 'id_offset'
+LAST_MODIFIED_TIME = 'last_modified_time'
+ROW_COUNT = 'row_count'
+
+TABLE_FINGERPRINTS_QUERY = '''
+SELECT table_id, last_modified_time, row_count
+FROM `{project_id}.{dataset_id}.__TABLES__`
+'''
+
+SAVE_UNION_STATE_QUERY = '''
+SELECT *
+FROM UNNEST(ARRAY<STRUCT<hpo_id STRING, table_name STRING, id_offset INT64,
+                         last_modified_time INT64, row_count INT64>>[
+  {rows}
+])
+'''
+
+DELETE_HPO_MAPPING_QUERY = '''
+DELETE FROM `{project_id}.{dataset_id}.{mapping_table}`
+WHERE src_hpo_id IN UNNEST({hpo_ids})
+'''
+
+DELETE_ID_RANGES_QUERY = '''
+DELETE FROM `{project_id}.{dataset_id}.{table_id}`
+WHERE {id_ranges}
+'''
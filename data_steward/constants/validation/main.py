@@ -205,3 +205,19 @@ REASON = 'reason'
 
 FOLDER_NAME_REGEX = r'\d{4}-\d{2}-\d{2}-v\d+'
 FOLDER_NAMING_CONVENTION = 'YYYY-MM-DD-vN/'
+
+# Concurrent validation of all HPO sites
+VALIDATION_MAX_WORKERS = 'VALIDATION_MAX_WORKERS'
+DEFAULT_VALIDATION_MAX_WORKERS = 4
+HPO_STATUS_DONE = 'done'
+HPO_STATUS_FAILED = 'failed'
+
+# Concurrent achilles analyses of an HPO site
+ACHILLES_MAX_WORKERS = 'ACHILLES_MAX_WORKERS'
+DEFAULT_ACHILLES_MAX_WORKERS = 8
+# maximum number of export reports of an HPO site to upload at the same time
+EXPORT_UPLOAD_MAX_WORKERS = 4
+# set to 'true' to combine the analyses of each CDM table into one query
+ACHILLES_SINGLE_PASS = 'ACHILLES_SINGLE_PASS'
+# set to 'true' to only union again the HPOs whose submissions changed
+EHR_UNION_INCREMENTAL = 'EHR_UNION_INCREMENTAL'
@@ -2,12 +2,16 @@
 https://github.com/all-of-us/raw-data-repository/blob/1.60.6/rdr_service/services/gcp_logging.py. This custom handler
 groups all the log messages generated within the same http request into an operation, this grouping mechanism allows
 us to quickly navigate to the relevant log message. """
+import atexit
 import collections
 import json
 import logging
 import os
+import queue
 import string
+import sys
 import threading
+import time
 import app_identity
 from datetime import datetime, timezone
 from enum import IntEnum
@@ -31,6 +35,14 @@ import curation_logging.gcp_request_log_pb2  # pylint: disable=unused-import
 
 # How many log lines should be batched before pushing them to StackDriver.
 _LOG_BUFFER_SIZE = 100
+# How many log entries may wait to be shipped to StackDriver.
+_LOG_QUEUE_SIZE = 1000
+# How many log entries are shipped to StackDriver in a single call.
+_LOG_BATCH_SIZE = 50
+# How long to wait for room in a full queue before dropping a log entry.
+_LOG_QUEUE_TIMEOUT = 0.5
+# How long to wait for queued log entries to be shipped at shutdown.
+_LOG_SHUTDOWN_TIMEOUT = 10
 
 GAE_LOGGING_MODULE_ID = 'app-' + os.environ.get('GAE_SERVICE', 'default')
 GAE_LOGGING_VERSION_ID = os.environ.get('GAE_VERSION', 'devel')
@@ -215,20 +227,163 @@ def update_long_operation(request_log_id, op_status):
     return operation_pb2
 
 
+class LogShipper(object):
+    """
+    Ships log entries to google stack driver logging from a background thread.  Thread safe.
+    Log entries of all threads are queued and written in batches of up to `batch_size` entries, so
+    requests do not wait on StackDriver.  When the queue is full, a thread waits up to `put_timeout`
+    seconds for room and then drops its log entry.
+    """
+
+    def __init__(self,
+                 logging_client=None,
+                 queue_size=_LOG_QUEUE_SIZE,
+                 batch_size=_LOG_BATCH_SIZE,
+                 put_timeout=_LOG_QUEUE_TIMEOUT):
+        """
+        :param logging_client: client used to write log entries, a LoggingServiceV2Client by default
+        :param queue_size: maximum number of log entries waiting to be shipped
+        :param batch_size: maximum number of log entries shipped in a single call
+        :param put_timeout: seconds to wait for room in a full queue before dropping a log entry
+        """
+        self._logging_client = logging_client
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._put_timeout = put_timeout
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dropped_count = 0
+
+    def _start(self):
+        """
+        Start the worker thread, again if the process was forked since it started.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._logging_client is None:
+                    self._logging_client = gcp_logging_v2.LoggingServiceV2Client(
+                    )
+                self._thread = threading.Thread(target=self._run,
+                                                name='LogShipper',
+                                                daemon=True)
+                self._thread.start()
+
+    def submit(self, log_entry_pb2, log_name):
+        """
+        Queue a log entry to be written to StackDriver.
+        :param log_entry_pb2: LogEntry pb2 object
+        :param log_name: name of the log to write the entry to
+        :return: True if the entry was queued, False if it was dropped
+        """
+        self._start()
+        # the worker thread cannot wait for itself to make room
+        timeout = 0 if threading.current_thread(
+        ) is self._thread else self._put_timeout
+        try:
+            self._queue.put((log_entry_pb2, log_name), timeout=timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped_count += 1
+            return False
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        """
+        Write a batch of log entries, with one call per log name.
+        :param batch: list of (log_entry_pb2, log_name) tuples
+        """
+        log_entries = collections.OrderedDict()
+        for log_entry_pb2, log_name in batch:
+            log_entries.setdefault(log_name, []).append(log_entry_pb2)
+        for log_name, entries in log_entries.items():
+            # pylint: disable=broad-except
+            try:
+                self._logging_client.write_log_entries(entries,
+                                                       log_name=log_name)
+            except Exception as e:
+                # logging the error would be shipped through this thread again
+                print(f'Failed to write {len(entries)} log entries: {e}',
+                      file=sys.stderr)
+
+    def flush(self, timeout=None):
+        """
+        Wait for the queued log entries to be shipped.
+        :param timeout: maximum number of seconds to wait, no limit by default
+        :return: True if all queued log entries were shipped
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic(
+                )
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=_LOG_SHUTDOWN_TIMEOUT):
+        """
+        Ship the queued log entries before the process exits.
+        :param timeout: maximum number of seconds to wait
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.flush(timeout)
+        if self.dropped_count:
+            print(f'Dropped {self.dropped_count} log entries', file=sys.stderr)
+
+
+_log_shipper = None
+_log_shipper_lock = threading.Lock()
+
+
+def get_log_shipper() -> LogShipper:
+    """
+    Return the LogShipper object shared by all threads, flushed when the process exits.
+    :return: LogShipper object
+    """
+    global _log_shipper
+    with _log_shipper_lock:
+        if _log_shipper is None:
+            _log_shipper = LogShipper()
+            atexit.register(_log_shipper.shutdown)
+        return _log_shipper
+
+
 class GCPStackDriverLogger(object):
     """
     Sends log records to google stack driver logging.  Each thread needs its own copy of this object.
     Buffers up to `buffer_size` log records into one ProtoBuffer to be submitted.
     """
 
-    def __init__(self, buffer_size=_LOG_BUFFER_SIZE):
+    def __init__(self, buffer_size=_LOG_BUFFER_SIZE, shipper=None):
+        """
+        :param buffer_size: number of log records to buffer before submitting them
+        :param shipper: LogShipper which writes the log entries in the background, if any.
+            Log entries are written on the calling thread otherwise.
+        """
 
         self._buffer_size = buffer_size
         self._buffer = collections.deque()
 
         self._reset()
 
-        self._logging_client = gcp_logging_v2.LoggingServiceV2Client()
+        self._shipper = shipper
+        self._logging_client = None if shipper else gcp_logging_v2.LoggingServiceV2Client(
+        )
         self._operation_pb2 = None
 
         # Used to determine how long a request took.
@@ -429,10 +584,13 @@ class GCPStackDriverLogger(object):
         log_entry_pb2 = gcp_logging_v2.types.log_entry_pb2.LogEntry(
             **log_entry_pb2_args)
 
-        self._logging_client.write_log_entries(
-            [log_entry_pb2],
-            log_name=LOG_NAME_TEMPLATE.format(
-                project_id=app_identity.get_application_id()))
+        log_name = LOG_NAME_TEMPLATE.format(
+            project_id=app_identity.get_application_id())
+        if self._shipper:
+            self._shipper.submit(log_entry_pb2, log_name)
+        else:
+            self._logging_client.write_log_entries([log_entry_pb2],
+                                                   log_name=log_name)
 
 
 def get_gcp_logger() -> GCPStackDriverLogger:
@@ -446,7 +604,7 @@ def get_gcp_logger() -> GCPStackDriverLogger:
 
     # We may need to initialize the logger for this thread.
     if 'GAE_ENV' in os.environ:
-        _logger = GCPStackDriverLogger()
+        _logger = GCPStackDriverLogger(shipper=get_log_shipper())
         setattr(_thread_store, 'logger', _logger)
         return _logger
 
@@ -510,3 +668,12 @@ def flush_request_logs():
     _logger = get_gcp_logger()
     if _logger:
         _logger.finalize(_request=request)
+
+
+def flush_thread_logs():
+    """
+    Flush any pending log records of a worker thread, outside of a request.
+    """
+    _logger = get_gcp_logger()
+    if _logger:
+        _logger.finalize()
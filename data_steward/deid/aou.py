@@ -76,6 +76,7 @@ DESIGN:
 import json
 import logging
 import os
+import threading
 import time
 from copy import copy
 from datetime import datetime
@@ -89,14 +90,48 @@ from google.oauth2 import service_account
 # Project imports
 import bq_utils
 import constants.bq_utils as bq_consts
-from constants.deid.deid import MAX_AGE
+from constants.deid.deid import (MAX_AGE, JOB_POLL_INITIAL_SECONDS,
+                                 JOB_POLL_MAX_SECONDS, JOB_TIMEOUT_SECONDS)
 from deid.parser import parse_args
 from deid.press import Press
 from resources import DEID_PATH
 from tools.concept_ids_suppression import get_all_concept_ids
+from utils.bq import JINJA_ENV
 
 LOGGER = logging.getLogger(__name__)
 
+CREATE_RESPONSE_MAP_QUERY = JINJA_ENV.from_string("""
+CREATE TABLE IF NOT EXISTS `{{map_table}}` (
+  questionnaire_response_id INT64,
+  research_response_id INT64
+)
+""")
+
+APPEND_RESPONSE_MAP_QUERY = JINJA_ENV.from_string("""
+-- Every unmapped response gets its own slot of 10 identifiers above the --
+-- identifiers in use and a random identifier within its slot.  Slots are --
+-- assigned in a random order. --
+INSERT INTO `{{map_table}}` (questionnaire_response_id, research_response_id)
+SELECT
+  questionnaire_response_id,
+  start_id + 10 * (ROW_NUMBER() OVER (ORDER BY RAND()) - 1)
+    + CAST(FLOOR(10 * RAND()) AS INT64) AS research_response_id
+FROM (
+  SELECT DISTINCT o.questionnaire_response_id
+  FROM `{{input_dataset}}.observation` AS o
+  WHERE o.questionnaire_response_id IS NOT NULL
+  AND NOT EXISTS (
+    SELECT 1
+    FROM `{{map_table}}` AS m
+    WHERE m.questionnaire_response_id = o.questionnaire_response_id)
+)
+CROSS JOIN (
+  SELECT GREATEST(IFNULL(MAX(research_response_id) + 1, {{lower_bound}}),
+    {{lower_bound}}) AS start_id
+  FROM `{{map_table}}`
+)
+""")
+
 
 def milliseconds_since_epoch():
     """
@@ -251,16 +286,58 @@ def create_concept_id_lookup_table(input_dataset, credentials):
     data.to_gbq(lookup_tablename, credentials=credentials, if_exists='replace')
 
 
+class RunContext(object):
+    """
+    State shared by the presses of a de-identification run.
+
+    The lookup tables of the input dataset, the age check of the _deid_map
+    table and the output dataset only need to be set up once per run, rather
+    than once per table.  The context also holds the credentials and the
+    BigQuery client used by every press.
+    """
+
+    def __init__(self, private_key):
+        """
+        :param private_key:  path to the service account file
+        """
+        self.private_key = private_key
+        self.credentials = service_account.Credentials.from_service_account_file(
+            private_key)
+        self.client = bq.Client.from_service_account_json(private_key)
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def run_once(self, key, setup):
+        """
+        Run a setup step unless it already ran in this context.
+
+        :param key:  identifies the setup step
+        :param setup:  callable running the setup step
+        :return:  the value returned by the first successful run of the step
+        """
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = setup()
+            return self._results[key]
+
+
 class AOU(Press):
 
     def __init__(self, **args):
         args['store'] = 'bigquery'
         Press.__init__(self, **args)
         self.private_key = args.get('private_key', '')
-        self.credentials = service_account.Credentials.from_service_account_file(
-            self.private_key)
+        self.context = args.get('context')
+        if self.context is not None:
+            self.credentials = self.context.credentials
+        else:
+            self.credentials = service_account.Credentials.from_service_account_file(
+                self.private_key)
         self.partition = args.get('cluster', False)
         self.priority = args.get('interactive', 'BATCH')
+        self.job_timeout = args.get('job_timeout', JOB_TIMEOUT_SECONDS)
+        self.map_responses_in_warehouse = args.get('map_responses_in_warehouse',
+                                                   False)
 
         if 'shift' in self.deid_rules:
             #
@@ -273,6 +350,28 @@ class AOU(Press):
                 json.dumps(self.deid_rules['shift']).replace(
                     ":SHIFT", shift_days))
 
+    def run_once(self, key, setup):
+        """
+        Run a setup step once per run if the press is part of a run context.
+
+        :param key:  identifies the setup step within the run
+        :param setup:  callable running the setup step
+        :return:  the value returned by the setup step
+        """
+        if self.context is None:
+            return setup()
+        return self.context.run_once(key, setup)
+
+    def get_client(self):
+        """
+        Get the BigQuery client of the run, or a new one if there is no run.
+
+        :return:  a BigQuery client authenticated with the service account
+        """
+        if self.context is None:
+            return bq.Client.from_service_account_json(self.private_key)
+        return self.context.client
+
     def initialize(self, **args):
         Press.initialize(self, **args)
         LOGGER.info(f"BEGINNING de-identification on table:\t{self.tablename}")
@@ -280,19 +379,40 @@ class AOU(Press):
         age_limit = args.get('age_limit', MAX_AGE)
         LOGGER.info(f"Using participant age limit of {age_limit}")
 
-        million = 1000000
-        map_tablename = self.idataset + "._deid_map"
-
-        map_table = pd.DataFrame()
-
         # Create concept_id lookup table for suppressions
-        create_concept_id_lookup_table(self.idataset, self.credentials)
+        self.run_once(('concept_id_lookup', self.idataset),
+                      lambda: create_concept_id_lookup_table(
+                          self.idataset, self.credentials))
 
         # only need to create these tables deidentifying the observation table
         if 'observation' in self.get_tablename().lower().split('.'):
-            create_allowed_states_table(self.idataset, self.credentials)
+            self.run_once(('observation_lookups', self.idataset),
+                          self.create_observation_lookup_tables)
+
+        return self.run_once(('age_limit', self.idataset, age_limit),
+                             lambda: self.check_age_limit(age_limit))
+
+    def create_observation_lookup_tables(self):
+        """
+        Create the lookup tables used to de-identify the observation table.
+        """
+        million = 1000000
+        create_allowed_states_table(self.idataset, self.credentials)
+        if self.map_responses_in_warehouse:
+            self.append_questionnaire_response_ids(million)
+        else:
             self.map_questionnaire_response_ids(million)
-            create_person_id_src_hpo_map(self.idataset, self.credentials)
+        create_person_id_src_hpo_map(self.idataset, self.credentials)
+
+    def check_age_limit(self, age_limit):
+        """
+        Check the _deid_map table only contains participants within age limits.
+
+        :param age_limit:  participants must be younger than this age
+        :return:  True if age eligible participants are mapped and no age
+            ineligible participant is mapped, False otherwise
+        """
+        map_tablename = self.idataset + "._deid_map"
 
         # ensure mapping table only contains participants within age limits
         sql = (f"SELECT DISTINCT p.person_id, "
@@ -326,6 +446,29 @@ class AOU(Press):
         return eligible_person_table.shape[
             0] > 0 and ineligible_person_table.shape[0] < 1
 
+    def append_questionnaire_response_ids(self, lower_bound):
+        """
+        Map unmapped questionnaire response ids without leaving BigQuery.
+
+        Responses already in the mapping table keep their identifiers.  Only
+        responses missing from it are assigned new random identifiers, above
+        the identifiers in use, and appended to it.
+
+        :param lower_bound:  The smallest number that may be used as an identifier.
+        """
+        map_tablename = self.idataset + "._deid_questionnaire_response_map"
+        client = self.get_client()
+        for query in [
+                CREATE_RESPONSE_MAP_QUERY.render(map_table=map_tablename),
+                APPEND_RESPONSE_MAP_QUERY.render(map_table=map_tablename,
+                                                 input_dataset=self.idataset,
+                                                 lower_bound=lower_bound)
+        ]:
+            job = client.query(query)
+            self.wait(client, job.job_id)
+        LOGGER.info(f"appended unmapped questionnaire response ids to "
+                    f"{map_tablename}")
+
     def map_questionnaire_response_ids(self, lower_bound):
         """
         Create a random mapping table for questionnaire response ids.
@@ -570,7 +713,32 @@ class AOU(Press):
         self._add_compute_rules(columns)
         self._add_dml_statements_rules(columns)
 
-    def submit(self, sql, create, dml=None):
+    def submit_statements(self, sql, dml_sql):
+        """
+        Submit the statements creating a de-identified table.
+
+        The first statement creates the table.  The remaining statements only
+        append to the table, so they are submitted together and run
+        concurrently.  DML statements run one after the other once all
+        records were appended.
+
+        :param sql:  list of statements selecting the de-identified records
+        :param dml_sql:  list of DML statements to run on the output table
+        """
+        if sql:
+            self.submit(sql[0], True)
+
+        job_ids = [
+            self.submit(statement, False, wait=False) for statement in sql[1:]
+        ]
+        job_ids = [job_id for job_id in job_ids if job_id is not None]
+        if job_ids:
+            self.wait_for_jobs(self.get_client(), job_ids)
+
+        for statement in dml_sql:
+            self.submit(statement, False, dml=True)
+
+    def submit(self, sql, create, dml=None, wait=True):
         """
         Submit the sql query to create a de-identified table.
 
@@ -578,18 +746,17 @@ class AOU(Press):
         :param create: a flag to identify if this query should create a new
             table or append to an existing table.
         :param dml:  boolean flag identifying if a statement is a dml statement
+        :param wait:  boolean flag identifying if the query must complete
+            before returning
+        :return:  the id of the submitted job, or None if the dry-run failed
         """
         dml = False if dml is None else dml
         table_name = self.get_tablename()
-        client = bq.Client.from_service_account_json(self.private_key)
+        client = self.get_client()
         #
         # Let's make sure the out dataset exists
-        datasets = list(client.list_datasets())
-        found = np.sum(
-            [1 for dataset in datasets if dataset.dataset_id == self.odataset])
-        if not found:
-            dataset = bq.Dataset(client.dataset(self.odataset))
-            client.create_dataset(dataset)
+        self.run_once(('output_dataset', self.odataset),
+                      lambda: self.create_output_dataset(client))
 
         # create the output table
         if create:
@@ -653,7 +820,23 @@ class AOU(Press):
                 LOGGER.info(
                     f"submitted a bigquery job for table:\t{table_name}\t\t"
                     f"status:\t'pending'\t\tvalue:\t{response.job_id}")
-                self.wait(client, response.job_id)
+                if wait:
+                    self.wait(client, response.job_id)
+                return response.job_id
+        return None
+
+    def create_output_dataset(self, client):
+        """
+        Create the output dataset if it does not exist.
+
+        :param client:  The BigQuery client object.
+        """
+        datasets = list(client.list_datasets())
+        found = np.sum(
+            [1 for dataset in datasets if dataset.dataset_id == self.odataset])
+        if not found:
+            dataset = bq.Dataset(client.dataset(self.odataset))
+            client.create_dataset(dataset)
 
     def wait(self, client, job_id):
         """
@@ -662,19 +845,74 @@ class AOU(Press):
         :param client:  The BigQuery client object.
         :param job_id:  job_id to verify finishes.
         """
-        LOGGER.info(
-            f"sleeping for table:\t{self.get_tablename()}\t\tjob_id:\t{job_id}")
-        status = 'NONE'
+        self.wait_for_jobs(client, [job_id])
 
-        while True:
-            status = client.get_job(job_id).state
+    def wait_for_jobs(self, client, job_ids):
+        """
+        Wait for queries to finish executing.
+
+        Jobs are polled at intervals doubling from JOB_POLL_INITIAL_SECONDS up
+        to JOB_POLL_MAX_SECONDS, so short jobs return quickly and long jobs
+        are not polled needlessly.
+
+        :param client:  The BigQuery client object.
+        :param job_ids:  list of job_ids to verify finish.
+        :raises BigQueryJobWaitError: if a job failed, or if the jobs did not
+            all finish within the job timeout of the press
+        """
+        LOGGER.info(f"sleeping for table:\t{self.get_tablename()}\t\t"
+                    f"job_ids:\t{', '.join(job_ids)}")
+        deadline = time.monotonic() + self.job_timeout
+        interval = JOB_POLL_INITIAL_SECONDS
+        pending = list(job_ids)
 
-            if status == 'DONE':
+        while True:
+            incomplete = []
+            for job_id in pending:
+                job = client.get_job(job_id)
+                if job.state != 'DONE':
+                    incomplete.append(job_id)
+                elif job.error_result:
+                    raise bq_utils.BigQueryJobWaitError([job_id],
+                                                        job.error_result.get(
+                                                            'message', ''))
+            pending = incomplete
+            if not pending:
                 break
-            else:
-                time.sleep(5)
 
-        LOGGER.info(f"awake.  status is:\t{status}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise bq_utils.BigQueryJobWaitError(
+                    pending, f'timed out after {self.job_timeout} seconds')
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, JOB_POLL_MAX_SECONDS)
+
+        LOGGER.info("awake.  status is:\tDONE")
+
+
+def create_press(raw_args=None, context=None):
+    """
+    Create a de-identification press and initialize it.
+
+    Initializing a press (re)creates the lookup tables of the input dataset
+    used by the de-identification rules, so presses of different tables
+    should be created one at a time before any of them is run.  Presses
+    sharing a run context only set up these tables once.
+
+    :param raw_args:  command line arguments, parsed by deid.parser.parse_args
+    :param context:  RunContext shared by the presses of a run, if any
+    :return:  the initialized AOU press, or None if it could not be initialized
+    """
+    sys_args = parse_args(raw_args)
+
+    handle = AOU(context=context, **sys_args)
+
+    if handle.initialize(age_limit=sys_args.get('age_limit')):
+        return handle
+
+    LOGGER.error(f"Unable to initialize process.  Check _deid_map table "
+                 f"contents against {sys_args.get('idataset')}.person contents")
+    return None
 
 
 def main(raw_args=None):
@@ -684,16 +922,10 @@ def main(raw_args=None):
     Entry point for de-identification.  Setting the main this way allows the
     module to run as a stand alone script or as part of the pipeline.
     """
-    sys_args = parse_args(raw_args)
+    handle = create_press(raw_args)
 
-    handle = AOU(**sys_args)
-
-    if handle.initialize(age_limit=sys_args.get('age_limit')):
+    if handle is not None:
         handle.do()
-    else:
-        LOGGER.error(
-            f"Unable to initialize process.  Check _deid_map table "
-            f"contents against {sys_args.get('idataset')}.person contents")
 
 
 if __name__ == '__main__':
@@ -201,6 +201,12 @@ def parse_args(raw_args=None):
         type=query_priority,
         const='INTERACTIVE',
         help='Run the query in interactive mode.  Default is batch mode.')
+    parser.add_argument(
+        '--map-responses-in-warehouse',
+        dest='map_responses_in_warehouse',
+        action='store_true',
+        help=('Map questionnaire response ids in BigQuery, only appending '
+              'unmapped responses to the existing mapping table.'))
     parser.add_argument('--version', action='version', version='deid-02')
     # normally, the parsed arguments are returned as a namespace object.  To avoid
     # rewriting a lot of existing code, the namespace elements will be turned into
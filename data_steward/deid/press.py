@@ -3,9 +3,14 @@ This class applies rules and meta data to yield a certain output
 """
 # Python imports
 import codecs
+import hashlib
 import json
 import logging
 import os
+import pickle
+import sys
+import tempfile
+import threading
 from abc import ABC, abstractmethod
 from datetime import datetime
 
@@ -20,6 +25,105 @@ from deid.rules import Deid, create_on_string
 
 LOGGER = logging.getLogger(__name__)
 
+# parsed rules, keyed by the contents of the rules file
+_RULES_CACHE = {}
+# compiled plans, keyed by the path they are saved to
+_PLAN_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+PLANS_DIR = 'plans'
+# bump when the format of saved plans changes without changing the sources
+# of the modules generating them
+PLAN_FORMAT_VERSION = 1
+# keys of the plans returned by Press.compile_plan
+PLAN_KEYS = ['info', 'sql', 'dml_sql', 'pipeline', 'filters']
+# hashes of the sources of the modules generating plans, keyed by module name
+_SOURCE_HASHES = {}
+
+
+def load_rules(rules_path):
+    """
+    Load deid rules, parsing each rules file once per process.
+
+    Presses modify their rules, so each press gets its own copy.
+
+    :param rules_path:  path to the JSON file containing the rules
+    :return:  tuple of a copy of the parsed rules and the contents of the file
+    """
+    with codecs.open(rules_path, 'r') as config:
+        contents = config.read()
+
+    with _CACHE_LOCK:
+        if contents not in _RULES_CACHE:
+            _RULES_CACHE[contents] = json.loads(contents)
+        rules = _RULES_CACHE[contents]
+    return pickle.loads(pickle.dumps(rules)), contents
+
+
+def get_source_hash(module_name):
+    """
+    Get the hash of the source file of a module, computed once per process.
+
+    Saved plans are only reused by the code version which generated them.
+
+    :param module_name:  name of a loaded module
+    :return:  hex digest of the module's source file or an empty string if
+        it has no source file
+    """
+    with _CACHE_LOCK:
+        if module_name not in _SOURCE_HASHES:
+            path = getattr(sys.modules[module_name], '__file__', None)
+            source_hash = ''
+            if path and path.endswith('.py') and os.path.exists(path):
+                with open(path, 'rb') as source:
+                    source_hash = hashlib.sha256(source.read()).hexdigest()
+            _SOURCE_HASHES[module_name] = source_hash
+        return _SOURCE_HASHES[module_name]
+
+
+def load_plan(plan_path):
+    """
+    Load a saved plan, treating an unreadable plan as a cache miss.
+
+    :param plan_path:  path of the JSON file holding the plan
+    :return:  the plan or None if it could not be read
+    """
+    try:
+        with open(plan_path) as plan_file:
+            plan = json.load(plan_file)
+        missing_keys = set(PLAN_KEYS) - set(plan)
+        if missing_keys:
+            raise ValueError(f"missing {sorted(missing_keys)}")
+    except (OSError, TypeError, ValueError):
+        LOGGER.exception(f"ignoring unreadable deid plan:\t{plan_path}")
+        return None
+    return plan
+
+
+def save_plan(plan, plan_path):
+    """
+    Save a plan, replacing any plan saved to the same path at once.
+
+    The plan is written to a temporary file first, so that an interrupted
+    write never leaves a truncated plan behind.
+
+    :param plan:  the plan, as returned by Press.compile_plan
+    :param plan_path:  path of the JSON file holding the plan
+    """
+    plan_dir = os.path.dirname(plan_path)
+    os.makedirs(plan_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w',
+                                     dir=plan_dir,
+                                     suffix='.tmp',
+                                     delete=False) as plan_file:
+        temp_path = plan_file.name
+        try:
+            json.dump(plan, plan_file)
+        except BaseException:
+            plan_file.close()
+            os.remove(temp_path)
+            raise
+    os.replace(temp_path, plan_path)
+
 
 def set_up_logging(log_path, idataset):
     """
@@ -75,8 +179,7 @@ class Press(ABC):
         self.logpath = args.get('logs', 'logs')
         set_up_logging(self.logpath, self.idataset)
 
-        with codecs.open(args.get('rules'), 'r') as config:
-            self.deid_rules = json.loads(config.read())
+        self.deid_rules, self.rules_source = load_rules(args.get('rules'))
 
         self.pipeline = args.get('pipeline',
                                  ['generalize', 'suppress', 'shift', 'compute'])
@@ -88,6 +191,10 @@ class Press(ABC):
             #   I.e physical field suppression and row filter
             #   Date Shifting
             self.table_info = {}
+        # configuration the plan of the table is compiled from
+        self.table_source = json.dumps([self.table_info, self.pipeline],
+                                       sort_keys=True)
+        self._table_columns = {}
 
         if isinstance(self.deid_rules, list):
             cache = {}
@@ -127,16 +234,20 @@ class Press(ABC):
     def get_table_columns(self, tablename):
         """
         Return a list of columns for the given table name.
+
+        The schema of each table is only fetched once per press.
         """
-        info = bq_utils.get_table_info(tablename, dataset_id=self.idataset)
-        schema = info.get('schema', {})
-        fields = schema.get('fields')
+        if tablename not in self._table_columns:
+            info = bq_utils.get_table_info(tablename, dataset_id=self.idataset)
+            schema = info.get('schema', {})
+            fields = schema.get('fields')
 
-        field_names = []
-        for field in fields:
-            field_names.append(field.get('name'))
+            field_names = []
+            for field in fields:
+                field_names.append(field.get('name'))
+            self._table_columns[tablename] = field_names
 
-        return field_names
+        return list(self._table_columns[tablename])
 
     @abstractmethod
     def get_dataframe(self, sql=None, limit=None):
@@ -152,6 +263,20 @@ class Press(ABC):
         """
         pass
 
+    def submit_statements(self, sql, dml_sql):
+        """
+        Submit the statements creating the de-identified table, in order.
+
+        :param sql:  list of statements selecting the de-identified records,
+            the first one creating the table and the others appending to it
+        :param dml_sql:  list of DML statements to run on the output table
+        """
+        for index, statement in enumerate(sql):
+            self.submit(statement, not index)
+
+        for statement in dml_sql:
+            self.submit(statement, False, dml=True)
+
     @abstractmethod
     def update_rules(self):
         """
@@ -159,9 +284,50 @@ class Press(ABC):
         """
         pass
 
-    def do(self):
+    def get_plan_key(self):
         """
-        This function actually runs deid and using both rule specifications and application of the rules
+        Get the key identifying the plan of the table.
+
+        The plan only depends on the rules, the table configuration, the
+        pipeline, the datasets, the columns of the table and the version of
+        the code generating it.
+
+        :return:  string made of the hash of the configuration and the hash of
+            the table schema
+        """
+        module_names = sorted(
+            {__name__, Deid.__module__,
+             type(self).__module__})
+        code_version = [PLAN_FORMAT_VERSION]
+        code_version += [get_source_hash(name) for name in module_names]
+        config = json.dumps([
+            code_version, self.rules_source, self.table_source, self.idataset,
+            self.odataset, self.tablename
+        ])
+        schema = json.dumps(self.get_table_columns(self.tablename))
+        config_hash = hashlib.sha256(config.encode()).hexdigest()
+        schema_hash = hashlib.sha256(schema.encode()).hexdigest()
+        return f'{config_hash[:16]}-{schema_hash[:16]}'
+
+    def get_plan_path(self, plan_key):
+        """
+        Get the path the plan of the table is saved to.
+
+        :param plan_key:  key identifying the plan of the table
+        :return:  path of the JSON file holding the plan
+        """
+        return os.path.join(self.logpath, self.idataset, PLANS_DIR,
+                            f'{self.tablename}-{plan_key}.json')
+
+    def compile_plan(self):
+        """
+        Generate the statements de-identifying the table.
+
+        :return:  a JSON serializable dict holding the rules applied to each
+            field ('info'), the statements selecting the de-identified records
+            ('sql'), the DML statements to run on the output table
+            ('dml_sql'), and the pipeline and row suppression filters the
+            rules resolved to
         """
         self.update_rules()
         d = Deid(pipeline=self.pipeline, rules=self.deid_rules, parent=self)
@@ -212,6 +378,56 @@ class Press(ABC):
                 sql[index] = formatted.replace(':join_tablename',
                                                self.tablename)
 
+        return {
+            'info': p,
+            'sql': sql,
+            'dml_sql': dml_sql,
+            'pipeline': self.pipeline,
+            'filters': self.deid_rules['suppress']['FILTERS']
+        }
+
+    def get_plan(self):
+        """
+        Get the plan of the table, compiling it only if it is not cached.
+
+        Plans are cached in memory and saved to the log path, so repeated
+        runs, including simulations, reuse them as long as the rules, the
+        table configuration and the table schema are unchanged.
+
+        :return:  the plan, as returned by compile_plan
+        """
+        plan_key = self.get_plan_key()
+        plan_path = self.get_plan_path(plan_key)
+        with _CACHE_LOCK:
+            plan = _PLAN_CACHE.get(plan_path)
+
+        if plan is None and os.path.exists(plan_path):
+            plan = load_plan(plan_path)
+            if plan is not None:
+                LOGGER.info(
+                    f"loaded deid plan for table:\t{self.get_tablename()}"
+                    f"\t\tfrom:\t{plan_path}")
+
+        if plan is None:
+            plan = pickle.loads(pickle.dumps(self.compile_plan()))
+            save_plan(plan, plan_path)
+            LOGGER.info(f"saved deid plan for table:\t{self.get_tablename()}"
+                        f"\t\tto:\t{plan_path}")
+
+        with _CACHE_LOCK:
+            _PLAN_CACHE[plan_path] = plan
+        return pickle.loads(pickle.dumps(plan))
+
+    def do(self):
+        """
+        This function actually runs deid and using both rule specifications and application of the rules
+        """
+        plan = self.get_plan()
+        p, sql, dml_sql = plan['info'], plan['sql'], plan['dml_sql']
+        # restore the state the rules resolved to, used by simulations
+        self.pipeline = plan['pipeline']
+        self.deid_rules['suppress']['FILTERS'] = plan['filters']
+
         if 'debug' in self.action:
             self.debug(p)
         else:
@@ -232,11 +448,7 @@ class Press(ABC):
                     sql_file.write(final_sql)
 
             if 'submit' in self.action:
-                for index, statement in enumerate(sql):
-                    self.submit(statement, not index)
-
-                for statement in dml_sql:
-                    self.submit(statement, False, dml=True)
+                self.submit_statements(sql, dml_sql)
 
             if 'simulate' in self.action:
                 #
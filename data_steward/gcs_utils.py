@@ -8,6 +8,8 @@ from io import BytesIO
 
 import googleapiclient.discovery
 
+from utils import client_cache
+
 MIMETYPES = {
     'json': 'application/json',
     'woff': 'application/font-woff',
@@ -15,6 +17,8 @@ MIMETYPES = {
     'eot': 'application/vnd.ms-fontobject'
 }
 GCS_DEFAULT_RETRY_COUNT = 5
+# resumable upload chunks must be a multiple of 256 KiB
+GCS_DEFAULT_CHUNK_SIZE = 32 * 256 * 1024
 
 
 def get_drc_bucket():
@@ -51,7 +55,13 @@ def hpo_gcs_path(hpo_id):
 
 
 def create_service():
-    return googleapiclient.discovery.build('storage', 'v1', cache={})
+    """
+    Get the GCS service for the current thread, building it on first use
+    """
+    return client_cache.get(
+        ('storage', 'v1'),
+        lambda: googleapiclient.discovery.build('storage', 'v1', cache={}),
+        per_thread=True)
 
 
 def list_bucket_dir(gcs_path):
@@ -154,12 +164,38 @@ def get_object(bucket, name, as_text=True):
     return result_bytes
 
 
-def upload_object(bucket, name, fp):
+def get_object_chunks(bucket, name, chunk_size=GCS_DEFAULT_CHUNK_SIZE):
+    """
+    Download object from a bucket one chunk at a time
+    :param bucket: the bucket containing the file
+    :param name: name of the file to download
+    :param chunk_size: number of bytes to download per request
+    :return: generator of the file contents as chunks of bytes
+    """
+    service = create_service()
+    req = service.objects().get_media(bucket=bucket, object=name)
+    out_file = BytesIO()
+    downloader = googleapiclient.http.MediaIoBaseDownload(out_file,
+                                                          req,
+                                                          chunksize=chunk_size)
+    done = False
+    while not done:
+        status, done = downloader.next_chunk(
+            num_retries=GCS_DEFAULT_RETRY_COUNT)
+        yield out_file.getvalue()
+        out_file.seek(0)
+        out_file.truncate()
+    out_file.close()
+
+
+def upload_object(bucket, name, fp, resumable=False):
     """
     Upload file to a GCS bucket
     :param bucket: name of the bucket
     :param name: name for the file
     :param fp: a file-like object containing file contents
+    :param resumable: if True, upload the file in chunks which are retried
+        individually, so large files need not be uploaded in one request
     :return: metadata about the uploaded file
     """
     service = create_service()
@@ -169,7 +205,8 @@ def upload_object(bucket, name, fp):
         mimetype = MIMETYPES[ext]
     else:
         (mimetype, encoding) = mimetypes.guess_type(name)
-    media_body = googleapiclient.http.MediaIoBaseUpload(fp, mimetype)
+    media_body = googleapiclient.http.MediaIoBaseUpload(
+        fp, mimetype, chunksize=GCS_DEFAULT_CHUNK_SIZE, resumable=resumable)
     req = service.objects().insert(bucket=bucket,
                                    body=body,
                                    media_body=media_body)
@@ -4,9 +4,11 @@ import inspect
 import json
 import logging
 import os
+import pickle
+import threading
+from collections import defaultdict
 from io import open
-
-import cachetools
+from types import MappingProxyType
 
 from common import ACHILLES_TABLES, ACHILLES_HEEL_TABLES, VOCABULARY_TABLES, PROCESSED_TXT, RESULTS_HTML, FITBIT_TABLES
 
@@ -61,18 +63,170 @@ PPI_BRANCHING_RULE_PATHS = [
     HEALTHCARE_ACCESS_CSV_PATH, LIFESTYLE_CSV_PATH, OVERALL_HEALTH_CSV_PATH,
     PERSONAL_MEDICAL_HISTORY_CSV_PATH
 ]
+# optional pickled snapshot of the parsed schema and lookup files
+RESOURCE_SNAPSHOT_PATH = os.environ.get('RESOURCE_SNAPSHOT_PATH')
+
+
+class ResourceRegistry(object):
+    """
+    An index of the schema and lookup files under resource_files
+
+    The directory tree is walked once to index the schema files by table name.
+    Files are parsed on first access and kept for the life of the registry,
+    or loaded from a pickled snapshot if the snapshot was made from the same
+    contents of the directory.
+    """
+
+    def __init__(self, root_path=resource_files_path, snapshot_path=None):
+        """
+        Index the files under a directory
+
+        :param root_path: directory holding the resource files
+        :param snapshot_path: path of a snapshot written by `write_snapshot`,
+            ignored if it does not exist or was made from other files
+        """
+        self.root_path = root_path
+        self.fields_path = os.path.join(root_path, 'fields')
+        file_paths = []
+        schema_paths = defaultdict(list)
+        for dir_path, _, files in os.walk(root_path):
+            for file_name in files:
+                file_path = os.path.join(dir_path, file_name)
+                file_paths.append(file_path)
+                if (file_name.endswith('.json') and
+                        file_path.startswith(self.fields_path + os.sep)):
+                    schema_paths[file_name[:-5]].append(file_path)
+        self.file_paths = tuple(file_paths)
+        self.schema_paths = MappingProxyType(
+            {table: tuple(paths) for table, paths in schema_paths.items()})
+        self._contents = dict()
+        self._lock = threading.Lock()
+        if snapshot_path and os.path.exists(snapshot_path):
+            self._load_snapshot(snapshot_path)
+
+    def get_snapshot_key(self):
+        """
+        Get a digest of the names and contents of the indexed files
+
+        :return: hex digest identifying the contents of the directory
+        """
+        hash_obj = hashlib.sha256(hash_dir(self.root_path).encode())
+        for file_path in self.file_paths:
+            hash_obj.update(os.path.relpath(file_path, self.root_path).encode())
+        return hash_obj.hexdigest()
+
+    def _load_snapshot(self, snapshot_path):
+        try:
+            with open(snapshot_path, 'rb') as fp:
+                snapshot = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            LOGGER.warning(f"Unable to read resource snapshot {snapshot_path}",
+                           exc_info=True)
+            return
+        if snapshot.get('key') != self.get_snapshot_key():
+            LOGGER.info(f"Ignoring outdated resource snapshot {snapshot_path}")
+            return
+        self._contents.update({
+            os.path.join(self.root_path, relative_path): contents
+            for relative_path, contents in snapshot['contents'].items()
+        })
+
+    def write_snapshot(self, snapshot_path):
+        """
+        Parse all schema and CSV files and save them to a pickled snapshot
+
+        :param snapshot_path: path of the snapshot file to write
+        """
+        for file_path in self.file_paths:
+            if file_path.endswith('.csv'):
+                self.get_csv(file_path)
+        for paths in self.schema_paths.values():
+            for schema_path in paths:
+                self._get_contents(schema_path, json.load)
+        with self._lock:
+            contents = {
+                os.path.relpath(file_path, self.root_path): file_contents
+                for file_path, file_contents in self._contents.items()
+                if file_path in self.file_paths
+            }
+        with open(snapshot_path, 'wb') as fp:
+            pickle.dump({
+                'key': self.get_snapshot_key(),
+                'contents': contents
+            }, fp)
+
+    def _get_contents(self, file_path, parse):
+        with self._lock:
+            if file_path not in self._contents:
+                with open(file_path, 'r') as fp:
+                    self._contents[file_path] = parse(fp)
+            return self._contents[file_path]
+
+    def get_csv(self, csv_path):
+        """
+        Get the records of a CSV file, which must not be modified
+
+        :param csv_path: absolute path to a well-formed CSV file
+        :return: list of `dict`
+        """
+        return self._get_contents(csv_path, _csv_file_to_list)
+
+    def get_schema(self, schema_path):
+        """
+        Get a copy of the fields of a JSON schema file
+
+        :param schema_path: absolute path to a JSON schema file
+        :return: a json object representing the fields of the table
+        """
+        # a pickle round trip copies the nested fields faster than deepcopy
+        return pickle.loads(
+            pickle.dumps(self._get_contents(schema_path, json.load),
+                         pickle.HIGHEST_PROTOCOL))
+
+    def find_schema_paths(self, table, sub_path=None):
+        """
+        Get the paths of the schema files of a table
+
+        :param table: the table to get schema files for
+        :param sub_path: a sub-directory in resource_files/fields.  If
+            provided, only its sub-directories with the same name are searched.
+        :return: tuple of the paths of the schema files
+        """
+        paths = self.schema_paths.get(table, ())
+        if sub_path:
+            path = os.path.join(self.fields_path, sub_path)
+            paths = tuple(
+                schema_path for schema_path in paths
+                if (schema_path.startswith(path + os.sep) and os.path.basename(
+                    os.path.dirname(schema_path)) == os.path.basename(sub_path)
+                   ))
+        return paths
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Get the registry of resource files, indexing them on first use
+
+    :return: the process-wide ResourceRegistry
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ResourceRegistry(snapshot_path=RESOURCE_SNAPSHOT_PATH)
+        return _registry
 
 
-@cachetools.cached(cache={})
 def csv_to_list(csv_path):
     """
     Yield a list of `dict` from a CSV file
     :param csv_path: absolute path to a well-formed CSV file
     :return:
     """
-    with open(csv_path, mode='r') as csv_file:
-        list_of_dicts = _csv_file_to_list(csv_file)
-    return list_of_dicts
+    return get_registry().get_csv(csv_path)
 
 
 def _csv_file_to_list(csv_file):
@@ -107,51 +261,36 @@ def cdm_csv():
 
 
 def achilles_index_files():
-    achilles_index_files = []
-    for path, subdirs, files in os.walk(achilles_index_path):
-        for name in files:
-            achilles_index_files.append(os.path.join(path, name))
-    return achilles_index_files
+    return [
+        file_path for file_path in get_registry().file_paths
+        if file_path.startswith(achilles_index_path + os.sep)
+    ]
 
 
 def fields_for(table, sub_path=None):
     """
     Return the json schema for any table identified in the fields directory.
 
-    Uses os.walk to traverse subdirectories
+    Schema files in subdirectories are found through the resource registry.
 
     :param table: The table to get a schema for
     :param sub_path: A string identifying a sub-directory in resource_files/fields.
         If provided, this directory will be searched.
     :returns: a json object representing the fields for the named table
     """
-    path = os.path.join(fields_path, sub_path if sub_path else '')
-
-    # default setting
-    json_path = os.path.join(path, table + '.json')
-
-    unique_count = 0
-    for dirpath, _, files in os.walk(path):
-        if sub_path and os.path.basename(sub_path) != os.path.basename(dirpath):
-            continue
-
-        for filename in files:
-            if filename[:-5] == table:
-                json_path = os.path.join(dirpath, filename)
-                unique_count = unique_count + 1
+    registry = get_registry()
+    path = os.path.join(registry.fields_path, sub_path if sub_path else '')
+    json_paths = registry.find_schema_paths(table, sub_path)
 
-    if unique_count > 1:
+    if len(json_paths) > 1:
         raise RuntimeError(
             f"Unable to read schema file because multiple schemas exist for:\t"
             f"{table} in path {path}")
-    elif unique_count == 0:
+    elif not json_paths:
         raise RuntimeError(
             f"Unable to find schema file for {table} in path {path}")
 
-    with open(json_path, 'r') as fp:
-        fields = json.load(fp)
-
-    return fields
+    return registry.get_schema(json_paths[0])
 
 
 def is_internal_table(table_id):
@@ -230,6 +369,37 @@ def is_id_match(table_id):
     return table_id.startswith('identity_')
 
 
+def _is_cdm_table(table_name, include_achilles=False, include_vocabulary=False):
+    """
+    Determine if a table belongs to the result of `cdm_schemas`
+
+    :param table_name: identifies the table
+    :param include_achilles:
+    :param include_vocabulary:
+    :return: True if the table is included, False otherwise
+    """
+    include_table = True
+    if table_name in VOCABULARY_TABLES and not include_vocabulary:
+        include_table = False
+    elif table_name in ACHILLES_TABLES + ACHILLES_HEEL_TABLES and not include_achilles:
+        include_table = False
+    elif is_internal_table(table_name):
+        include_table = False
+    elif is_pii_table(table_name):
+        include_table = False
+    elif is_id_match(table_name):
+        include_table = False
+    elif is_extension_table(table_name):
+        include_table = False
+    elif is_deid_table(table_name):
+        include_table = False
+    elif is_wearables_table(table_name):
+        include_table = False
+    elif table_name == 'post_deid_person':
+        include_table = False
+    return include_table
+
+
 def cdm_schemas(include_achilles=False, include_vocabulary=False):
     """
     Get a dictionary mapping table_name -> schema
@@ -239,68 +409,64 @@ def cdm_schemas(include_achilles=False, include_vocabulary=False):
     :return:
     """
     result = dict()
+    registry = get_registry()
     # TODO:  update this code as part of DC-1015 and remove this comment
-    for dir_path, _, files in os.walk(fields_path):
-        for f in files:
-            file_path = os.path.join(dir_path, f)
-            with open(file_path, 'r') as fp:
-                file_name = os.path.basename(f)
-                table_name = file_name.split('.')[0]
-                schema = json.load(fp)
-                include_table = True
-                if table_name in VOCABULARY_TABLES and not include_vocabulary:
-                    include_table = False
-                elif table_name in ACHILLES_TABLES + ACHILLES_HEEL_TABLES and not include_achilles:
-                    include_table = False
-                elif is_internal_table(table_name):
-                    include_table = False
-                elif is_pii_table(table_name):
-                    include_table = False
-                elif is_id_match(table_name):
-                    include_table = False
-                elif is_extension_table(table_name):
-                    include_table = False
-                elif is_deid_table(table_name):
-                    include_table = False
-                elif is_wearables_table(table_name):
-                    include_table = False
-                elif table_name == 'post_deid_person':
-                    include_table = False
-                if include_table:
-                    result[table_name] = schema
+    for table_name, file_paths in registry.schema_paths.items():
+        if _is_cdm_table(table_name, include_achilles, include_vocabulary):
+            # the last schema file found for a table is used
+            result[table_name] = registry.get_schema(file_paths[-1])
 
     return result
 
 
-def mapping_schemas():
-    result = dict()
-    for f in os.listdir(fields_path):
-        file_path = os.path.join(fields_path, f)
-        table_name = f.split('.')[0]
+def _mapping_schema_paths():
+    """
+    Get the paths of the mapping table schemas in the fields directory itself
 
-        if is_mapping_table(table_name):
-            # only open and load mapping tables, instead of all tables
-            with open(file_path, 'r') as fp:
-                result[table_name] = json.load(fp)
+    :return: dictionary mapping table_name -> schema path
+    """
+    registry = get_registry()
+    return {
+        table_name: file_path
+        for table_name, file_paths in registry.schema_paths.items()
+        if is_mapping_table(table_name) for file_path in file_paths
+        if os.path.dirname(file_path) == registry.fields_path
+    }
 
-    return result
+
+def mapping_schemas():
+    registry = get_registry()
+    return {
+        table_name: registry.get_schema(file_path)
+        for table_name, file_path in _mapping_schema_paths().items()
+    }
 
 
 def hash_dir(in_dir):
     """
     Generate an MD5 digest from the contents of a directory
+
+    Subdirectories are digested recursively along with their names.
     """
     file_names = os.listdir(in_dir)
     hash_obj = hashlib.sha256()
     for file_name in file_names:
         file_path = os.path.join(in_dir, file_name)
+        if os.path.isdir(file_path):
+            hash_obj.update(file_name.encode())
+            hash_obj.update(hash_dir(file_path).encode())
+            continue
         with open(file_path, 'rb') as fp:
             hash_obj.update(fp.read())
     return hash_obj.hexdigest()
 
 
-CDM_TABLES = list(cdm_schemas().keys())
-MAPPING_TABLES = list(mapping_schemas().keys())
+# table names are listed from the registry without parsing their schemas
+CDM_TABLES = [
+    table_name for table_name in get_registry().schema_paths
+    if _is_cdm_table(table_name)
+]
+MAPPING_TABLES = list(_mapping_schema_paths().keys())
 ACHILLES_INDEX_FILES = achilles_index_files()
 CDM_FILES = [table + '.csv' for table in CDM_TABLES]
 ALL_ACHILLES_INDEX_FILES = [
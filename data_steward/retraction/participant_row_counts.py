@@ -18,7 +18,6 @@ import logging
 # Third party imports
 from google.api_core.exceptions import BadRequest
 import pandas as pd
-from jinja2 import Template
 
 # Project imports
 from utils import bq
@@ -60,7 +59,8 @@ def get_combined_deid_query(project_id,
     # Combined
     for table in tables_with_pid:
         if table in cdm_and_mapping_tables:
-            tmpl = Template(consts.CDM_MAPPING_TABLE_COUNT).render(
+            tmpl = bq.render_template(
+                consts.CDM_MAPPING_TABLE_COUNT,
                 project=project_id,
                 dataset=dataset_id,
                 table=table,
@@ -75,12 +75,12 @@ def get_combined_deid_query(project_id,
             # death table does not have mapping and could have come from EHR or RDR, needs investigation
             if table == common.DEATH:
                 ehr_count = "COUNT(*)"
-            tmpl = Template(consts.PID_TABLE_COUNT).render(
-                project=project_id,
-                dataset=dataset_id,
-                table=table,
-                pids_expr=pid_sql_expr,
-                ehr_count=ehr_count)
+            tmpl = bq.render_template(consts.PID_TABLE_COUNT,
+                                      project=project_id,
+                                      dataset=dataset_id,
+                                      table=table,
+                                      pids_expr=pid_sql_expr,
+                                      ehr_count=ehr_count)
         query_list.append(tmpl)
     query = consts.UNION_ALL.join(query_list)
     return query
@@ -109,11 +109,12 @@ def get_dataset_query(project_id,
     # Unioned EHR or generic dataset
     for table in tables_with_pid:
         ehr_count = 0 if for_rdr else "COUNT(*)"
-        tmpl = Template(consts.PID_TABLE_COUNT).render(project=project_id,
-                                                       dataset=dataset_id,
-                                                       table=table,
-                                                       pids_expr=pid_sql_expr,
-                                                       ehr_count=ehr_count)
+        tmpl = bq.render_template(consts.PID_TABLE_COUNT,
+                                  project=project_id,
+                                  dataset=dataset_id,
+                                  table=table,
+                                  pids_expr=pid_sql_expr,
+                                  ehr_count=ehr_count)
         query_list.append(tmpl)
     query = consts.UNION_ALL.join(query_list)
     return query
@@ -150,11 +151,12 @@ def get_ehr_query(project_id, dataset_id, pid_source, hpo_id, table_df):
 
     for table in tables_to_consider:
         ehr_count = "COUNT(*)"
-        tmpl = Template(consts.PID_TABLE_COUNT).render(project=project_id,
-                                                       dataset=dataset_id,
-                                                       table=table,
-                                                       pids_expr=pid_sql_expr,
-                                                       ehr_count=ehr_count)
+        tmpl = bq.render_template(consts.PID_TABLE_COUNT,
+                                  project=project_id,
+                                  dataset=dataset_id,
+                                  table=table,
+                                  pids_expr=pid_sql_expr,
+                                  ehr_count=ehr_count)
         query_list.append(tmpl)
     query = consts.UNION_ALL.join(query_list)
     return query
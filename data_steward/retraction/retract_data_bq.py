@@ -11,10 +11,12 @@ import re
 import logging
 
 # Third party imports
+from googleapiclient.errors import HttpError
 
 # Project imports
 import common
 import bq_utils
+from utils import task_graph
 from validation import ehr_union
 from retraction import retract_utils as ru
 
@@ -29,6 +31,10 @@ RESEARCH_ID = 'research_id'
 
 PERSON_DOMAIN = 56
 
+DEFAULT_MAX_WORKERS = 4
+# number of times a failed retraction query is run again
+MAX_RETRIES = 2
+
 NON_PID_TABLES = [
     common.CARE_SITE, common.LOCATION, common.FACT_RELATIONSHIP, common.PROVIDER
 ]
@@ -159,9 +165,30 @@ def list_existing_tables(project_id, dataset_id):
     return existing_tables
 
 
-def queries_to_retract_from_ehr_dataset(project_id, dataset_id, pid_project_id,
-                                        sandbox_dataset_id, hpo_id,
-                                        pid_table_id):
+def list_existing_tables_by_dataset(project_id, dataset_ids, max_workers=1):
+    """
+    List the tables of several datasets concurrently
+
+    :param project_id: identifies the project containing the datasets
+    :param dataset_ids: list of datasets to list tables for
+    :param max_workers: maximum number of datasets to list at the same time
+    :return: dict mapping each dataset_id to the list of its table ids
+    """
+    logging.info('Checking existing tables for %s' % ', '.join(dataset_ids))
+    existing_tables = task_graph.run_tasks(
+        dataset_ids, [set()] * len(dataset_ids),
+        lambda dataset_id: list_existing_tables(project_id, dataset_id),
+        max_workers=max_workers)
+    return dict(zip(dataset_ids, existing_tables))
+
+
+def queries_to_retract_from_ehr_dataset(project_id,
+                                        dataset_id,
+                                        pid_project_id,
+                                        sandbox_dataset_id,
+                                        hpo_id,
+                                        pid_table_id,
+                                        existing_tables=None):
     """
     Get list of queries to remove all records in all tables associated with supplied ids
 
@@ -171,11 +198,13 @@ def queries_to_retract_from_ehr_dataset(project_id, dataset_id, pid_project_id,
     :param sandbox_dataset_id: identifies the dataset containing the pid table
     :param hpo_id: identifies the HPO site
     :param pid_table_id: table containing the person_ids and research_ids
+    :param existing_tables: ids of the tables in the dataset, listed if not set
     :return: list of dict with keys query, dataset, table, delete_flag
     """
-    logging.info('Checking existing tables for %s.%s' %
-                 (project_id, dataset_id))
-    existing_tables = list_existing_tables(project_id, dataset_id)
+    if existing_tables is None:
+        logging.info('Checking existing tables for %s.%s' %
+                     (project_id, dataset_id))
+        existing_tables = list_existing_tables(project_id, dataset_id)
     site_queries = []
     unioned_mapping_queries = []
     unioned_mapping_legacy_queries = []
@@ -312,9 +341,12 @@ def queries_to_retract_from_ehr_dataset(project_id, dataset_id, pid_project_id,
     return unioned_mapping_legacy_queries + unioned_mapping_queries, unioned_queries + site_queries
 
 
-def queries_to_retract_from_unioned_dataset(project_id, dataset_id,
-                                            pid_project_id, sandbox_dataset_id,
-                                            pid_table_id):
+def queries_to_retract_from_unioned_dataset(project_id,
+                                            dataset_id,
+                                            pid_project_id,
+                                            sandbox_dataset_id,
+                                            pid_table_id,
+                                            existing_tables=None):
     """
     Get list of queries to remove all records in all tables associated with supplied ids
 
@@ -323,11 +355,13 @@ def queries_to_retract_from_unioned_dataset(project_id, dataset_id,
     :param pid_project_id: identifies the project containing the sandbox dataset
     :param sandbox_dataset_id: identifies the dataset containing the pid table
     :param pid_table_id: table containing the person_ids and research_ids
+    :param existing_tables: ids of the tables in the dataset, listed if not set
     :return: list of dict with keys query, dataset, table
     """
-    logging.info('Checking existing tables for %s.%s' %
-                 (project_id, dataset_id))
-    existing_tables = list_existing_tables(project_id, dataset_id)
+    if existing_tables is None:
+        logging.info('Checking existing tables for %s.%s' %
+                     (project_id, dataset_id))
+        existing_tables = list_existing_tables(project_id, dataset_id)
     unioned_mapping_queries = []
     unioned_queries = []
     for table in TABLES_FOR_RETRACTION:
@@ -397,9 +431,14 @@ def queries_to_retract_from_unioned_dataset(project_id, dataset_id,
     return unioned_mapping_queries, unioned_queries
 
 
-def queries_to_retract_from_combined_or_deid_dataset(
-    project_id, dataset_id, pid_project_id, sandbox_dataset_id, pid_table_id,
-    retraction_type, deid_flag):
+def queries_to_retract_from_combined_or_deid_dataset(project_id,
+                                                     dataset_id,
+                                                     pid_project_id,
+                                                     sandbox_dataset_id,
+                                                     pid_table_id,
+                                                     retraction_type,
+                                                     deid_flag,
+                                                     existing_tables=None):
     """
     Get list of queries to remove all records in all tables associated with supplied ids
 
@@ -411,11 +450,13 @@ def queries_to_retract_from_combined_or_deid_dataset(
     :param retraction_type: string indicating whether all data needs to be removed, including RDR,
         or if RDR data needs to be kept intact. Can take the values 'rdr_and_ehr' or 'only_ehr'
     :param deid_flag: flag indicating if running on a deid dataset
+    :param existing_tables: ids of the tables in the dataset, listed if not set
     :return: list of dict with keys query, dataset, table
     """
-    logging.info('Checking existing tables for %s.%s' %
-                 (project_id, dataset_id))
-    existing_tables = list_existing_tables(project_id, dataset_id)
+    if existing_tables is None:
+        logging.info('Checking existing tables for %s.%s' %
+                     (project_id, dataset_id))
+        existing_tables = list_existing_tables(project_id, dataset_id)
 
     # retract from ehr and rdr or only ehr
     if retraction_type == 'rdr_and_ehr':
@@ -514,26 +555,120 @@ def queries_to_retract_from_combined_or_deid_dataset(
     return combined_mapping_queries, combined_queries
 
 
-def retraction_query_runner(queries):
-    query_job_ids = []
-    for query_dict in queries:
-        logging.info('Retracting from %s.%s using query %s' %
-                     (query_dict[DEST_DATASET], query_dict[DEST_TABLE],
-                      query_dict[QUERY]))
-        job_results = bq_utils.query(q=query_dict[QUERY], batch=True)
-        rows_affected = job_results['numDmlAffectedRows']
-        logging.info(
-            '%s rows deleted from %s.%s' %
-            (rows_affected, query_dict[DEST_DATASET], query_dict[DEST_TABLE]))
-        query_job_id = job_results['jobReference']['jobId']
-        query_job_ids.append(query_job_id)
+def _submit_retraction_query(query_dict):
+    """
+    Submit a retraction query, returning its response or submission error
 
-    incomplete_jobs = bq_utils.wait_on_jobs(query_job_ids)
-    if incomplete_jobs:
+    :param query_dict: dict with keys query, dataset, table
+    :return: tuple of the query response, or None if the submission failed,
+        and the error message, if any
+    """
+    logging.info(
+        'Retracting from %s.%s using query %s' %
+        (query_dict[DEST_DATASET], query_dict[DEST_TABLE], query_dict[QUERY]))
+    try:
+        return bq_utils.query(q=query_dict[QUERY], batch=True), None
+    except HttpError as e:
+        logging.exception('Failed to submit query for %s.%s' %
+                          (query_dict[DEST_DATASET], query_dict[DEST_TABLE]))
+        return None, str(e)
+
+
+def retraction_query_runner(queries,
+                            max_workers=1,
+                            max_retries=MAX_RETRIES,
+                            rows_removed=None):
+    """
+    Run retraction queries in concurrent batches, retrying failed queries
+
+    At most `max_workers` queries are submitted and run at the same time.  A
+    query which fails is run again in a later batch, up to `max_retries`
+    times, while the queries which succeeded are not run again.
+
+    :param queries: list of dict with keys query, dataset, table
+    :param max_workers: maximum number of queries to run at the same time
+    :param max_retries: number of times a failed query is run again
+    :param rows_removed: optional dict in which the number of rows deleted
+        by each query is recorded as rows_removed[dataset][table]
+    :raises BigQueryJobWaitError: if queries still failed after the retries
+        or did not complete
+    """
+    pending = [(query_dict, 0) for query_dict in queries]
+    failed_job_ids, errors = [], []
+    while pending:
+        batch, pending = pending[:max_workers], pending[max_workers:]
+        responses = task_graph.run_tasks(
+            [query_dict for query_dict, _ in batch], [set()] * len(batch),
+            _submit_retraction_query,
+            max_workers=max_workers)
+        # only wait on the jobs which did not complete within the request
+        running_job_ids = [
+            response['jobReference']['jobId']
+            for response, _ in responses
+            if response is not None and not response.get('jobComplete')
+        ]
+        tracker = bq_utils.JobTracker()
+        incomplete_jobs = tracker.wait(
+            running_job_ids) if running_job_ids else []
+        if incomplete_jobs:
+            logging.info('Failed on {count} job ids {ids}'.format(
+                count=len(incomplete_jobs), ids=incomplete_jobs))
+            logging.info('Terminating retraction')
+            raise bq_utils.BigQueryJobWaitError(incomplete_jobs)
+
+        for (query_dict, attempt), (response, error) in zip(batch, responses):
+            job_id = None
+            if response is not None:
+                job_id = response['jobReference']['jobId']
+                job_resource = tracker.job_resources.get(job_id)
+                if job_resource is None:
+                    rows_affected = response.get('numDmlAffectedRows')
+                else:
+                    error = job_resource['status'].get('errorResult',
+                                                       {}).get('message')
+                    rows_affected = job_resource.get('statistics', {}).get(
+                        'query', {}).get('numDmlAffectedRows')
+            if error is None:
+                logging.info('%s rows deleted from %s.%s' %
+                             (rows_affected, query_dict[DEST_DATASET],
+                              query_dict[DEST_TABLE]))
+                if rows_removed is not None:
+                    rows_removed.setdefault(
+                        query_dict[DEST_DATASET],
+                        dict())[query_dict[DEST_TABLE]] = int(rows_affected or
+                                                              0)
+            elif attempt < max_retries:
+                logging.info(
+                    'Retrying query for %s.%s after error: %s' %
+                    (query_dict[DEST_DATASET], query_dict[DEST_TABLE], error))
+                pending.append((query_dict, attempt + 1))
+            else:
+                failed_job_ids.append(
+                    job_id or '%s.%s' %
+                    (query_dict[DEST_DATASET], query_dict[DEST_TABLE]))
+                errors.append(error)
+
+    if failed_job_ids:
         logging.info('Failed on {count} job ids {ids}'.format(
-            count=len(incomplete_jobs), ids=incomplete_jobs))
+            count=len(failed_job_ids), ids=failed_job_ids))
         logging.info('Terminating retraction')
-        raise bq_utils.BigQueryJobWaitError(incomplete_jobs)
+        raise bq_utils.BigQueryJobWaitError(failed_job_ids, errors[0])
+
+
+def log_retraction_summary(rows_removed):
+    """
+    Log the number of rows removed from each table of each dataset
+
+    :param rows_removed: dict of the number of rows deleted as
+        rows_removed[dataset][table]
+    """
+    for dataset in sorted(rows_removed):
+        dataset_rows_removed = rows_removed[dataset]
+        logging.info('%d rows removed from %d tables in %s' % (sum(
+            dataset_rows_removed.values()), len(dataset_rows_removed), dataset))
+        for table in sorted(dataset_rows_removed):
+            logging.info('\t%s.%s: %d' %
+                         (dataset, table, dataset_rows_removed[table]))
 
 
 def is_deid_dataset(dataset_id):
@@ -556,8 +691,14 @@ def is_ehr_dataset(dataset_id):
         ru.EHR_REGEX, dataset_id)) or dataset_id == bq_utils.get_dataset_id()
 
 
-def run_bq_retraction(project_id, sandbox_dataset_id, pid_project_id,
-                      pid_table_id, hpo_id, dataset_ids, retraction_type):
+def run_bq_retraction(project_id,
+                      sandbox_dataset_id,
+                      pid_project_id,
+                      pid_table_id,
+                      hpo_id,
+                      dataset_ids,
+                      retraction_type,
+                      max_workers=DEFAULT_MAX_WORKERS):
     """
     Main function to perform retraction
     pid table must follow schema described above in PID_TABLE_FIELDS and must reside in sandbox_dataset_id
@@ -572,7 +713,9 @@ def run_bq_retraction(project_id, sandbox_dataset_id, pid_project_id,
         If set to 'none', skips retraction from BigQuery datasets
     :param retraction_type: string indicating whether all data needs to be removed, including RDR,
         or if RDR data needs to be kept intact. Can take the values 'rdr_and_ehr' or 'only_ehr'
-    :return:
+    :param max_workers: maximum number of datasets to list or retraction
+        queries to run at the same time
+    :return: dict of the number of rows removed as rows_removed[dataset][table]
     """
     # initialize list of all datasets in project
     dataset_objs = bq_utils.list_datasets(project_id)
@@ -618,24 +761,39 @@ def run_bq_retraction(project_id, sandbox_dataset_id, pid_project_id,
         )
         ehr_datasets = []
 
+    existing_tables = list_existing_tables_by_dataset(
+        project_id,
+        ehr_datasets + unioned_datasets + combined_datasets + deid_datasets,
+        max_workers=max_workers)
+
+    # queries of all datasets run together, mapping tables first since their
+    # queries read the tables retracted from afterwards
+    mapping_queries, queries = [], []
     logging.info('Retracting from EHR datasets: %s' % ', '.join(ehr_datasets))
     for dataset in ehr_datasets:
         ehr_mapping_queries, ehr_queries = queries_to_retract_from_ehr_dataset(
-            project_id, dataset, pid_project_id, sandbox_dataset_id, hpo_id,
-            pid_table_id)
-        retraction_query_runner(ehr_mapping_queries)
-        retraction_query_runner(ehr_queries)
-    logging.info('Finished retracting from EHR datasets')
+            project_id,
+            dataset,
+            pid_project_id,
+            sandbox_dataset_id,
+            hpo_id,
+            pid_table_id,
+            existing_tables=existing_tables[dataset])
+        mapping_queries.extend(ehr_mapping_queries)
+        queries.extend(ehr_queries)
 
     logging.info('Retracting from UNIONED datasets: %s' %
                  ', '.join(unioned_datasets))
     for dataset in unioned_datasets:
         unioned_mapping_queries, unioned_queries = queries_to_retract_from_unioned_dataset(
-            project_id, dataset, pid_project_id, sandbox_dataset_id,
-            pid_table_id)
-        retraction_query_runner(unioned_mapping_queries)
-        retraction_query_runner(unioned_queries)
-    logging.info('Finished retracting from UNIONED datasets')
+            project_id,
+            dataset,
+            pid_project_id,
+            sandbox_dataset_id,
+            pid_table_id,
+            existing_tables=existing_tables[dataset])
+        mapping_queries.extend(unioned_mapping_queries)
+        queries.extend(unioned_queries)
 
     logging.info('Retracting from COMBINED datasets: %s' %
                  ', '.join(combined_datasets))
@@ -647,10 +805,10 @@ def run_bq_retraction(project_id, sandbox_dataset_id, pid_project_id,
             sandbox_dataset_id,
             pid_table_id,
             retraction_type,
-            deid_flag=False)
-        retraction_query_runner(combined_mapping_queries)
-        retraction_query_runner(combined_queries)
-    logging.info('Finished retracting from COMBINED datasets')
+            deid_flag=False,
+            existing_tables=existing_tables[dataset])
+        mapping_queries.extend(combined_mapping_queries)
+        queries.extend(combined_queries)
 
     # TODO ensure the correct research_ids for persons_ids are used for each deid retraction
     logging.info('Retracting from DEID datasets: %s' % ', '.join(deid_datasets))
@@ -662,10 +820,22 @@ def run_bq_retraction(project_id, sandbox_dataset_id, pid_project_id,
             sandbox_dataset_id,
             pid_table_id,
             retraction_type,
-            deid_flag=True)
-        retraction_query_runner(deid_mapping_queries)
-        retraction_query_runner(deid_queries)
-    logging.info('Finished retracting from DEID datasets')
+            deid_flag=True,
+            existing_tables=existing_tables[dataset])
+        mapping_queries.extend(deid_mapping_queries)
+        queries.extend(deid_queries)
+
+    rows_removed = dict()
+    retraction_query_runner(mapping_queries,
+                            max_workers=max_workers,
+                            rows_removed=rows_removed)
+    retraction_query_runner(queries,
+                            max_workers=max_workers,
+                            rows_removed=rows_removed)
+    logging.info('Finished retracting from EHR, UNIONED, COMBINED and DEID '
+                 'datasets')
+    log_retraction_summary(rows_removed)
+    return rows_removed
 
 
 if __name__ == '__main__':
@@ -729,9 +899,22 @@ if __name__ == '__main__':
         help='Identifies whether all data needs to be removed, including RDR,'
         'or if RDR data needs to be kept intact. Can take the values "rdr_and_ehr" or "only_ehr"',
         required=True)
+    parser.add_argument(
+        '-w',
+        '--max_workers',
+        dest='max_workers',
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help='Maximum number of retraction queries to run at the same time',
+        required=False)
     args = parser.parse_args()
 
-    run_bq_retraction(args.project_id, args.sandbox_dataset_id,
-                      args.pid_project_id, args.pid_table_id, args.hpo_id,
-                      args.dataset_ids, args.retraction_type)
+    run_bq_retraction(args.project_id,
+                      args.sandbox_dataset_id,
+                      args.pid_project_id,
+                      args.pid_table_id,
+                      args.hpo_id,
+                      args.dataset_ids,
+                      args.retraction_type,
+                      max_workers=args.max_workers)
     logging.info('Retraction complete')
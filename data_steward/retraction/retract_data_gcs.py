@@ -8,14 +8,15 @@ If the submission folder is set to 'all_folders', all the submissions from the s
 If a submission folder is specified, only that folder will be considered for retraction
 """
 
-from io import BytesIO
 import argparse
 import logging
+import tempfile
 
 import bq_utils
 import common
 import gcs_utils
 import resources
+from utils import task_graph
 
 EXTRACT_PIDS_QUERY = """
 SELECT person_id
@@ -28,10 +29,17 @@ PID_IN_COL2 = [
     common.MEASUREMENT, common.PROCEDURE_OCCURRENCE, common.OBSERVATION,
     common.DEVICE_EXPOSURE, common.SPECIMEN, common.NOTE
 ]
+DEFAULT_MAX_WORKERS = 4
 
 
-def run_gcs_retraction(project_id, sandbox_dataset_id, pid_table_id, hpo_id,
-                       folder, force_flag):
+def run_gcs_retraction(project_id,
+                       sandbox_dataset_id,
+                       pid_table_id,
+                       hpo_id,
+                       folder,
+                       force_flag,
+                       max_workers=DEFAULT_MAX_WORKERS,
+                       lines_removed=None):
     """
     Retract from a folder/folders in a GCS bucket all records associated with a pid
 
@@ -42,6 +50,10 @@ def run_gcs_retraction(project_id, sandbox_dataset_id, pid_table_id, hpo_id,
     :param folder: the site's submission folder; if set to 'all_folders', retract from all folders by the site
         if set to 'none', skip retraction from bucket folders
     :param force_flag: if False then prompt for each file
+    :param max_workers: maximum number of files of a folder to retract from
+        at the same time
+    :param lines_removed: optional dict in which the number of lines removed
+        from each file is recorded by object name
     :return: metadata for each object updated in order to retract as a list of lists
     """
 
@@ -118,8 +130,13 @@ def run_gcs_retraction(project_id, sandbox_dataset_id, pid_table_id, hpo_id,
             # Make sure user types Y to proceed
             response = get_response()
         if response == "Y":
-            folder_upload_output = retract(pids, bucket, found_files,
-                                           folder_prefix, force_flag)
+            folder_upload_output = retract(pids,
+                                           bucket,
+                                           found_files,
+                                           folder_prefix,
+                                           force_flag,
+                                           max_workers=max_workers,
+                                           lines_removed=lines_removed)
             result_dict[folder_prefix] = folder_upload_output
             logging.info("Retraction completed for folder %s/%s " %
                          (bucket, folder_prefix))
@@ -129,7 +146,13 @@ def run_gcs_retraction(project_id, sandbox_dataset_id, pid_table_id, hpo_id,
     return result_dict
 
 
-def retract(pids, bucket, found_files, folder_prefix, force_flag):
+def retract(pids,
+            bucket,
+            found_files,
+            folder_prefix,
+            force_flag,
+            max_workers=1,
+            lines_removed=None):
     """
     Retract from a folder in a GCS bucket all records associated with a pid
     pid table must follow schema described in retract_data_bq.PID_TABLE_FIELDS and must reside in sandbox_dataset_id
@@ -141,12 +164,15 @@ def retract(pids, bucket, found_files, folder_prefix, force_flag):
     :param found_files: files found in the current folder
     :param folder_prefix: current folder being processed
     :param force_flag: if False then prompt for each file
+    :param max_workers: maximum number of files to retract from at the same
+        time, once confirmed
+    :param lines_removed: optional dict in which the number of lines removed
+        from each file is recorded by object name
     :return: metadata for each object updated in order to retract
     """
-    result_list = []
+    pids = set(pids)
+    confirmed_files = []
     for file_name in found_files:
-        table_name = file_name.split(".")[0]
-        lines_removed = 0
         file_gcs_path = '%s/%s%s' % (bucket, folder_prefix, file_name)
         if force_flag:
             logging.info(
@@ -160,62 +186,140 @@ def retract(pids, bucket, found_files, folder_prefix, force_flag):
                 % (pids, bucket, folder_prefix, file_name))
             response = get_response()
         if response == "Y":
-            # Output and input file content initialization
-            retracted_file_string = BytesIO()
-            input_file_bytes = gcs_utils.get_object(bucket,
-                                                    folder_prefix + file_name,
-                                                    as_text=False)
-            input_file_lines = input_file_bytes.split(b'\n')
-            input_header = input_file_lines[0]
-            input_contents = input_file_lines[1:]
-            retracted_file_string.write(input_header + b'\n')
-            logging.info("Checking for person_ids %s in path %s" %
-                         (pids, file_gcs_path))
-
-            # Check if file has person_id in first or second column
-            for input_line in input_contents:
-                input_line = input_line.strip()
-                # ensure line is not empty
-                if input_line:
-                    cols = input_line.split(b',')
-                    # ensure at least two columns exist
-                    if len(cols) > 1:
-                        col_1 = cols[0]
-                        col_2 = cols[1]
-                        # skip if non-integer is encountered and keep the line as is
-                        try:
-                            if (table_name in PID_IN_COL1 and int(col_1) in pids) or \
-                                    (table_name in PID_IN_COL2 and int(col_2) in pids):
-                                # do not write back this line since it contains a pid to retract
-                                # increment removed lines counter
-                                lines_removed += 1
-                            else:
-                                # pid not found, retain this line
-                                retracted_file_string.write(input_line + b'\n')
-                        except ValueError:
-                            # write back non-num lines
-                            retracted_file_string.write(input_line + b'\n')
-                    else:
-                        # write back ill-formed lines. Note: These lines do not make it into BigQuery
-                        retracted_file_string.write(input_line + b'\n')
-
-            # Write result back to bucket
-            if lines_removed > 0:
-                logging.info("%d rows retracted from %s, overwriting..." %
-                             (lines_removed, file_gcs_path))
-                upload_result = gcs_utils.upload_object(
-                    bucket, folder_prefix + file_name, retracted_file_string)
-                result_list.append(upload_result)
-                logging.info("Retraction successful for file %s" %
-                             file_gcs_path)
-            else:
-                logging.info("Not updating file %s since pids %s not found" %
-                             (file_gcs_path, pids))
+            confirmed_files.append(file_name)
         elif response.lower() == "n":
             logging.info("Skipping file %s" % file_gcs_path)
+
+    results = task_graph.run_tasks(
+        confirmed_files, [set()] * len(confirmed_files),
+        lambda file_name: retract_file(pids, bucket, folder_prefix, file_name),
+        max_workers=max_workers)
+
+    result_list = []
+    for file_name, (upload_result,
+                    file_lines_removed) in zip(confirmed_files, results):
+        if lines_removed is not None:
+            lines_removed[folder_prefix + file_name] = file_lines_removed
+        if upload_result is not None:
+            result_list.append(upload_result)
     return result_list
 
 
+def get_pid_column(table_name):
+    """
+    Get the position of the person_id column in the files of a table
+
+    :param table_name: identifies the table
+    :return: index of the person_id column or None if retraction does not
+        apply to the table
+    """
+    if table_name in PID_IN_COL1:
+        return 0
+    if table_name in PID_IN_COL2:
+        return 1
+    return None
+
+
+def _split_lines(chunks):
+    """
+    Yield the lines of a file from its chunks, without the line breaks
+
+    :param chunks: iterable of the file contents as chunks of bytes
+    :return: generator of lines, as `bytes.split(b'\\n')` would return them
+    """
+    remainder = b''
+    for chunk in chunks:
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        yield from lines
+    yield remainder
+
+
+def retract_lines(lines, pid_col, pids, out_file):
+    """
+    Write the lines of a file which do not belong to the pids to retract
+
+    The header is kept as is.  Other lines are stripped and empty lines are
+    dropped.  Lines without at least two columns or without an integer
+    person_id are kept.
+
+    :param lines: iterable of the lines of the file, header first
+    :param pid_col: index of the person_id column
+    :param pids: set of person_ids to retract
+    :param out_file: binary file-like object to write the retained lines to
+    :return: number of lines removed
+    """
+    lines = iter(lines)
+    lines_removed = 0
+    out_file.write(next(lines, b'') + b'\n')
+    for input_line in lines:
+        input_line = input_line.strip()
+        # ensure line is not empty
+        if not input_line:
+            continue
+        cols = input_line.split(b',', 2)
+        # ensure at least two columns exist
+        if len(cols) > 1:
+            # skip if non-integer is encountered and keep the line as is
+            try:
+                if int(cols[pid_col]) in pids:
+                    # do not write back this line since it contains a pid to retract
+                    lines_removed += 1
+                    continue
+            except ValueError:
+                pass
+        # write back lines of other pids, non-num and ill-formed lines.
+        # Note: ill-formed lines do not make it into BigQuery
+        out_file.write(input_line + b'\n')
+    return lines_removed
+
+
+def retract_file(pids, bucket, folder_prefix, file_name):
+    """
+    Retract the records associated with pids from a file in a GCS bucket
+
+    The file is read and rewritten in chunks, so it is never held in memory
+    as a whole.  It is only rewritten if lines were removed.
+
+    :param pids: set of person_ids to retract
+    :param bucket: bucket containing records to retract
+    :param folder_prefix: folder containing the file
+    :param file_name: name of the file
+    :return: tuple of the metadata of the updated object, or None if it was
+        not updated, and the number of lines removed
+    """
+    file_gcs_path = '%s/%s%s' % (bucket, folder_prefix, file_name)
+    pid_col = get_pid_column(file_name.split(".")[0])
+    if pid_col is None:
+        logging.info("Not updating file %s since it has no person_id column" %
+                     file_gcs_path)
+        return None, 0
+
+    logging.info("Checking for person_ids %s in path %s" %
+                 (pids, file_gcs_path))
+    # output is only spilled to disk if larger than a chunk
+    with tempfile.SpooledTemporaryFile(
+            max_size=gcs_utils.GCS_DEFAULT_CHUNK_SIZE) as retracted_file:
+        chunks = gcs_utils.get_object_chunks(bucket, folder_prefix + file_name)
+        lines_removed = retract_lines(_split_lines(chunks), pid_col, pids,
+                                      retracted_file)
+
+        # Write result back to bucket
+        if lines_removed == 0:
+            logging.info("Not updating file %s since pids %s not found" %
+                         (file_gcs_path, pids))
+            return None, 0
+        logging.info("%d rows retracted from %s, overwriting..." %
+                     (lines_removed, file_gcs_path))
+        retracted_file.seek(0)
+        upload_result = gcs_utils.upload_object(bucket,
+                                                folder_prefix + file_name,
+                                                retracted_file,
+                                                resumable=True)
+    logging.info("Retraction successful for file %s" % file_gcs_path)
+    return upload_result, lines_removed
+
+
 # Make sure user types Y to proceed
 def get_response():
     prompt_text = 'Please press Y/n\n'
@@ -297,10 +401,23 @@ if __name__ == '__main__':
         action='store_true',
         help='Optional. Indicates pids must be retracted without user prompts',
         required=False)
+    parser.add_argument(
+        '-w',
+        '--max_workers',
+        dest='max_workers',
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=
+        'Optional. Maximum number of files to retract from at the same time',
+        required=False)
 
     args = parser.parse_args()
 
     # result is mainly for debugging file uploads
-    result = run_gcs_retraction(args.project_id, args.sandbox_dataset_id,
-                                args.pid_table_id, args.hpo_id,
-                                args.folder_name, args.force_flag)
+    result = run_gcs_retraction(args.project_id,
+                                args.sandbox_dataset_id,
+                                args.pid_table_id,
+                                args.hpo_id,
+                                args.folder_name,
+                                args.force_flag,
+                                max_workers=args.max_workers)
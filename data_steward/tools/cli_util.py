@@ -1,6 +1,8 @@
 import json
 import os
 
+from utils import client_cache
+
 PROJECT_ID = 'project_id'
 APPLICATION_ID = 'APPLICATION_ID'
 GOOGLE_APPLICATION_CREDENTIALS = 'GOOGLE_APPLICATION_CREDENTIALS'
@@ -29,6 +31,8 @@ def activate_creds(creds_path):
         raise OSError('%s does not refer to a valid GCP key file' % creds_path)
     os.environ[APPLICATION_ID] = project_id
     os.environ[GOOGLE_APPLICATION_CREDENTIALS] = creds_path
+    # clients built with previous credentials must not be reused
+    client_cache.invalidate()
     return creds
 
 
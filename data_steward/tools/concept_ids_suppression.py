@@ -23,6 +23,7 @@ from jinja2 import Environment
 
 # Project Imports
 from resources import DEID_PATH
+from utils import bq
 
 LOGGER = logging.getLogger(__name__)
 LOGS_PATH = '../logs'
@@ -38,6 +39,8 @@ jinja_env = Environment(
     # with these comment delimiters
     comment_start_string='--',
     comment_end_string=' --')
+# compiles each query once per process
+query_templates = bq.TemplateRegistry(env=jinja_env)
 
 COVID_CONCEPT_IDS_QUERY = """
 SELECT
@@ -146,8 +149,8 @@ def get_concepts_via_query(input_dataset, client):
         "Running queries to append data to _concept_ids_suppression table")
     for q in queries:
         query_data_df = client.query(
-            jinja_env.from_string(q).render(
-                input_dataset=input_dataset)).to_dataframe()
+            query_templates.render(q,
+                                   input_dataset=input_dataset)).to_dataframe()
         # verify csv file contains 'concept_id' column
         if check_concept_id_field(query_data_df):
             final_query_data_df = final_query_data_df.append(query_data_df)
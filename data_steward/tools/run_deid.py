@@ -4,8 +4,11 @@ Deid runner.
 A central script to execute deid for each table needing de-identification.
 """
 
+import json
 import logging
 import os
+import re
+import time
 from argparse import ArgumentParser
 # Python imports
 from datetime import datetime
@@ -21,6 +24,7 @@ import deid.aou as aou
 from deid.parser import odataset_name_verification
 from resources import fields_for, fields_path, DEID_PATH
 from utils import bq
+from utils.task_graph import run_tasks
 
 LOGGER = logging.getLogger(__name__)
 DEID_TABLES = [
@@ -41,6 +45,9 @@ DEID_MAP_TABLE = '_deid_map'
 PIPELINE_TABLES_DATASET = 'pipeline_tables'
 
 LOGS_PATH = 'LOGS'
+DEFAULT_MAX_WORKERS = 4
+# references to tables of the output dataset in deid rules and table configs
+ODATASET_TABLE_REGEX = re.compile(r':odataset\.(\w+)')
 
 jinja_env = Environment(
     # help protect against cross-site scripting vulnerabilities
@@ -248,7 +255,25 @@ def parse_args(raw_args=None):
                         action='store_true',
                         required=False,
                         help='Log to the console as well as to a file.')
+    parser.add_argument(
+        '--map-responses-in-warehouse',
+        dest='map_responses_in_warehouse',
+        action='store_true',
+        required=False,
+        help=('Map questionnaire response ids in BigQuery, only appending '
+              'unmapped responses to the existing mapping table.  Defaults '
+              'to rebuilding the mapping table if it is out of date.'))
     parser.add_argument('--version', action='version', version='deid-02')
+    parser.add_argument(
+        '-w',
+        '--max-workers',
+        dest='max_workers',
+        action='store',
+        type=int,
+        required=False,
+        default=DEFAULT_MAX_WORKERS,
+        help=('Maximum number of tables to de-identify at the same time.  '
+              'Tables are de-identified one at a time if 1.'))
     parser.add_argument('-m',
                         '--age_limit',
                         dest='age_limit',
@@ -305,6 +330,156 @@ def load_deid_map_table(deid_map_dataset_name, age_limit):
         )
 
 
+def get_parameter_list(args, table, configured_tables, deid_tables_path):
+    """
+    Get the command line arguments of the deid press of a table.
+
+    :param args:  parsed command line arguments of run_deid
+    :param table:  name of the table to de-identify
+    :param configured_tables:  names of the tables having a deid configuration
+    :param deid_tables_path:  path to the deid configurations of the tables
+    :return:  list of command line arguments for deid.aou
+    """
+    if table in configured_tables:
+        tablepath = os.path.join(deid_tables_path, table + '.json')
+    else:
+        tablepath = table
+
+    parameter_list = [
+        '--rules',
+        os.path.join(DEID_PATH, 'config', 'ids', 'config.json'),
+        '--private_key', args.private_key, '--table', tablepath, '--action',
+        args.action, '--idataset', args.input_dataset, '--log', LOGS_PATH,
+        '--odataset', args.odataset, '--age-limit', args.age_limit
+    ]
+
+    if args.interactive_mode:
+        parameter_list.append('--interactive')
+
+    if args.map_responses_in_warehouse:
+        parameter_list.append('--map-responses-in-warehouse')
+
+    field_names = [field.get('name') for field in fields_for(table)]
+    if 'person_id' in field_names:
+        parameter_list.append('--cluster')
+
+    return parameter_list
+
+
+def get_table_dependencies(tables, configured_tables, deid_tables_path,
+                           rules_path):
+    """
+    Get the tables each table's de-identification reads the output of.
+
+    A table depends on another table if its configuration, or the DML
+    statements run on its output, reference the other table in the output
+    dataset.
+
+    :param tables:  names of the tables to de-identify
+    :param configured_tables:  names of the tables having a deid configuration
+    :param deid_tables_path:  path to the deid configurations of the tables
+    :param rules_path:  path to the deid rules
+    :return:  list whose i-th item is the set of indexes of the tables the i-th
+        table depends on
+    """
+    with open(rules_path) as rules_file:
+        rules = json.load(rules_file)
+    dml_statements = {}
+    for rule in rules:
+        if rule.get('_id') == 'dml_statements':
+            dml_statements = rule
+
+    dependencies = []
+    for table in tables:
+        references = [json.dumps(dml_statements.get(table, ''))]
+        if table in configured_tables:
+            with open(os.path.join(deid_tables_path,
+                                   table + '.json')) as table_file:
+                references.append(table_file.read())
+        referenced_tables = set(
+            ODATASET_TABLE_REGEX.findall(' '.join(references)))
+        dependencies.append({
+            i for i, other in enumerate(tables)
+            if other != table and other in referenced_tables
+        })
+    return dependencies
+
+
+def run_presses(tables,
+                parameter_lists,
+                dependencies,
+                max_workers=1,
+                context=None):
+    """
+    De-identify tables, running independent tables concurrently.
+
+    Presses are created one at a time first, since initializing a press
+    sets up lookup tables shared by all presses.  Presses sharing a run
+    context set up these tables, and the output dataset, only once.  The
+    presses are then run on a bounded pool of workers, each table starting
+    once the tables it depends on were de-identified.  A table is skipped if
+    a table it depends on could not be de-identified.
+
+    :param tables:  names of the tables to de-identify
+    :param parameter_lists:  list of the command line arguments of the deid
+        press of each table
+    :param dependencies:  list whose i-th item is the set of indexes of the
+        tables the i-th table depends on
+    :param max_workers:  maximum number of tables to de-identify at the same
+        time
+    :param context:  deid.aou.RunContext shared by the presses, if any
+    :return:  tuple of the list of tables successfully de-identified, the list
+        of tables which encountered exceptions, and a dict mapping each table
+        to its elapsed time in seconds
+    """
+    handles = {}
+    elapsed_times = {}
+    for i, (table, parameter_list) in enumerate(zip(tables, parameter_lists)):
+        LOGGER.info(
+            f"Executing deid with:\n\tpython deid/aou.py {' '.join(parameter_list)}"
+        )
+        start = time.time()
+        try:
+            handles[i] = aou.create_press(parameter_list, context=context)
+        except (google.api_core.exceptions.GoogleAPIError,
+                bq_utils.BigQueryJobWaitError):
+            LOGGER.exception("Encountered deid exception:\n")
+        elapsed_times[table] = time.time() - start
+
+    succeeded = [False] * len(tables)
+
+    def run_press(i):
+        table = tables[i]
+        if i not in handles:
+            return
+        if not all(succeeded[j] for j in dependencies[i]):
+            LOGGER.error(f"Skipping deid on table: {table} because a table "
+                         f"it depends on could not be de-identified")
+            return
+        start = time.time()
+        try:
+            # presses which could not be initialized already logged why
+            if handles[i] is not None:
+                handles[i].do()
+        except (google.api_core.exceptions.GoogleAPIError,
+                bq_utils.BigQueryJobWaitError):
+            LOGGER.exception("Encountered deid exception:\n")
+        else:
+            LOGGER.info(f"Successfully executed deid on table: {table}")
+            succeeded[i] = True
+        finally:
+            elapsed_times[table] += time.time() - start
+
+    run_tasks(list(range(len(tables))),
+              dependencies,
+              run_press,
+              max_workers=max_workers)
+
+    successes = [table for i, table in enumerate(tables) if succeeded[i]]
+    exceptions = [table for i, table in enumerate(tables) if not succeeded[i]]
+    return successes, exceptions, elapsed_times
+
+
 def main(raw_args=None):
     """
     Execute deid as a single script.
@@ -323,48 +498,29 @@ def main(raw_args=None):
                         age_limit=args.age_limit)
     logging.info(f"Loaded {DEID_MAP_TABLE} table.")
 
-    exceptions = []
-    successes = []
-    for table in tables:
-        tablepath = None
-        if table in configured_tables:
-            tablepath = os.path.join(deid_tables_path, table + '.json')
-        else:
-            tablepath = table
-
-        parameter_list = [
-            '--rules',
-            os.path.join(DEID_PATH, 'config', 'ids', 'config.json'),
-            '--private_key', args.private_key, '--table', tablepath, '--action',
-            args.action, '--idataset', args.input_dataset, '--log', LOGS_PATH,
-            '--odataset', args.odataset, '--age-limit', args.age_limit
-        ]
-
-        if args.interactive_mode:
-            parameter_list.append('--interactive')
-
-        field_names = [field.get('name') for field in fields_for(table)]
-        if 'person_id' in field_names:
-            parameter_list.append('--cluster')
-
-        LOGGER.info(
-            f"Executing deid with:\n\tpython deid/aou.py {' '.join(parameter_list)}"
-        )
-
-        try:
-            aou.main(parameter_list)
-        except google.api_core.exceptions.GoogleAPIError:
-            LOGGER.exception("Encountered deid exception:\n")
-            exceptions.append(table)
-        else:
-            LOGGER.info(f"Successfully executed deid on table: {table}")
-            successes.append(table)
+    parameter_lists = [
+        get_parameter_list(args, table, configured_tables, deid_tables_path)
+        for table in tables
+    ]
+    dependencies = get_table_dependencies(
+        tables, configured_tables, deid_tables_path,
+        os.path.join(DEID_PATH, 'config', 'ids', 'config.json'))
+    context = aou.RunContext(args.private_key)
+    successes, exceptions, elapsed_times = run_presses(
+        tables,
+        parameter_lists,
+        dependencies,
+        max_workers=args.max_workers,
+        context=context)
 
     copy_suppressed_table_schemas(known_tables, args.odataset)
 
     LOGGER.info(
         "Deid has finished.  Successfully executed on tables: {}".format(
             '\n'.join(successes)))
+    for table in tables:
+        LOGGER.info(f"Deid on table: {table} took "
+                    f"{elapsed_times[table]:.1f} seconds")
     for exc in exceptions:
         LOGGER.error(f"Deid encountered exceptions when processing table: {exc}"
                      f".  Fix problems and re-run deid for table if needed.")
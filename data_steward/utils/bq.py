@@ -2,10 +2,14 @@
 A utility to standardize use of the BigQuery python client library.
 """
 # Python Imports
+import hashlib
 import logging
 import os
+import threading
+import time
 import typing
 import warnings
+from collections import OrderedDict
 
 # Third-party imports
 from google.api_core.exceptions import GoogleAPIError, BadRequest
@@ -15,7 +19,7 @@ import jinja2
 
 # Project Imports
 from app_identity import PROJECT_ID
-from utils import auth
+from utils import auth, client_cache
 from constants.utils import bq as consts
 from resources import fields_for
 
@@ -69,6 +73,181 @@ CLUSTER BY
 
 DATASET_COLUMNS_TPL = JINJA_ENV.from_string(consts.DATASET_COLUMNS_QUERY)
 
+STRICT_JINJA_ENV = JINJA_ENV.overlay(undefined=jinja2.StrictUndefined)
+
+
+class TemplateRegistry(object):
+    """
+    Compiles each Jinja template once and keeps timing counters
+
+    Templates are keyed by the name they are registered with, or by a hash
+    of their source, so that rules generating a query per table or per HPO
+    in a loop compile their template once and only pay for rendering.
+    Rendering fails on undefined variables instead of silently producing
+    empty strings in the generated SQL.
+
+    Named templates are kept until the registry is cleared. Unnamed templates
+    are evicted, least recently used first, once there are more than
+    `max_unnamed` of them, so templates whose source is built in a loop
+    should be registered under a name instead.
+    """
+
+    def __init__(self,
+                 env=STRICT_JINJA_ENV,
+                 max_unnamed=consts.MAX_UNNAMED_TEMPLATES):
+        """
+        :param env: jinja2.Environment used to compile the templates
+        :param max_unnamed: maximum number of unnamed templates kept compiled
+        """
+        self.env = env
+        self.max_unnamed = max_unnamed
+        self._templates = dict()
+        self._sources = dict()
+        self._stats = dict()
+        self._unnamed = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_source_key(source):
+        """
+        Get the key identifying an unnamed template
+
+        :param source: source of the template
+        :return: key derived from the hash of the source
+        """
+        return 'sha256:' + hashlib.sha256(source.encode()).hexdigest()
+
+    def _compile(self, key, source, named=False):
+        """
+        Get the template compiled from source, compiling it if needed
+
+        :param key: name or source key of the template
+        :param source: source of the template
+        :param named: True if the template is registered under a name
+        :return: the compiled jinja2.Template
+        """
+        with self._lock:
+            template = self._templates.get(key)
+            stats = self._stats.setdefault(
+                key, dict.fromkeys(consts.TEMPLATE_STAT_KEYS, 0))
+            if key in self._unnamed:
+                self._unnamed.move_to_end(key)
+            if template is not None:
+                stats[consts.CACHE_HITS] += 1
+                return template
+            start = time.perf_counter()
+            template = self.env.from_string(source)
+            stats[consts.COMPILES] += 1
+            stats[consts.COMPILE_SECONDS] += time.perf_counter() - start
+            self._templates[key] = template
+            self._sources[key] = source
+            if not named:
+                self._unnamed[key] = None
+                while len(self._unnamed) > self.max_unnamed:
+                    evicted_key, _ = self._unnamed.popitem(last=False)
+                    del self._templates[evicted_key]
+                    del self._sources[evicted_key]
+                    del self._stats[evicted_key]
+            return template
+
+    def register(self, name, source):
+        """
+        Compile a template and register it under a name
+
+        :param name: name identifying the template
+        :param source: source of the template
+        :return: the compiled jinja2.Template
+        :raises ValueError: if another template is registered under the name
+        """
+        with self._lock:
+            registered_source = self._sources.get(name)
+        if registered_source is not None and registered_source != source:
+            raise ValueError(
+                f'Another template is already registered as `{name}`')
+        return self._compile(name, source, named=True)
+
+    def _get_key(self, template):
+        """
+        Get the key of a template
+
+        :param template: name of a registered template or template source
+        :return: the name of a registered template or the key of its source
+        """
+        with self._lock:
+            if template in self._sources:
+                return template
+        return self.get_source_key(template)
+
+    def get_template(self, template):
+        """
+        Get a compiled template
+
+        :param template: name of a registered template or template source
+        :return: the compiled jinja2.Template
+        """
+        key = self._get_key(template)
+        return self._compile(key,
+                             self._sources.get(key, template),
+                             named=key == template)
+
+    def render(self, template, **kwargs):
+        """
+        Render a template, compiling it only the first time it is seen
+
+        :param template: name of a registered template or template source
+        :param kwargs: variables referenced in the template
+        :return: the rendered string
+        :raises jinja2.UndefinedError: if a variable in the template is not
+            provided
+        """
+        key = self._get_key(template)
+        compiled = self._compile(key,
+                                 self._sources.get(key, template),
+                                 named=key == template)
+        start = time.perf_counter()
+        result = compiled.render(**kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats.setdefault(
+                key, dict.fromkeys(consts.TEMPLATE_STAT_KEYS, 0))
+            stats[consts.RENDERS] += 1
+            stats[consts.RENDER_SECONDS] += elapsed
+        return result
+
+    def get_stats(self):
+        """
+        Get the timing counters of the templates
+
+        :return: dict mapping the name or source key of each template to a
+            dict of its counters
+        """
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def clear(self):
+        """
+        Drop all compiled templates and counters
+        """
+        with self._lock:
+            self._templates.clear()
+            self._sources.clear()
+            self._stats.clear()
+            self._unnamed.clear()
+
+
+TEMPLATE_REGISTRY = TemplateRegistry()
+
+
+def render_template(template, **kwargs):
+    """
+    Render a template using the shared registry of compiled templates
+
+    :param template: name of a registered template or template source
+    :param kwargs: variables referenced in the template
+    :return: the rendered string
+    """
+    return TEMPLATE_REGISTRY.render(template, **kwargs)
+
 
 def get_client(project_id=None, scopes=None):
     """
@@ -79,11 +258,26 @@ def get_client(project_id=None, scopes=None):
         the project_id.
     :param scopes: List of Google scopes as strings
 
+    :return:  A bigquery Client object.
+    """
+    scopes = tuple(scopes) if scopes else None
+    key = ('bigquery.Client', project_id, scopes)
+    return client_cache.get(key, lambda: _create_client(project_id, scopes))
+
+
+def _create_client(project_id=None, scopes=None):
+    """
+    Create a new client for a specified project.
+
+    :param project_id:  Name of the project to create a bigquery library client for
+    :param scopes: List of Google scopes as strings
+
     :return:  A bigquery Client object.
     """
     if scopes:
         credentials, project_id = default()
-        credentials = auth.delegated_credentials(credentials, scopes=scopes)
+        credentials = auth.delegated_credentials(credentials,
+                                                 scopes=list(scopes))
         return bigquery.Client(project=project_id, credentials=credentials)
     if project_id is None:
         LOGGER.info(f"You should specify project_id for a reliable experience."
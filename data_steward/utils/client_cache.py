@@ -0,0 +1,85 @@
+"""
+A process-wide cache of Google API clients and discovery based services.
+
+Building a discovery based service parses the API discovery document and
+constructing a client sets up credentials, both of which dominate the cost of
+small API calls. Clients are built once per key (e.g. API, project and scopes)
+and reused until the cache is invalidated, which must be done whenever the
+active credentials change.
+
+Discovery based services share an `httplib2.Http` object which is not
+thread-safe, so those are cached separately for every thread.
+
+Clients are built outside of the cache-wide lock, so that building a slow
+client only blocks the threads waiting for the same key.
+"""
+# Python imports
+import logging
+import threading
+from collections import Counter
+
+LOGGER = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = dict()
+# locks serializing the builds of each key, so that a client is built once
+_key_locks = dict()
+# incremented on invalidation so that clients built meanwhile are not cached
+_generation = 0
+_build_counts = Counter()
+
+
+def get(key, factory, per_thread=False):
+    """
+    Get the client cached under a key, building it on first use
+
+    :param key: hashable tuple identifying the client, whose first item names
+        the kind of client (e.g. ('bigquery', 'v2', None))
+    :param factory: callable taking no arguments that builds the client
+    :param per_thread: if True, each thread gets its own instance of the client
+    :return: the cached client
+    """
+    cache_key = (key, threading.get_ident() if per_thread else None)
+    with _lock:
+        client = _clients.get(cache_key)
+        if client is not None:
+            return client
+        key_lock = _key_locks.setdefault(cache_key, threading.Lock())
+
+    with key_lock:
+        with _lock:
+            client = _clients.get(cache_key)
+            generation = _generation
+        if client is not None:
+            return client
+        client = factory()
+        with _lock:
+            if generation == _generation:
+                _clients[cache_key] = client
+            _build_counts[key[0]] += 1
+        LOGGER.debug(f"Built client for {key}")
+        return client
+
+
+def invalidate():
+    """
+    Discard all cached clients, e.g. after credentials are refreshed or changed
+    """
+    global _generation
+    with _lock:
+        _clients.clear()
+        _key_locks.clear()
+        _generation += 1
+
+
+def get_build_count(name=None):
+    """
+    Get the number of clients built since the process started
+
+    :param name: the kind of client to count (all kinds by default)
+    :return: number of clients built
+    """
+    with _lock:
+        if name is None:
+            return sum(_build_counts.values())
+        return _build_counts[name]
@@ -0,0 +1,75 @@
+"""
+Run interdependent tasks concurrently on a bounded thread pool.
+
+Tasks are identified by their index in a list and each task lists the indexes
+of the tasks which must complete before it starts. A task is submitted as soon
+as all of its dependencies completed, so the total run time approaches that of
+the longest chain of dependent tasks rather than the sum of all tasks.
+"""
+# Python imports
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Project imports
+from curation_logging.curation_gae_handler import flush_thread_logs
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _run_in_worker(run_task, task):
+    try:
+        return run_task(task)
+    finally:
+        flush_thread_logs()
+
+
+def run_tasks(tasks, dependencies, run_task, max_workers=1):
+    """
+    Run tasks concurrently in an order respecting their dependencies
+
+    No further tasks are started once a task fails and the first error is
+    raised after the running tasks complete.
+
+    :param tasks: list of tasks, in an order which respects their dependencies
+    :param dependencies: list whose i-th item is the collection of indexes of
+        the tasks which must complete before the i-th task starts
+    :param run_task: callable running a single task to completion
+    :param max_workers: maximum number of tasks to run at the same time;
+        tasks are run sequentially in the calling thread if 1 or less
+    :return: list of the values returned by `run_task` for each task
+    """
+    if max_workers <= 1:
+        return [run_task(task) for task in tasks]
+
+    dependents = defaultdict(list)
+    for i, task_dependencies in enumerate(dependencies):
+        for j in task_dependencies:
+            dependents[j].append(i)
+    remaining = [len(task_dependencies) for task_dependencies in dependencies]
+    ready = deque(i for i, count in enumerate(remaining) if count == 0)
+    results = [None] * len(tasks)
+    running = dict()
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while running or (ready and error is None):
+            while ready and error is None:
+                i = ready.popleft()
+                future = executor.submit(_run_in_worker, run_task, tasks[i])
+                running[future] = i
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    LOGGER.exception(f"Task {i} failed")
+                    error = error or e
+                    continue
+                for j in dependents[i]:
+                    remaining[j] -= 1
+                    if remaining[j] == 0:
+                        ready.append(j)
+    if error is not None:
+        raise error
+    return results
@@ -14,6 +14,7 @@ ACHILLES_TABLES = [ACHILLES_ANALYSIS, ACHILLES_RESULTS, ACHILLES_RESULTS_DIST]
 ACHILLES_DML_SQL_PATH = os.path.join(resources.resource_files_path,
                                      'achilles_dml.sql')
 INSERT_INTO = 'insert into'
+BQ_TYPES = {'integer': 'INT64', 'string': 'STRING', 'float': 'FLOAT64'}
 
 
 def _get_run_analysis_commands(hpo_id):
@@ -22,6 +23,86 @@ def _get_run_analysis_commands(hpo_id):
     return commands
 
 
+def _get_source_table(command, cdm_table_ids):
+    """
+    Get the first CDM table read by a command, used to group analyses
+    """
+    for table_name in sql_wrangle.READ_TABLE_PATTERN.findall(command):
+        if table_name.lower() in cdm_table_ids:
+            return table_name.lower()
+    return None
+
+
+def _get_results_fields(table_id):
+    """
+    Get the schema of the achilles results table with the specified id
+    """
+    if table_id.endswith(ACHILLES_RESULTS_DIST):
+        return resources.fields_for(ACHILLES_RESULTS_DIST)
+    return resources.fields_for(ACHILLES_RESULTS)
+
+
+def _get_single_pass_query(query, column_names, fields):
+    """
+    Select the output of an analysis query as all the columns of its results
+    table, filling columns the analysis does not populate with NULL
+    """
+    select_exprs = []
+    for field in fields:
+        name = field['name']
+        value = name if name in column_names else 'NULL'
+        select_exprs.append(
+            f'CAST({value} AS {BQ_TYPES[field["type"]]}) AS {name}')
+    return f'SELECT {", ".join(select_exprs)} FROM ({query})'
+
+
+def _get_single_pass_commands(hpo_id):
+    """
+    Get the achilles commands with the analyses of each source table combined
+
+    Analyses appending to the same results table and reading the same CDM
+    table are combined into a single INSERT of the UNION ALL of their queries,
+    so each source table is queried by one job instead of one per analysis.
+    Commands whose output columns cannot be determined are kept as they are.
+
+    :param hpo_id: hpo_id of the site to run on
+    :return: list of commands
+    """
+    cdm_table_ids = {
+        bq_utils.get_table_id(hpo_id, table_name).lower()
+        for table_name in resources.CDM_TABLES
+    }
+    commands = []
+    groups = dict()
+    for command in _get_run_analysis_commands(hpo_id):
+        insert_parts = sql_wrangle.get_insert_parts(command)
+        if insert_parts is None:
+            commands.append(command)
+            continue
+        table_id, column_names, query = insert_parts
+        if sql_wrangle.get_output_columns(query) != column_names:
+            commands.append(command)
+            continue
+        key = (table_id, _get_source_table(query, cdm_table_ids))
+        if key not in groups:
+            groups[key] = []
+            commands.append(key)
+        groups[key].append(
+            _get_single_pass_query(query, column_names,
+                                   _get_results_fields(table_id)))
+
+    single_pass_commands = []
+    for command in commands:
+        if isinstance(command, tuple):
+            table_id, _ = command
+            queries = groups[command]
+            columns = [field['name'] for field in _get_results_fields(table_id)]
+            command = (f'insert into {table_id} ({", ".join(columns)}) ' +
+                       ' UNION ALL '.join(queries))
+        single_pass_commands.append(command)
+    return single_pass_commands
+
+
 def load_analyses(hpo_id):
     """
     Populate achilles lookup table
@@ -81,18 +162,36 @@ def run_analysis_job(command):
         raise RuntimeError('Job id %s taking too long' % job_id)
 
 
-def run_analyses(hpo_id):
+def run_command(command):
+    """
+    Runs a single achilles command to completion
+    :param command: query to run
+    :return: None
+    """
+    if sql_wrangle.is_truncate(command) or sql_wrangle.is_drop(command):
+        drop_or_truncate_table(command)
+    else:
+        run_analysis_job(command)
+
+
+def run_analyses(hpo_id, max_workers=1, single_pass=False):
     """
     Run the achilles analyses
+
+    Independent analyses are run concurrently, see
+    `sql_wrangle.get_command_dependencies`.
+
     :param hpo_id: hpo_id of the site to run on
+    :param max_workers: maximum number of analyses to run at the same time
+    :param single_pass: if True, run the analyses of each source table in a
+        single query, see `_get_single_pass_commands`
     :return: None
     """
-    commands = _get_run_analysis_commands(hpo_id)
-    for command in commands:
-        if sql_wrangle.is_truncate(command) or sql_wrangle.is_drop(command):
-            drop_or_truncate_table(command)
-        else:
-            run_analysis_job(command)
+    if single_pass:
+        commands = _get_single_pass_commands(hpo_id)
+    else:
+        commands = _get_run_analysis_commands(hpo_id)
+    sql_wrangle.run_commands(commands, run_command, max_workers=max_workers)
 
 
 def create_tables(hpo_id, drop_existing=False):
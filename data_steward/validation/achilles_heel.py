@@ -101,19 +101,32 @@ def run_heel_analysis_job(command):
         raise RuntimeError('Job id %s taking too long' % job_id)
 
 
-def run_heel(hpo_id):
+def run_command(command):
+    """
+    Runs a single heel command to completion
+
+    :param command: query to run
+    :returns: None
+    """
+    if sql_wrangle.is_truncate(command) or sql_wrangle.is_drop(command):
+        drop_or_truncate_table(command)
+    else:
+        run_heel_analysis_job(command)
+
+
+def run_heel(hpo_id, max_workers=1):
     """
     Run heel commands
 
+    Commands which do not depend on each other's results are run concurrently,
+    see `sql_wrangle.get_command_dependencies`.
+
     :param hpo_id:  string name for the hpo identifier
+    :param max_workers: maximum number of commands to run at the same time
     :returns: None
     """
-    commands = _get_heel_commands(hpo_id)
-    for command in commands:
-        if sql_wrangle.is_truncate(command) or sql_wrangle.is_drop(command):
-            drop_or_truncate_table(command)
-        else:
-            run_heel_analysis_job(command)
+    commands = list(_get_heel_commands(hpo_id))
+    sql_wrangle.run_commands(commands, run_command, max_workers=max_workers)
 
 
 def create_tables(hpo_id, drop_existing=False):
@@ -71,6 +71,7 @@ TODO
  * Besides `visit_occurrence` also handle mapping of other foreign key fields (e.g. `location_id`)
 """
 import argparse
+import functools
 import logging
 
 import app_identity
@@ -81,6 +82,7 @@ import common
 from constants.validation import ehr_union as eu_constants
 import resources
 from constants.tools.combine_ehr_rdr import PERSON_TABLE, OBSERVATION_TABLE
+from utils import task_graph
 
 UNION_ALL = '''
 
@@ -114,7 +116,11 @@ def output_table_for(table_id):
     return 'unioned_ehr_' + table_id
 
 
-def _mapping_subqueries(table_name, hpo_ids, dataset_id, project_id):
+def _mapping_subqueries(table_name,
+                        hpo_ids,
+                        dataset_id,
+                        project_id,
+                        hpo_offsets=None):
     """
     Get list of subqueries (one for each HPO table found in the source) that comprise the ID mapping query
 
@@ -122,10 +128,12 @@ def _mapping_subqueries(table_name, hpo_ids, dataset_id, project_id):
     :param hpo_ids: list of HPOs to process
     :param dataset_id: identifies the source dataset
     :param project_id: identifies the GCP project
+    :param hpo_offsets: (optional) dict mapping hpo_id => numeric offset, by
+        default as returned by `get_hpo_offsets(hpo_ids)`
     :return: list of subqueries
     """
     result = []
-    hpo_unique_identifiers = get_hpo_offsets(hpo_ids)
+    hpo_unique_identifiers = hpo_offsets or get_hpo_offsets(hpo_ids)
 
     # Exclude subqueries that reference tables that are missing from source dataset
     all_table_ids = bq_utils.list_all_table_ids(dataset_id)
@@ -150,7 +158,11 @@ def _mapping_subqueries(table_name, hpo_ids, dataset_id, project_id):
     return result
 
 
-def mapping_query(table_name, hpo_ids, dataset_id=None, project_id=None):
+def mapping_query(table_name,
+                  hpo_ids,
+                  dataset_id=None,
+                  project_id=None,
+                  hpo_offsets=None):
     """
     Get query used to generate new ids for a CDM table
 
@@ -158,6 +170,7 @@ def mapping_query(table_name, hpo_ids, dataset_id=None, project_id=None):
     :param hpo_ids: identifies the HPOs
     :param dataset_id: identifies the BQ dataset containing the input table
     :param project_id: identifies the GCP project containing the dataset
+    :param hpo_offsets: (optional) dict mapping hpo_id => numeric offset
     :return: the query
     """
     if dataset_id is None:
@@ -165,7 +178,7 @@ def mapping_query(table_name, hpo_ids, dataset_id=None, project_id=None):
     if project_id is None:
         project_id = app_identity.get_application_id()
     subqueries = _mapping_subqueries(table_name, hpo_ids, dataset_id,
-                                     project_id)
+                                     project_id, hpo_offsets)
     union_all_query = UNION_ALL.join(subqueries)
     return '''
     WITH all_{table_name} AS (
@@ -190,24 +203,32 @@ def mapping_table_for(domain_table):
     return '_mapping_' + domain_table
 
 
-def mapping(domain_table, hpo_ids, input_dataset_id, output_dataset_id,
-            project_id):
+def mapping(domain_table,
+            hpo_ids,
+            input_dataset_id,
+            output_dataset_id,
+            project_id,
+            hpo_offsets=None,
+            write_disposition='WRITE_TRUNCATE'):
     """
     Create and load a table that assigns unique ids to records in domain tables
-    Note: Overwrites destination table if it already exists
+    Note: Overwrites destination table if it already exists, unless appending
 
     :param domain_table:
     :param hpo_ids: identifies which HPOs' data to include in union
     :param input_dataset_id: identifies dataset with multiple CDMs, each from an HPO submission
     :param output_dataset_id: identifies dataset where mapping table should be output
     :param project_id: identifies GCP project that contain the datasets
+    :param hpo_offsets: (optional) dict mapping hpo_id => numeric offset
+    :param write_disposition: WRITE_TRUNCATE (default) or WRITE_APPEND
     :return:
     """
-    q = mapping_query(domain_table, hpo_ids, input_dataset_id, project_id)
+    q = mapping_query(domain_table, hpo_ids, input_dataset_id, project_id,
+                      hpo_offsets)
     mapping_table = mapping_table_for(domain_table)
     logging.info('Query for {mapping_table} is {q}'.format(
         mapping_table=mapping_table, q=q))
-    query(q, mapping_table, output_dataset_id, 'WRITE_TRUNCATE')
+    query(q, mapping_table, output_dataset_id, write_disposition)
 
 
 def query(q, dst_table_id, dst_dataset_id, write_disposition='WRITE_APPEND'):
@@ -720,7 +741,341 @@ def map_ehr_person_to_observation(output_dataset_id):
     query(q, dst_table_id, dst_dataset_id, write_disposition='WRITE_APPEND')
 
 
-def main(input_dataset_id, output_dataset_id, project_id, hpo_ids=None):
+def run_dml(q):
+    """
+    Run a DML statement and wait for it to complete
+
+    :param q: SQL statement
+    :return: query result
+    """
+    query_job_result = bq_utils.query(q)
+    query_job_id = query_job_result['jobReference']['jobId']
+    incomplete_jobs = bq_utils.wait_on_jobs([query_job_id])
+    if len(incomplete_jobs) > 0:
+        raise bq_utils.BigQueryJobWaitError(incomplete_jobs)
+    return query_job_result
+
+
+def get_table_fingerprints(hpo_ids, input_dataset_id, project_id):
+    """
+    Get the last modified time and row count of each submitted CDM table
+
+    :param hpo_ids: identifies the HPOs
+    :param input_dataset_id: identifies dataset containing HPO submissions
+    :param project_id: identifies GCP project that contains the dataset
+    :return: dict mapping (hpo_id, table_name) => (last_modified_time, row_count)
+    """
+    table_keys = {
+        bq_utils.get_table_id(hpo_id, table_name): (hpo_id, table_name)
+        for hpo_id in hpo_ids for table_name in resources.CDM_TABLES
+    }
+    q = eu_constants.TABLE_FINGERPRINTS_QUERY.format(
+        project_id=project_id, dataset_id=input_dataset_id)
+    response = bq_utils.query(q)
+    fingerprints = dict()
+    for row in bq_utils.iter_query_rows(response):
+        key = table_keys.get(row['table_id'])
+        if key is not None:
+            fingerprints[key] = (row[eu_constants.LAST_MODIFIED_TIME],
+                                 row[eu_constants.ROW_COUNT])
+    return fingerprints
+
+
+def get_union_state(output_dataset_id, project_id):
+    """
+    Get the table fingerprints and HPO offsets saved by the last union
+
+    :param output_dataset_id: identifies dataset where the union is stored
+    :param project_id: identifies GCP project that contains the dataset
+    :return: tuple (fingerprints, hpo_offsets) or None if no state was saved
+        or any of the union's tables is missing
+    """
+    union_tables = [eu_constants.UNION_STATE_TABLE]
+    union_tables += [output_table_for(table) for table in resources.CDM_TABLES]
+    union_tables += [
+        mapping_table_for(table)
+        for table in cdm.tables_to_map() + [PERSON_TABLE]
+    ]
+    existing_tables = bq_utils.list_all_table_ids(output_dataset_id)
+    if not set(union_tables).issubset(existing_tables):
+        return None
+    q = 'SELECT * FROM `{project_id}.{dataset_id}.{table_id}`'.format(
+        project_id=project_id,
+        dataset_id=output_dataset_id,
+        table_id=eu_constants.UNION_STATE_TABLE)
+    fingerprints = dict()
+    hpo_offsets = dict()
+    for row in bq_utils.iter_query_rows(bq_utils.query(q)):
+        hpo_id = row[eu_constants.HPO_ID]
+        fingerprints[(hpo_id, row[eu_constants.TABLE_NAME])] = (
+            row[eu_constants.LAST_MODIFIED_TIME], row[eu_constants.ROW_COUNT])
+        hpo_offsets[hpo_id] = row[eu_constants.ID_OFFSET]
+    return fingerprints, hpo_offsets
+
+
+def save_union_state(fingerprints, hpo_offsets, output_dataset_id):
+    """
+    Save the table fingerprints and HPO offsets used by a union
+
+    :param fingerprints: dict mapping (hpo_id, table_name) => (last_modified_time, row_count)
+    :param hpo_offsets: dict mapping hpo_id => numeric offset
+    :param output_dataset_id: identifies dataset where the union is stored
+    """
+    rows = [
+        "('{hpo_id}', '{table_name}', {id_offset}, {last_modified_time}, {row_count})"
+        .format(hpo_id=hpo_id,
+                table_name=table_name,
+                id_offset=hpo_offsets[hpo_id],
+                last_modified_time=last_modified_time,
+                row_count=row_count)
+        for (hpo_id, table_name), (last_modified_time,
+                                   row_count) in sorted(fingerprints.items())
+    ]
+    q = eu_constants.SAVE_UNION_STATE_QUERY.format(rows=',\n  '.join(rows))
+    query(q, eu_constants.UNION_STATE_TABLE, output_dataset_id,
+          'WRITE_TRUNCATE')
+
+
+def delete_union_state(output_dataset_id):
+    """
+    Delete the state saved by the last union, if any
+
+    A full union rewrites every table of the union, so the saved state no
+    longer describes it and must not be used by a later incremental union.
+
+    :param output_dataset_id: identifies dataset where the union is stored
+    """
+    if bq_utils.table_exists(eu_constants.UNION_STATE_TABLE, output_dataset_id):
+        bq_utils.delete_table(eu_constants.UNION_STATE_TABLE, output_dataset_id)
+
+
+def get_changed_hpo_ids(hpo_ids, fingerprints, union_state):
+    """
+    Determine which HPOs must be unioned again since the last union
+
+    :param hpo_ids: identifies the HPOs to include in union
+    :param fingerprints: current fingerprints as returned by `get_table_fingerprints`
+    :param union_state: saved state as returned by `get_union_state`
+    :return: list of HPOs whose submitted tables changed, or None if a full
+        union is required because no state was saved or the HPOs (and hence
+        their id offsets) changed
+    """
+    if union_state is None:
+        return None
+    saved_fingerprints, saved_offsets = union_state
+    hpo_offsets = get_hpo_offsets(hpo_ids)
+    for hpo_id, saved_offset in saved_offsets.items():
+        if hpo_offsets.get(hpo_id) != saved_offset:
+            return None
+
+    changed_hpo_ids = []
+    for hpo_id in hpo_ids:
+        current = {
+            key: value
+            for key, value in fingerprints.items()
+            if key[0] == hpo_id
+        }
+        saved = {
+            key: value
+            for key, value in saved_fingerprints.items()
+            if key[0] == hpo_id
+        }
+        if current != saved:
+            changed_hpo_ids.append(hpo_id)
+    return changed_hpo_ids
+
+
+def _id_ranges_condition(id_column, offsets):
+    """
+    Get a condition matching ids in the id ranges starting at the offsets
+    """
+    return ' OR '.join(
+        '({id_column} >= {start} AND {id_column} < {end})'.format(
+            id_column=id_column,
+            start=offset,
+            end=offset + common.ID_CONSTANT_FACTOR) for offset in offsets)
+
+
+def incremental_union(changed_hpo_ids, hpo_ids, fingerprints, input_dataset_id,
+                      output_dataset_id, project_id):
+    """
+    Replace the records of the specified HPOs in an existing union
+
+    Records in mapping tables are identified by src_hpo_id and records in
+    mapped tables by the HPO's id range (see `get_hpo_offsets`). Tables
+    whose records cannot be attributed to an HPO (e.g. person, death) are
+    unioned again from all HPOs, as are the person records moved to
+    observation.
+
+    :param changed_hpo_ids: identifies the HPOs whose records are replaced
+    :param hpo_ids: identifies all HPOs included in the union
+    :param fingerprints: dict mapping (hpo_id, table_name) => fingerprint of
+        the submitted tables
+    :param input_dataset_id: identifies dataset containing HPO submissions
+    :param output_dataset_id: identifies dataset where the union is stored
+    :param project_id: identifies GCP project that contains the datasets
+    """
+    hpo_offsets = get_hpo_offsets(hpo_ids)
+    tables_to_map = cdm.tables_to_map()
+
+    # Remove person records moved to observation, they are moved again below
+    pto_offset = eu_constants.EHR_PERSON_TO_OBS_CONSTANT
+    for table_id in [
+            output_table_for(OBSERVATION_TABLE),
+            mapping_table_for(OBSERVATION_TABLE)
+    ]:
+        run_dml(
+            eu_constants.DELETE_ID_RANGES_QUERY.format(
+                project_id=project_id,
+                dataset_id=output_dataset_id,
+                table_id=table_id,
+                id_ranges=_id_ranges_condition('observation_id', [pto_offset])))
+
+    # Remove records of the changed HPOs
+    for table_name in tables_to_map + [PERSON_TABLE]:
+        run_dml(
+            eu_constants.DELETE_HPO_MAPPING_QUERY.format(
+                project_id=project_id,
+                dataset_id=output_dataset_id,
+                mapping_table=mapping_table_for(table_name),
+                hpo_ids=changed_hpo_ids))
+    for table_name in tables_to_map:
+        run_dml(
+            eu_constants.DELETE_ID_RANGES_QUERY.format(
+                project_id=project_id,
+                dataset_id=output_dataset_id,
+                table_id=output_table_for(table_name),
+                id_ranges=_id_ranges_condition(
+                    table_name + '_id',
+                    [hpo_offsets[hpo_id] for hpo_id in changed_hpo_ids])))
+
+    # Map and load records of the changed HPOs
+    for table_name in tables_to_map + [PERSON_TABLE]:
+        submitted_hpo_ids = [
+            hpo_id for hpo_id in changed_hpo_ids
+            if (hpo_id, table_name) in fingerprints
+        ]
+        if submitted_hpo_ids:
+            logging.info('Mapping {domain_table} for {hpo_ids}...'.format(
+                domain_table=table_name, hpo_ids=submitted_hpo_ids))
+            mapping(table_name,
+                    submitted_hpo_ids,
+                    input_dataset_id,
+                    output_dataset_id,
+                    project_id,
+                    hpo_offsets=hpo_offsets,
+                    write_disposition='WRITE_APPEND')
+    for table_name in resources.CDM_TABLES:
+        if table_name in tables_to_map:
+            union_hpo_ids = [
+                hpo_id for hpo_id in changed_hpo_ids
+                if (hpo_id, table_name) in fingerprints
+            ]
+        else:
+            # Records are not attributable to an HPO, so union all of them
+            bq_utils.create_standard_table(table_name,
+                                           output_table_for(table_name),
+                                           drop_existing=True,
+                                           dataset_id=output_dataset_id)
+            union_hpo_ids = [
+                hpo_id for hpo_id in hpo_ids
+                if (hpo_id, table_name) in fingerprints
+            ]
+        if union_hpo_ids:
+            load(table_name, union_hpo_ids, input_dataset_id, output_dataset_id)
+
+    map_ehr_person_to_observation(output_dataset_id)
+    move_ehr_person_to_observation(output_dataset_id)
+
+
+def get_union_tasks(hpo_ids, input_dataset_id, output_dataset_id, project_id):
+    """
+    Get the tasks which create the union and the dependencies between them
+
+    Output tables are created and mapping tables loaded independently. The
+    union of a table is loaded once its output table and the mapping tables it
+    joins (its own and those of foreign keys) are loaded. Person records are
+    moved to observation once the person and observation tables are loaded.
+
+    :param hpo_ids: identifies which HPOs to include in union
+    :param input_dataset_id: identifies dataset containing HPO submissions
+    :param output_dataset_id: identifies dataset where the union is stored
+    :param project_id: identifies GCP project that contains the datasets
+    :return: tuple (tasks, dependencies) where tasks is a list of
+        (description, callable) and dependencies lists the indexes of the
+        tasks each task depends on
+    """
+    tasks = []
+    dependencies = []
+    task_indexes = dict()
+
+    def add_task(key, description, func, depends_on=()):
+        task_indexes[key] = len(tasks)
+        tasks.append((description, func))
+        dependencies.append({task_indexes[dep] for dep in depends_on})
+
+    tables_to_map = cdm.tables_to_map()
+    for table_name in resources.CDM_TABLES:
+        result_table = output_table_for(table_name)
+        add_task(('create', table_name),
+                 'Creating {dataset_id}.{table_id}'.format(
+                     dataset_id=output_dataset_id, table_id=result_table),
+                 functools.partial(bq_utils.create_standard_table,
+                                   table_name,
+                                   result_table,
+                                   drop_existing=True,
+                                   dataset_id=output_dataset_id))
+    for domain_table in tables_to_map + [PERSON_TABLE]:
+        add_task(('map', domain_table),
+                 'Mapping {domain_table}'.format(domain_table=domain_table),
+                 functools.partial(mapping, domain_table, hpo_ids,
+                                   input_dataset_id, output_dataset_id,
+                                   project_id))
+
+    for table_name in resources.CDM_TABLES:
+        field_names = [
+            field['name'] for field in resources.fields_for(table_name)
+        ]
+        mapped_tables = [
+            mapped_table for mapped_table in tables_to_map
+            if mapped_table == table_name or mapped_table + '_id' in field_names
+        ]
+        if table_name == eu_constants.FACT_RELATIONSHIP:
+            mapped_tables.append(common.MEASUREMENT)
+        add_task(('load', table_name),
+                 'Creating union of table {table}'.format(table=table_name),
+                 functools.partial(load, table_name, hpo_ids, input_dataset_id,
+                                   output_dataset_id),
+                 depends_on=[('create', table_name)] +
+                 [('map', mapped_table) for mapped_table in mapped_tables])
+
+    # Map and move EHR person records into four rows in observation, one each for race, ethnicity, dob and gender
+    add_task('map_person_to_observation',
+             'Mapping EHR person records to observation',
+             functools.partial(map_ehr_person_to_observation,
+                               output_dataset_id),
+             depends_on=[('map', PERSON_TABLE), ('load', PERSON_TABLE),
+                         ('map', OBSERVATION_TABLE)])
+    add_task('move_person_to_observation',
+             'Moving EHR person records to observation',
+             functools.partial(move_ehr_person_to_observation,
+                               output_dataset_id),
+             depends_on=[('load', PERSON_TABLE), ('load', OBSERVATION_TABLE)])
+    return tasks, dependencies
+
+
+def _run_union_task(task):
+    description, func = task
+    logging.info('{description}...'.format(description=description))
+    return func()
+
+
+def main(input_dataset_id,
+         output_dataset_id,
+         project_id,
+         hpo_ids=None,
+         incremental=False,
+         max_workers=eu_constants.DEFAULT_MAX_WORKERS):
     """
     Create a new CDM which is the union of all EHR datasets submitted by HPOs
 
@@ -728,49 +1083,49 @@ def main(input_dataset_id, output_dataset_id, project_id, hpo_ids=None):
     :param output_dataset_id identifies the dataset to store the new CDM in
     :param project_id: project containing the datasets
     :param hpo_ids: (optional) identifies HPOs to process, by default process all
+    :param incremental: if True, only union again the HPOs whose submitted
+        tables changed since the last union, see `incremental_union`. Falls back
+        to a full union if the last union was not incremental or HPOs changed.
+    :param max_workers: maximum number of tables to create, map or load at
+        the same time
     :returns: list of tables generated successfully
     """
     logging.info('EHR union started')
     if hpo_ids is None:
         hpo_ids = [item['hpo_id'] for item in bq_utils.get_hpo_info()]
 
-    # Create empty output tables to ensure proper schema, clustering, etc.
-    for table in resources.CDM_TABLES:
-        result_table = output_table_for(table)
-        logging.info('Creating {dataset_id}.{table_id}...'.format(
-            dataset_id=output_dataset_id, table_id=result_table))
-        bq_utils.create_standard_table(table,
-                                       result_table,
-                                       drop_existing=True,
-                                       dataset_id=output_dataset_id)
-
-    # Create mapping tables
-    for domain_table in cdm.tables_to_map():
-        logging.info(
-            'Mapping {domain_table}...'.format(domain_table=domain_table))
-        mapping(domain_table, hpo_ids, input_dataset_id, output_dataset_id,
-                project_id)
-
-    # Load all tables with union of submitted tables
-    for table_name in resources.CDM_TABLES:
-        logging.info(
-            'Creating union of table {table}...'.format(table=table_name))
-        load(table_name, hpo_ids, input_dataset_id, output_dataset_id)
-
+    if incremental:
+        fingerprints = get_table_fingerprints(hpo_ids, input_dataset_id,
+                                              project_id)
+        union_state = get_union_state(output_dataset_id, project_id)
+        changed_hpo_ids = get_changed_hpo_ids(hpo_ids, fingerprints,
+                                              union_state)
+        if changed_hpo_ids is not None:
+            logging.info('Incremental union of {hpo_ids}'.format(
+                hpo_ids=changed_hpo_ids))
+            if changed_hpo_ids:
+                incremental_union(changed_hpo_ids, hpo_ids, fingerprints,
+                                  input_dataset_id, output_dataset_id,
+                                  project_id)
+                save_union_state(fingerprints, get_hpo_offsets(hpo_ids),
+                                 output_dataset_id)
+            logging.info('Incremental union of Unioned EHR complete')
+            return
+        logging.info('No state saved by a previous union for the same HPOs, '
+                     'performing a full union')
+
+    delete_union_state(output_dataset_id)
+    tasks, dependencies = get_union_tasks(hpo_ids, input_dataset_id,
+                                          output_dataset_id, project_id)
+    task_graph.run_tasks(tasks,
+                         dependencies,
+                         _run_union_task,
+                         max_workers=max_workers)
     logging.info('Creation of Unioned EHR complete')
 
-    # create person mapping table
-    domain_table = PERSON_TABLE
-    logging.info('Mapping {domain_table}...'.format(domain_table=domain_table))
-    mapping(domain_table, hpo_ids, input_dataset_id, output_dataset_id,
-            project_id)
-
-    logging.info('Starting process for Person to Observation')
-    # Map and move EHR person records into four rows in observation, one each for race, ethnicity, dob and gender
-    map_ehr_person_to_observation(output_dataset_id)
-    move_ehr_person_to_observation(output_dataset_id)
-
-    logging.info('Completed Person to Observation')
+    if incremental:
+        save_union_state(fingerprints, get_hpo_offsets(hpo_ids),
+                         output_dataset_id)
 
 
 if __name__ == '__main__':
@@ -788,6 +1143,20 @@ if __name__ == '__main__':
     parser.add_argument('-hpo_id',
                         nargs='+',
                         help='HPOs to process (all by default)')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only union again HPOs whose submissions changed since the last '
+        'incremental union')
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=eu_constants.DEFAULT_MAX_WORKERS,
+        help='Maximum number of tables to create, map or load at the same time')
     args = parser.parse_args()
     if args.input_dataset_id:
-        main(args.input_dataset_id, args.output_dataset_id, args.project_id)
+        main(args.input_dataset_id,
+             args.output_dataset_id,
+             args.project_id,
+             incremental=args.incremental,
+             max_workers=args.max_workers)
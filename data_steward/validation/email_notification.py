@@ -6,7 +6,7 @@ from io import BytesIO
 
 # Third party imports
 import mandrill
-from jinja2 import Template
+from jinja2 import Environment, Template
 from matplotlib import image as mpimg
 
 # Project imports
@@ -19,6 +19,10 @@ from resources import achilles_images_path
 LOGGER = logging.getLogger(__name__)
 
 CONTACT_QUERY_TMPL = Template(consts.CONTACT_LIST_QUERY)
+# the email body is html, so it is not rendered with the SQL environment
+EMAIL_TEMPLATES = bq.TemplateRegistry(env=Environment())
+EMAIL_BODY_TEMPLATE = 'email_body'
+EMAIL_TEMPLATES.register(EMAIL_BODY_TEMPLATE, consts.EMAIL_BODY)
 
 
 class MandrillConfigurationError(RuntimeError):
@@ -129,7 +133,8 @@ def generate_html_body(site_name, folder_uri, report_data):
     """
     submission_folder_url = folder_uri.replace(
         'gs://', 'https://console.cloud.google.com/storage/browser/')
-    html_email_body = Template(consts.EMAIL_BODY).render(
+    html_email_body = EMAIL_TEMPLATES.render(
+        EMAIL_BODY_TEMPLATE,
         site_name=site_name,
         ehr_ops_site_url=consts.EHR_OPS_SITE_URL,
         submission_folder_url=submission_folder_url,
@@ -1,14 +1,18 @@
+import logging
 import os
+import time
 from glob import glob
 from io import open
 
 import bq_utils
 import resources
+from utils import task_graph
 
 EXPORT_PATH = os.path.join(resources.resource_files_path, 'export')
 RESULTS_SCHEMA_PLACEHOLDER = '@results_database_schema.'
 VOCAB_SCHEMA_PLACEHOLDER = '@vocab_database_schema.'
 UNIONED_EHR = 'unioned_ehr'
+DEFAULT_MAX_WORKERS = 10
 
 
 def list_files(base_path):
@@ -52,35 +56,57 @@ def is_hpo_id(hpo_id):
     return hpo_id in [item['hpo_id'] for item in bq_utils.get_hpo_info()]
 
 
-# TODO Make this function more generic.
-def export_from_path(p, datasource_id):
+def list_query_paths(p):
     """
-    Export results
-    :param p: path to SQL file
+    List the SQL files of an export, in the order they are assembled
+
+    :param p: path to the export directory
+    :return: list of paths to SQL files
+    """
+    paths = [os.path.join(p, f) for f in list_files_only(p)]
+    for d in list_dirs_only(p):
+        paths.extend(list_query_paths(os.path.join(p, d)))
+    return paths
+
+
+def run_export_query(path, datasource_id):
+    """
+    Render and run the export query in a SQL file
+
+    :param path: path to SQL file
     :param datasource_id: HPO or aggregate dataset to run export for
+    :return: tuple (payload, elapsed) of the query result in the report format
+        and the number of seconds the query took
+    """
+    with open(path, 'r') as fp:
+        sql = fp.read()
+    sql = render(sql,
+                 datasource_id,
+                 results_schema=bq_utils.get_dataset_id(),
+                 vocab_schema='')
+    start = time.time()
+    query_result = bq_utils.query(sql)
+    elapsed = time.time() - start
+    # TODO reshape results
+    return query_result_to_payload(query_result), elapsed
+
+
+def assemble_payloads(p, payloads):
+    """
+    Nest the payloads of the SQL files of an export as per its directory tree
+
+    :param p: path to the export directory
+    :param payloads: `dict` mapping SQL file paths to payloads
     :return: `dict` structured for report render
     """
     result = dict()
-    if not is_hpo_id(datasource_id) and datasource_id != UNIONED_EHR:
-        datasource_id = None
     for f in list_files_only(p):
         name = f[0:-4].upper()
-        abs_path = os.path.join(p, f)
-        with open(abs_path, 'r') as fp:
-            sql = fp.read()
-            sql = render(sql,
-                         datasource_id,
-                         results_schema=bq_utils.get_dataset_id(),
-                         vocab_schema='')
-            query_result = bq_utils.query(sql)
-            # TODO reshape results
-            result[name] = query_result_to_payload(query_result)
+        result[name] = payloads[os.path.join(p, f)]
 
     for d in list_dirs_only(p):
-        abs_path = os.path.join(p, d)
         name = d.upper()
-        # recursive call
-        dir_result = export_from_path(abs_path, datasource_id)
+        dir_result = assemble_payloads(os.path.join(p, d), payloads)
         if name in result:
             # a sql file generated the item already
             result[name].update(dir_result)
@@ -90,6 +116,40 @@ def export_from_path(p, datasource_id):
     return result
 
 
+# TODO Make this function more generic.
+def export_from_path(p,
+                     datasource_id,
+                     max_workers=DEFAULT_MAX_WORKERS,
+                     query_times=None):
+    """
+    Export results
+
+    All the SQL files in the directory tree are rendered and run concurrently.
+
+    :param p: path to SQL file
+    :param datasource_id: HPO or aggregate dataset to run export for
+    :param max_workers: maximum number of queries to run at the same time
+    :param query_times: optional `dict` which is updated with the number of
+        seconds each query took, keyed by SQL file path
+    :return: `dict` structured for report render
+    """
+    if not is_hpo_id(datasource_id) and datasource_id != UNIONED_EHR:
+        datasource_id = None
+    paths = list_query_paths(p)
+    query_results = task_graph.run_tasks(
+        paths, [set()] * len(paths),
+        lambda path: run_export_query(path, datasource_id),
+        max_workers=max_workers)
+
+    payloads = dict()
+    for path, (payload, elapsed) in zip(paths, query_results):
+        payloads[path] = payload
+        logging.debug(f"Export query {path} took {elapsed:.2f}s")
+        if query_times is not None:
+            query_times[path] = elapsed
+    return assemble_payloads(p, payloads)
+
+
 def convert_value(value, tpe):
     """
     Cast to specified type
@@ -11,6 +11,8 @@ import json
 import logging
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO, open
 
 # Third party imports
@@ -29,8 +31,12 @@ import resources
 from common import ACHILLES_EXPORT_PREFIX_STRING, ACHILLES_EXPORT_DATASOURCES_JSON
 from constants.validation import hpo_report as report_consts
 from constants.validation import main as consts
-from curation_logging.curation_gae_handler import begin_request_logging, end_request_logging, initialize_logging
+from curation_logging.curation_gae_handler import (begin_request_logging,
+                                                   end_request_logging,
+                                                   flush_thread_logs,
+                                                   initialize_logging)
 from retraction import retract_data_bq, retract_data_gcs
+from utils import task_graph
 from validation import achilles, achilles_heel, ehr_union, export, hpo_report
 from validation.app_errors import (log_traceback, errors_blueprint,
                                    InternalValidationError,
@@ -107,15 +113,30 @@ def run_export(datasource_id=None, folder_prefix="", target_bucket=None):
 
     # Run export queries and store json payloads in specified folder in the target bucket
     reports_prefix = folder_prefix + ACHILLES_EXPORT_PREFIX_STRING + datasource_name + '/'
+    reports = []
     for export_name in common.ALL_REPORTS:
         sql_path = os.path.join(export.EXPORT_PATH, export_name)
-        result = export.export_from_path(sql_path, datasource_id)
-        content = json.dumps(result)
-        fp = StringIO(content)
-        result = gcs_utils.upload_object(target_bucket,
-                                         reports_prefix + export_name + '.json',
-                                         fp)
-        results.append(result)
+        start = time.time()
+        query_times = dict()
+        result = export.export_from_path(sql_path,
+                                         datasource_id,
+                                         query_times=query_times)
+        slowest_path = max(query_times, key=query_times.get, default=None)
+        logging.info(
+            f"Ran {len(query_times)} {export_name} export queries for "
+            f"{datasource_name} in {time.time() - start:.2f}s, slowest "
+            f"{slowest_path} in {query_times.get(slowest_path, 0):.2f}s")
+        reports.append((reports_prefix + export_name + '.json', result))
+
+    def upload_report(report):
+        report_path, report_result = report
+        fp = StringIO(json.dumps(report_result))
+        return gcs_utils.upload_object(target_bucket, report_path, fp)
+
+    results.extend(
+        task_graph.run_tasks(reports, [set()] * len(reports),
+                             upload_report,
+                             max_workers=consts.EXPORT_UPLOAD_MAX_WORKERS))
     result = save_datasources_json(datasource_id=datasource_id,
                                    folder_prefix=folder_prefix,
                                    target_bucket=target_bucket)
@@ -133,11 +154,27 @@ def run_achilles(hpo_id=None):
         logging.info(f"Running achilles for hpo_id '{hpo_id}'")
     achilles.create_tables(hpo_id, True)
     achilles.load_analyses(hpo_id)
-    achilles.run_analyses(hpo_id=hpo_id)
+    max_workers = get_achilles_max_workers()
+    single_pass = os.environ.get(consts.ACHILLES_SINGLE_PASS) == 'true'
+    achilles.run_analyses(hpo_id=hpo_id,
+                          max_workers=max_workers,
+                          single_pass=single_pass)
     if hpo_id is not None:
         logging.info(f"Running achilles_heel for hpo_id '{hpo_id}'")
     achilles_heel.create_tables(hpo_id, True)
-    achilles_heel.run_heel(hpo_id=hpo_id)
+    achilles_heel.run_heel(hpo_id=hpo_id, max_workers=max_workers)
+
+
+def get_achilles_max_workers():
+    """
+    Get the maximum number of achilles queries to run concurrently for a site
+
+    :return: value of the ACHILLES_MAX_WORKERS environment variable if set,
+        otherwise the default
+    """
+    return int(
+        os.environ.get(consts.ACHILLES_MAX_WORKERS,
+                       consts.DEFAULT_ACHILLES_MAX_WORKERS))
 
 
 @api_util.auth_required_cron
@@ -191,12 +228,67 @@ def validate_all_hpos():
     """
     validation end point for all hpo_ids
     """
-    for item in bq_utils.get_hpo_info():
-        hpo_id = item['hpo_id']
-        process_hpo(hpo_id)
+    hpo_ids = [item['hpo_id'] for item in bq_utils.get_hpo_info()]
+    summary = validate_hpos(hpo_ids, max_workers=get_validation_max_workers())
+    for hpo_summary in summary:
+        logging.info(
+            f"Validation of hpo_id '{hpo_summary['hpo_id']}' "
+            f"{hpo_summary['status']} in {hpo_summary['elapsed']:.2f}s")
     return 'validation done!'
 
 
+def get_validation_max_workers():
+    """
+    Get the number of HPO sites which may be validated at the same time
+
+    :return: value of the VALIDATION_MAX_WORKERS environment variable if set,
+        otherwise the default
+    """
+    return int(
+        os.environ.get(consts.VALIDATION_MAX_WORKERS,
+                       consts.DEFAULT_VALIDATION_MAX_WORKERS))
+
+
+def validate_hpos(hpo_ids, max_workers=consts.DEFAULT_VALIDATION_MAX_WORKERS):
+    """
+    Run validation for several hpo_ids concurrently
+
+    An error processing one site is logged and recorded in its summary but does
+    not prevent the remaining sites from being processed.
+
+    :param hpo_ids: identifies the hpo sites to process
+    :param max_workers: maximum number of sites to process at the same time
+    :return: list of dicts with keys hpo_id, status, elapsed and error, one
+        per hpo_id and in the same order as hpo_ids
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(_timed_process_hpo, hpo_ids))
+
+
+def _timed_process_hpo(hpo_id):
+    """
+    Run validation for a single hpo_id and summarize the outcome
+
+    :param hpo_id: which hpo_id to run for
+    :return: dict with keys hpo_id, status, elapsed (in seconds) and error
+    """
+    start = time.time()
+    status = consts.HPO_STATUS_DONE
+    error = None
+    try:
+        process_hpo(hpo_id)
+    except Exception as e:
+        status = consts.HPO_STATUS_FAILED
+        error = repr(e)
+        logging.exception(f"Failed to process hpo_id '{hpo_id}'")
+    finally:
+        flush_thread_logs()
+    return dict(hpo_id=hpo_id,
+                status=status,
+                elapsed=time.time() - start,
+                error=error)
+
+
 def list_bucket(bucket):
     try:
         return gcs_utils.list_bucket(bucket)
@@ -232,7 +324,11 @@ def categorize_folder_items(folder_items):
     return found_cdm_files, found_pii_files, unknown_files
 
 
-def validate_submission(hpo_id, bucket, folder_items, folder_prefix):
+def validate_submission(hpo_id,
+                        bucket,
+                        folder_items,
+                        folder_prefix,
+                        batch_load=True):
     """
     Load submission in BigQuery and summarize outcome
 
@@ -240,6 +336,8 @@ def validate_submission(hpo_id, bucket, folder_items, folder_prefix):
     :param bucket:
     :param folder_items:
     :param folder_prefix:
+    :param batch_load: if True, submit the load jobs for all files up front and
+        wait on them together, otherwise load and wait on one file at a time
     :return: a dict with keys results, errors, warnings
       results is list of tuples (file_name, found, parsed, loaded)
       errors and warnings are both lists of tuples (file_name, message)
@@ -260,17 +358,24 @@ def validate_submission(hpo_id, bucket, folder_items, folder_prefix):
         table_id = bq_utils.get_table_id(hpo_id, table_name)
         bq_utils.create_standard_table(table_name, table_id, drop_existing=True)
 
-    for cdm_file_name in sorted(resources.CDM_FILES):
-        file_results, file_errors = perform_validation_on_file(
-            cdm_file_name, found_cdm_files, hpo_id, folder_prefix, bucket)
-        results.extend(file_results)
-        errors.extend(file_errors)
-
-    for pii_file_name in sorted(common.PII_FILES):
-        file_results, file_errors = perform_validation_on_file(
-            pii_file_name, found_pii_files, hpo_id, folder_prefix, bucket)
-        results.extend(file_results)
-        errors.extend(file_errors)
+    if batch_load:
+        file_names = sorted(resources.CDM_FILES) + sorted(common.PII_FILES)
+        found_file_names = found_cdm_files + found_pii_files
+        results, errors = perform_validation_on_files(file_names,
+                                                      found_file_names, hpo_id,
+                                                      folder_prefix, bucket)
+    else:
+        for cdm_file_name in sorted(resources.CDM_FILES):
+            file_results, file_errors = perform_validation_on_file(
+                cdm_file_name, found_cdm_files, hpo_id, folder_prefix, bucket)
+            results.extend(file_results)
+            errors.extend(file_errors)
+
+        for pii_file_name in sorted(common.PII_FILES):
+            file_results, file_errors = perform_validation_on_file(
+                pii_file_name, found_pii_files, hpo_id, folder_prefix, bucket)
+            results.extend(file_results)
+            errors.extend(file_errors)
 
     # (filename, message) for each unknown file
     warnings = [
@@ -679,14 +784,12 @@ def perform_validation_on_file(file_name, found_file_names, hpo_id,
         found = 1
         load_results = bq_utils.load_from_csv(hpo_id, table_name, folder_prefix)
         load_job_id = load_results['jobReference']['jobId']
-        incomplete_jobs = bq_utils.wait_on_jobs([load_job_id])
+        job_tracker = bq_utils.JobTracker()
+        incomplete_jobs = job_tracker.wait([load_job_id])
 
         if not incomplete_jobs:
-            job_resource = bq_utils.get_job_details(job_id=load_job_id)
-            job_status = job_resource['status']
-            if 'errorResult' in job_status:
-                # These are issues (which we report back) as opposed to internal errors
-                issues = [item['message'] for item in job_status['errors']]
+            issues = get_load_job_issues(job_tracker.job_resources[load_job_id])
+            if issues:
                 errors.append((file_name, ' || '.join(issues)))
                 logging.info(
                     f"Issues found in gs://{bucket}/{folder_prefix}/{file_name}"
@@ -712,6 +815,95 @@ def perform_validation_on_file(file_name, found_file_names, hpo_id,
     return results, errors
 
 
+def perform_validation_on_files(file_names, found_file_names, hpo_id,
+                                folder_prefix, bucket):
+    """
+    Attempts to load several csv files into BigQuery at once
+
+    Load jobs for all found files are submitted before waiting on any of them,
+    so the files are loaded concurrently rather than one after another.
+
+    :param file_names: names of the files to validate, in reporting order
+    :param found_file_names: files found in the submission folder
+    :param hpo_id: identifies the hpo site
+    :param folder_prefix: directory containing the submission
+    :param bucket: bucket containing the submission
+    :return: tuple (results, errors) where
+     results is list of tuples (file_name, found, parsed, loaded)
+     errors is list of tuples (file_name, message)
+    """
+    errors = []
+    results = []
+
+    load_job_ids = dict()
+    for file_name in file_names:
+        if file_name in found_file_names:
+            logging.info(f"Loading file '{file_name}'")
+            table_name = file_name.split('.')[0]
+            load_results = bq_utils.load_from_csv(hpo_id, table_name,
+                                                  folder_prefix)
+            load_job_ids[file_name] = load_results['jobReference']['jobId']
+
+    job_tracker = bq_utils.JobTracker()
+    if load_job_ids:
+        incomplete_jobs = job_tracker.wait(list(load_job_ids.values()))
+        if incomplete_jobs:
+            # Incomplete jobs are internal unrecoverable errors.
+            # Aborting the process allows for this submission to be validated when system recovers.
+            incomplete_tables = [
+                file_name.split('.')[0]
+                for file_name, load_job_id in load_job_ids.items()
+                if load_job_id in incomplete_jobs
+            ]
+            message = (
+                f"Loading hpo_id '{hpo_id}' tables {incomplete_tables} failed "
+                f"because job ids {incomplete_jobs} did not complete.\n")
+            message += f"Aborting processing 'gs://{bucket}/{folder_prefix}'."
+            logging.error(message)
+            raise InternalValidationError(message)
+
+    for file_name in file_names:
+        logging.info(f"Validating file '{file_name}'")
+        found = parsed = loaded = 0
+        if file_name in load_job_ids:
+            found = 1
+            load_job_id = load_job_ids[file_name]
+            logging.info(
+                f"Load job '{load_job_id}' for '{file_name}' completed "
+                f"in {job_tracker.wait_times[load_job_id]:.2f}s")
+            issues = get_load_job_issues(job_tracker.job_resources[load_job_id])
+            if issues:
+                errors.append((file_name, ' || '.join(issues)))
+                logging.info(
+                    f"Issues found in gs://{bucket}/{folder_prefix}/{file_name}"
+                )
+                for issue in issues:
+                    logging.info(issue)
+            else:
+                # Processed ok
+                parsed = loaded = 1
+
+        if file_name in common.SUBMISSION_FILES:
+            results.append((file_name, found, parsed, loaded))
+
+    return results, errors
+
+
+def get_load_job_issues(job_resource):
+    """
+    Get the issues reported by a completed load job
+
+    These are issues (which we report back) as opposed to internal errors
+
+    :param job_resource: job resource of the completed load job
+    :return: list of issue messages, empty if the file loaded successfully
+    """
+    job_status = job_resource['status']
+    if 'errorResult' in job_status:
+        return [item['message'] for item in job_status['errors']]
+    return []
+
+
 def _validation_done(bucket, folder):
     if gcs_utils.get_metadata(bucket=bucket,
                               name=folder + common.PROCESSED_TXT) is not None:
@@ -920,7 +1112,11 @@ def union_ehr():
     app_id = bq_utils.app_identity.get_application_id()
     input_dataset_id = bq_utils.get_dataset_id()
     output_dataset_id = bq_utils.get_unioned_dataset_id()
-    ehr_union.main(input_dataset_id, output_dataset_id, app_id)
+    incremental = os.environ.get(consts.EHR_UNION_INCREMENTAL) == 'true'
+    ehr_union.main(input_dataset_id,
+                   output_dataset_id,
+                   app_id,
+                   incremental=incremental)
 
     run_achilles(hpo_id)
     now_date_string = datetime.datetime.now().strftime('%Y_%m_%d')
@@ -7,6 +7,7 @@ from io import open
 import bq_utils
 import resources
 from constants.validation.metrics import completeness as consts
+from utils import client_cache
 
 
 def get_hpo_ids():
@@ -163,6 +164,7 @@ if __name__ == '__main__':
         os.environ[consts.APPLICATION_ID] = project_id
         os.environ[consts.GOOGLE_APPLICATION_CREDENTIALS] = credentials
         os.environ[consts.BIGQUERY_DATASET_ID] = dataset_id
+        client_cache.invalidate()
 
         hpo_ids = [hpo_id] if hpo_id else get_hpo_ids()
         cols = get_cols(dataset_id)
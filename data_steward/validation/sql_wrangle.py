@@ -1,14 +1,29 @@
 import re
+from collections import defaultdict
 
 import bq_utils
 from io import open
+from utils import task_graph
 
 COMMAND_SEP = ';'
 PREFIX_PLACEHOLDER = 'synpuf_100.'
 TEMP_PREFIX = 'temp.'
+READ = 'read'
+APPEND = 'append'
+WRITE = 'write'
 TEMP_TABLE_PATTERN = re.compile('\s*INTO\s+([^\s]+)')
 TRUNCATE_TABLE_PATTERN = re.compile('\s*truncate\s+table\s+([^\s]+)')
 DROP_TABLE_PATTERN = re.compile('\s*drop\s+table\s+([^\s]+)')
+INSERT_TABLE_PATTERN = re.compile(r'\binsert\s+into\s+([^\s(]+)', re.IGNORECASE)
+READ_TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+([^\s(),;]+)',
+                                re.IGNORECASE)
+INSERT_COMMAND_PATTERN = re.compile(
+    r'^\s*insert\s+into\s+([^\s(]+)\s*\(([^)]*)\)\s*(.*)$',
+    re.IGNORECASE | re.DOTALL)
+SELECT_PATTERN = re.compile(r'\bselect(\s+distinct)?\b', re.IGNORECASE)
+FROM_PATTERN = re.compile(r'\bfrom\b', re.IGNORECASE)
+ALIAS_PATTERN = re.compile(r'\bas\s+(\w+)$', re.IGNORECASE)
+COLUMN_PATTERN = re.compile(r'^[\w.]+$')
 COMMENTED_BLOCK_REGEX = re.compile(
     '(?P<before_comment>(^)(.)*)(?P<comment>(\/\*)(.)*(\*\/))(?P<after_comment>(.)*$)',
     re.DOTALL)
@@ -86,13 +101,12 @@ def qualify_tables(command, hpo_id=None):
     return command
 
 
-def is_to_temp_table(query):
+def _remove_comments(query):
     """
-    Determine if the query is a DML statement that outputs to a temp table
+    Remove line and block comments from a query
 
     :param query: The query string to parse
-    :return:  True if the query string is saving results to a temporary table.
-        False if not a DML statement outputting to a temporary table.
+    :return: the query string without comments
     """
     # remove all line comments
     query_without_line_comments = []
@@ -107,7 +121,18 @@ def is_to_temp_table(query):
         query_string = match.group('before_comment') + match.group(
             'after_comment')
         match = COMMENTED_BLOCK_REGEX.search(query_string)
+    return query_string
+
+
+def is_to_temp_table(query):
+    """
+    Determine if the query is a DML statement that outputs to a temp table
 
+    :param query: The query string to parse
+    :return:  True if the query string is saving results to a temporary table.
+        False if not a DML statement outputting to a temporary table.
+    """
+    query_string = _remove_comments(query)
     query_list = query_string.split()
     insert_query = False
     if query_list[0].lower() == 'insert':
@@ -178,3 +203,172 @@ def get_drop_table_name(q):
     """
     match = DROP_TABLE_PATTERN.search(q)
     return match.group(1)
+
+
+def get_insert_parts(command):
+    """
+    Split an INSERT statement into its target table, column list and query
+
+    :param command: qualified command as returned by `qualify_tables`
+    :return: tuple (table_name, column_names, query) with lowercase table and
+        column names, or None if the command is not an INSERT statement
+    """
+    match = INSERT_COMMAND_PATTERN.match(_remove_comments(command))
+    if match is None:
+        return None
+    table_name, columns, query = match.groups()
+    column_names = [column.strip().lower() for column in columns.split(',')]
+    return table_name.lower(), column_names, query.strip()
+
+
+def _mask_nested(query):
+    """
+    Blank out text nested in parentheses, keeping the outermost ones
+
+    The masked string has the same length as the query, so positions of top
+    level keywords found in it are also valid in the query.
+    """
+    masked = []
+    depth = 0
+    for char in query:
+        if char == '(':
+            depth += 1
+            masked.append('(' if depth == 1 else ' ')
+        elif char == ')':
+            depth -= 1
+            masked.append(')' if depth == 0 else ' ')
+        else:
+            masked.append(char if depth == 0 else ' ')
+    return ''.join(masked)
+
+
+def get_output_columns(query):
+    """
+    Get the names of the columns a query outputs
+
+    Names are taken from the first top level SELECT (or from the first
+    parenthesized query of a set operation), so every selected expression
+    must either have an alias or be a plain column reference.
+
+    :param query: a SELECT statement, optionally with a WITH clause
+    :return: list of lowercase column names, or None if they cannot be
+        determined
+    """
+    query = query.strip()
+    masked = _mask_nested(query)
+    select = SELECT_PATTERN.search(masked)
+    if select is None:
+        if query.startswith('(') and ')' in masked:
+            return get_output_columns(query[1:masked.index(')')])
+        return None
+
+    from_clause = FROM_PATTERN.search(masked, select.end())
+    end = from_clause.start() if from_clause else len(query)
+    items = []
+    start = select.end()
+    for i in range(select.end(), end):
+        if masked[i] == ',':
+            items.append(query[start:i])
+            start = i + 1
+    items.append(query[start:end])
+
+    column_names = []
+    for item in items:
+        item = ' '.join(item.split())
+        alias = ALIAS_PATTERN.search(item)
+        if alias:
+            column_names.append(alias.group(1).lower())
+        elif COLUMN_PATTERN.match(item):
+            column_names.append(item.split('.')[-1].lower())
+        else:
+            return None
+    return column_names
+
+
+def get_table_accesses(command):
+    """
+    Get the tables a command reads, appends to or (re)writes
+
+    Temp table outputs, truncates and drops replace the contents of a table,
+    while INSERT statements only append rows to it.
+
+    :param command: qualified command as returned by `qualify_tables`
+    :return: dict mapping each lowercase table name to the set of access kinds
+        (READ, APPEND and/or WRITE)
+    """
+    accesses = defaultdict(set)
+    if is_truncate(command):
+        accesses[get_truncate_table_name(command).lower()].add(WRITE)
+        return accesses
+    if is_drop(command):
+        accesses[get_drop_table_name(command).lower()].add(WRITE)
+        return accesses
+
+    query = _remove_comments(command)
+    if is_to_temp_table(command):
+        accesses[get_temp_table_name(command).lower()].add(WRITE)
+        query = get_temp_table_query(query)
+    for table_name in INSERT_TABLE_PATTERN.findall(query):
+        accesses[table_name.lower()].add(APPEND)
+    for table_name in READ_TABLE_PATTERN.findall(query):
+        accesses[table_name.lower()].add(READ)
+    return accesses
+
+
+def _conflicts(accesses, other_accesses):
+    """
+    True if two commands must run in their original order
+
+    Commands conflict if they access a common table and at least one of them
+    rewrites it, or one of them reads rows the other appends. Appends to the
+    same table commute.
+    """
+    for table_name in accesses.keys() & other_accesses.keys():
+        kinds = accesses[table_name] | other_accesses[table_name]
+        if WRITE in kinds or kinds == {READ, APPEND}:
+            return True
+    return False
+
+
+def get_command_dependencies(commands):
+    """
+    Derive the dependency graph of a sequence of commands
+
+    A command depends on every earlier command it conflicts with (e.g. a query
+    reading a temp table depends on the query creating it and the drop of the
+    temp table depends on both), so any order that respects the graph produces
+    the same results as running the commands sequentially.
+
+    :param commands: list of qualified commands in their original order
+    :return: list whose i-th item is the set of indexes of the earlier commands
+        which must complete before the i-th command starts
+    """
+    accesses = [get_table_accesses(command) for command in commands]
+    dependencies = []
+    for i, command_accesses in enumerate(accesses):
+        dependencies.append(
+            {j for j in range(i) if _conflicts(accesses[j], command_accesses)})
+    return dependencies
+
+
+def run_commands(commands, run_command, max_workers=1):
+    """
+    Run commands concurrently in an order respecting their dependencies
+
+    No further commands are started once a command fails and the first error
+    is raised after the running commands complete.
+
+    :param commands: list of qualified commands in their original order
+    :param run_command: callable running a single command to completion
+    :param max_workers: maximum number of commands to run at the same time;
+        commands are run sequentially in the calling thread if 1 or less
+    :return: None
+    """
+    if max_workers <= 1:
+        dependencies = [set() for _ in commands]
+    else:
+        dependencies = get_command_dependencies(commands)
+    task_graph.run_tasks(commands,
+                         dependencies,
+                         run_command,
+                         max_workers=max_workers)
@@ -14,6 +14,14 @@ ACHILLES_LOOKUP_COUNT = 215
 ACHILLES_RESULTS_COUNT = 2779
 
 
+def _get_sort_key(row):
+    # float aggregates may differ in their last digits between runs
+    return str([
+        value for _, value in sorted(row.items())
+        if not isinstance(value, float)
+    ])
+
+
 class AchillesTest(unittest.TestCase):
 
     @classmethod
@@ -63,3 +71,46 @@ class AchillesTest(unittest.TestCase):
         result = bq_utils.query(cmd)
         self.assertEqual(int(result['rows'][0]['f'][0]['v']),
                          ACHILLES_RESULTS_COUNT)
+
+    def _get_results_rows(self):
+        """
+        Get the rows of the achilles results tables in a deterministic order
+        """
+        rows = []
+        for table_name in [
+                achilles.ACHILLES_RESULTS, achilles.ACHILLES_RESULTS_DIST
+        ]:
+            table_id = bq_utils.get_table_id(FAKE_HPO_ID, table_name)
+            # analysis 0 stores the run date, which may differ between runs
+            response = bq_utils.query(
+                f'SELECT * FROM {table_id} WHERE analysis_id <> 0')
+            table_rows = bq_utils.large_response_to_rowlist(response)
+            rows.append(sorted(table_rows, key=_get_sort_key))
+        return rows
+
+    def test_run_analyses_single_pass(self):
+        # Long-running test
+        self._load_dataset()
+        achilles.create_tables(FAKE_HPO_ID, True)
+        achilles.load_analyses(FAKE_HPO_ID)
+        achilles.run_analyses(hpo_id=FAKE_HPO_ID)
+        expected_rows = self._get_results_rows()
+
+        achilles.create_tables(FAKE_HPO_ID, True)
+        achilles.load_analyses(FAKE_HPO_ID)
+        achilles.run_analyses(hpo_id=FAKE_HPO_ID, single_pass=True)
+        actual_rows = self._get_results_rows()
+
+        # both modes produce the same results, row for row
+        for actual_table_rows, expected_table_rows in zip(
+                actual_rows, expected_rows):
+            self.assertEqual(len(actual_table_rows), len(expected_table_rows))
+            for actual_row, expected_row in zip(actual_table_rows,
+                                                expected_table_rows):
+                self.assertEqual(actual_row.keys(), expected_row.keys())
+                for column, expected_value in expected_row.items():
+                    if isinstance(expected_value, float):
+                        self.assertAlmostEqual(actual_row[column],
+                                               expected_value)
+                    else:
+                        self.assertEqual(actual_row[column], expected_value)
@@ -22,55 +22,310 @@ class BqUtilsTest(unittest.TestCase):
         self.assertRaises(ValueError, bq_utils.load_cdm_csv, self.hpo_id,
                           'not_a_cdm_table')
 
-    @mock.patch('bq_utils.job_status_done', lambda x: True)
-    def test_wait_on_jobs_already_done(self):
+    @staticmethod
+    def _job_resources(*done_job_ids):
+        """
+        Get a side effect for get_jobs_details
+
+        :param done_job_ids: for each call, the job ids reported as done
+        :return: function returning the job resources for the next call
+        """
+        calls = iter(done_job_ids)
+
+        def get_jobs_details(job_ids, project_id=None, bq_service=None):
+            done = next(calls)
+            return {
+                job_id: {
+                    'status': {
+                        'state': 'DONE' if job_id in done else 'RUNNING'
+                    }
+                } for job_id in job_ids
+            }
+
+        return get_jobs_details
+
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils.get_jobs_details')
+    def test_wait_on_jobs_already_done(self, mock_get_jobs_details,
+                                       mock_sleeper, mock_create_service,
+                                       mock_get_app_id):
         job_ids = range(3)
+        mock_get_jobs_details.side_effect = self._job_resources([0, 1, 2])
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = []
         self.assertEqual(actual, expected)
+        # all jobs are checked in a single batch
+        self.assertEqual(mock_get_jobs_details.call_count, 1)
 
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
     @mock.patch('time.sleep', return_value=None)
-    @mock.patch('bq_utils.job_status_done', return_value=False)
-    def test_wait_on_jobs_all_fail(self, mock_job_status_done, mock_time_sleep):
+    @mock.patch('bq_utils.get_jobs_details')
+    def test_wait_on_jobs_all_fail(self, mock_get_jobs_details, mock_time_sleep,
+                                   mock_create_service, mock_get_app_id):
         job_ids = list(range(3))
+        mock_get_jobs_details.side_effect = self._job_resources(
+            *[[]] * bq_utils_consts.BQ_DEFAULT_RETRY_COUNT)
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = job_ids
         self.assertEqual(actual, expected)
-        # TODO figure out how to count this
-        # self.assertEquals(mock_time_sleep.call_count, bq_utils.BQ_DEFAULT_RETRY_COUNT)
+        self.assertEqual(mock_time_sleep.call_count,
+                         bq_utils_consts.BQ_DEFAULT_RETRY_COUNT)
 
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
     @mock.patch('time.sleep', return_value=None)
-    @mock.patch(
-        'bq_utils.job_status_done',
-        side_effect=[False, False, False, True, False, False, True, True, True])
-    def test_wait_on_jobs_get_done(self, mock_job_status_done, mock_time_sleep):
+    @mock.patch('bq_utils.get_jobs_details')
+    def test_wait_on_jobs_get_done(self, mock_get_jobs_details, mock_time_sleep,
+                                   mock_create_service, mock_get_app_id):
         job_ids = list(range(3))
+        mock_get_jobs_details.side_effect = self._job_resources([], [0], [1, 2])
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = []
         self.assertEqual(actual, expected)
+        # only outstanding jobs are checked
+        self.assertEqual(
+            [c[0][0] for c in mock_get_jobs_details.call_args_list],
+            [[0, 1, 2], [0, 1, 2], [1, 2]])
+        # the service is built only once
+        self.assertEqual(mock_create_service.call_count, 1)
 
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
     @mock.patch('time.sleep', return_value=None)
-    @mock.patch('bq_utils.job_status_done',
-                side_effect=[
-                    False, False, True, False, False, False, False, False,
-                    False, False, False, False
-                ])
-    def test_wait_on_jobs_some_fail(self, mock_job_status_done,
-                                    mock_time_sleep):
+    @mock.patch('bq_utils.get_jobs_details')
+    def test_wait_on_jobs_some_fail(self, mock_get_jobs_details,
+                                    mock_time_sleep, mock_create_service,
+                                    mock_get_app_id):
         job_ids = list(range(2))
+        mock_get_jobs_details.side_effect = self._job_resources(
+            *[[0]] * bq_utils_consts.BQ_DEFAULT_RETRY_COUNT)
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = [1]
         self.assertEqual(actual, expected)
 
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
     @mock.patch('bq_utils.sleeper')
-    @mock.patch('bq_utils.job_status_done')
-    def test_wait_on_jobs_retry_count(self, mock_job_status, mock_sleep):
+    @mock.patch('bq_utils.get_jobs_details')
+    def test_wait_on_jobs_retry_count(self, mock_get_jobs_details, mock_sleep,
+                                      mock_create_service, mock_get_app_id):
         max_sleep_interval = 512
-        mock_job_status.return_value = False
+        mock_get_jobs_details.side_effect = self._job_resources(
+            *[[]] * bq_utils_consts.BQ_DEFAULT_RETRY_COUNT)
         job_ids = ["job_1", "job_2"]
         bq_utils.wait_on_jobs(job_ids)
         mock_sleep.assert_called_with(max_sleep_interval)
 
+    @mock.patch('bq_utils.sleeper')
+    def test_job_tracker(self, mock_sleep):
+        job_ids = ['job_1', 'job_2']
+        error_result = {'message': 'fake error'}
+        responses = {
+            'job_1': {
+                'status': {
+                    'state': 'DONE'
+                }
+            },
+            'job_2': {
+                'status': {
+                    'state': 'DONE',
+                    'errorResult': error_result
+                }
+            }
+        }
+        mock_service = mock.MagicMock()
+        # each request is represented by the id of the job it gets
+        mock_service.jobs.return_value.get.side_effect = lambda projectId, jobId: jobId
+        mock_batch = mock_service.new_batch_http_request.return_value
+        added = []
+        mock_batch.add.side_effect = lambda request, request_id: added.append(
+            (request_id, request))
+
+        def execute():
+            callback = mock_service.new_batch_http_request.call_args[1][
+                'callback']
+            for request_id, job_id in added:
+                if job_id == 'job_2' and mock_batch.execute.call_count == 1:
+                    # first attempt to get job_2 fails and is retried
+                    callback(request_id, None, Exception('fake http error'))
+                else:
+                    callback(request_id, responses[job_id], None)
+            added.clear()
+
+        mock_batch.execute.side_effect = execute
+
+        tracker = bq_utils.JobTracker(project_id='fake_project',
+                                      bq_service=mock_service)
+        incomplete_jobs = tracker.wait(job_ids)
+
+        self.assertEqual(incomplete_jobs, [])
+        self.assertEqual(mock_batch.execute.call_count, 2)
+        self.assertEqual(tracker.job_resources, responses)
+        self.assertEqual(
+            tracker.job_resources['job_2']['status']['errorResult'],
+            error_result)
+        self.assertCountEqual(job_ids, tracker.wait_times.keys())
+        for wait_time in tracker.wait_times.values():
+            self.assertGreaterEqual(wait_time, 0)
+
+    @staticmethod
+    def _query_pages():
+        """
+        Get the pages of a fake query response with nested and repeated fields
+        """
+        schema = {
+            'fields': [{
+                'name': 'person_id',
+                'type': 'INTEGER',
+                'mode': 'NULLABLE'
+            }, {
+                'name': 'value',
+                'type': 'FLOAT',
+                'mode': 'NULLABLE'
+            }, {
+                'name': 'is_valid',
+                'type': 'BOOLEAN',
+                'mode': 'NULLABLE'
+            }, {
+                'name': 'codes',
+                'type': 'STRING',
+                'mode': 'REPEATED'
+            }, {
+                'name':
+                    'visits',
+                'type':
+                    'RECORD',
+                'mode':
+                    'REPEATED',
+                'fields': [{
+                    'name': 'visit_id',
+                    'type': 'INTEGER',
+                    'mode': 'NULLABLE'
+                }]
+            }]
+        }
+
+        def row(person_id, value, is_valid, codes, visit_ids):
+            return {
+                'f': [{
+                    'v': person_id
+                }, {
+                    'v': value
+                }, {
+                    'v': is_valid
+                }, {
+                    'v': [{
+                        'v': code
+                    } for code in codes]
+                }, {
+                    'v': [{
+                        'v': {
+                            'f': [{
+                                'v': visit_id
+                            }]
+                        }
+                    } for visit_id in visit_ids]
+                }]
+            }
+
+        first_page = {
+            'schema':
+                schema,
+            'jobReference': {
+                'jobId': 'fake_job'
+            },
+            'pageToken':
+                'page_2',
+            'rows': [
+                row('1', '1.5', 'true', ['a', 'b'], ['10']),
+                row('2', None, 'false', [], [])
+            ]
+        }
+        second_page = {
+            'schema': schema,
+            'jobReference': {
+                'jobId': 'fake_job'
+            },
+            'rows': [row('3', '2.0', 'TRUE', ['c'], ['11', '12'])]
+        }
+        expected_rows = [{
+            'person_id': 1,
+            'value': 1.5,
+            'is_valid': True,
+            'codes': ['a', 'b'],
+            'visits': [{
+                'visit_id': 10
+            }]
+        }, {
+            'person_id': 2,
+            'value': None,
+            'is_valid': False,
+            'codes': [],
+            'visits': []
+        }, {
+            'person_id': 3,
+            'value': 2.0,
+            'is_valid': True,
+            'codes': ['c'],
+            'visits': [{
+                'visit_id': 11
+            }, {
+                'visit_id': 12
+            }]
+        }]
+        return first_page, second_page, expected_rows
+
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
+    def test_iter_query_rows(self, mock_create_service, mock_get_app_id):
+        first_page, second_page, expected_rows = self._query_pages()
+        mock_get_query_results = mock_create_service.return_value.jobs.return_value.getQueryResults
+        mock_get_query_results.return_value.execute.return_value = second_page
+
+        rows = bq_utils.iter_query_rows(first_page)
+        # the rows of the first page are available before fetching the next
+        self.assertEqual(next(rows), expected_rows[0])
+        self.assertEqual(next(rows), expected_rows[1])
+        mock_get_query_results.assert_not_called()
+        self.assertEqual(list(rows), expected_rows[2:])
+        mock_get_query_results.assert_called_once_with(projectId=mock.ANY,
+                                                       jobId='fake_job',
+                                                       pageToken='page_2')
+
+        self.assertEqual(bq_utils.large_response_to_rowlist(first_page),
+                         expected_rows)
+        self.assertEqual(bq_utils.response2rows(first_page), expected_rows[:2])
+
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
+    def test_iter_query_batches(self, mock_create_service, mock_get_app_id):
+        first_page, second_page, expected_rows = self._query_pages()
+        mock_get_query_results = mock_create_service.return_value.jobs.return_value.getQueryResults
+        mock_get_query_results.return_value.execute.return_value = second_page
+
+        batches = list(bq_utils.iter_query_batches(first_page))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0]['person_id'].dtype.name, 'int64')
+        self.assertEqual(batches[0]['person_id'].tolist(), [1, 2])
+        # columns with nulls are kept as objects
+        self.assertEqual(batches[0]['value'].dtype.name, 'object')
+        self.assertEqual(batches[0]['value'].tolist(), [1.5, None])
+        self.assertEqual(batches[1]['value'].dtype.name, 'float64')
+        self.assertEqual(batches[0]['is_valid'].tolist(), [True, False])
+        self.assertEqual(batches[1]['visits'].tolist(),
+                         [expected_rows[2]['visits']])
+
+        data_frames = list(
+            bq_utils.iter_query_batches(first_page, as_dataframe=True))
+        self.assertEqual(len(data_frames), 2)
+        self.assertEqual(list(data_frames[0].columns),
+                         ['person_id', 'value', 'is_valid', 'codes', 'visits'])
+        self.assertEqual(data_frames[0].to_dict('records')[0], expected_rows[0])
+        self.assertEqual(data_frames[1]['person_id'].tolist(), [3])
+
     @mock.patch('bq_utils.os.environ.get')
     def test_get_validation_results_dataset_id_not_existing(self, mock_env_var):
         # preconditions
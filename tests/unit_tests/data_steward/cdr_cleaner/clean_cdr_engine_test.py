@@ -1,11 +1,20 @@
 # Python imports
 import inspect
+import os
+import shutil
+import sqlite3
+import tempfile
 from unittest import TestCase
 
+# Third party imports
+import mock
+
 # Project imports
 from cdr_cleaner import clean_cdr_engine as ce
 from cdr_cleaner.cleaning_rules.base_cleaning_rule import BaseCleaningRule
+from constants import bq_utils as bq_consts
 from constants.cdr_cleaner import clean_cdr as cdr_consts
+from constants.cdr_cleaner import clean_cdr_engine as ce_consts
 
 fake_rule_class_query = 'SELECT "FakeRuleClass"'
 fake_rule_func_query = 'SELECT "fake_rule_func"'
@@ -42,6 +51,135 @@ def fake_rule_func(project_id, dataset_id, sandbox_dataset_id='hello'):
     return [{cdr_consts.QUERY: fake_rule_func_query}]
 
 
+class FakeSandboxRuleClass(FakeRuleClass):
+
+    def get_query_specs(self, *args, **keyword_args):
+        return [{
+            cdr_consts.QUERY: f'SELECT * FROM `{self.dataset_id}.observation`',
+            cdr_consts.DESTINATION_TABLE: 'observation_sandbox',
+            cdr_consts.DESTINATION_DATASET: self.sandbox_dataset_id
+        }, {
+            cdr_consts.QUERY:
+                f'DELETE FROM `{self.project_id}.{self.dataset_id}.observation` '
+                f'WHERE person_id IN (SELECT person_id FROM '
+                f'`{self.sandbox_dataset_id}.observation_sandbox`)'
+        }]
+
+
+class FakeDependentRuleClass(FakeRuleClass):
+
+    def __init__(self, project_id, dataset_id, sandbox_dataset_id):
+        super().__init__(project_id, dataset_id, sandbox_dataset_id)
+        self._depends_on_classes = [FakeRuleClass]
+
+    def get_query_specs(self, *args, **keyword_args):
+        return [{
+            cdr_consts.QUERY:
+                f'UPDATE `{self.dataset_id}.measurement` SET value = 0 '
+                f'WHERE TRUE'
+        }]
+
+
+class FakeSetupRuleClass(FakeRuleClass):
+    reads_dataset_in_setup = True
+
+    def setup_rule(self, client, *args, **keyword_args):
+        client.list_tables(self.dataset_id)
+
+
+FUSABLE_TABLES = ['observation', 'measurement']
+
+
+def _rewrite_specs(query, project_id, dataset_id, tables=FUSABLE_TABLES):
+    return [{
+        cdr_consts.QUERY:
+            query.format(project=project_id, dataset=dataset_id, table=table),
+        cdr_consts.DESTINATION_TABLE:
+            table,
+        cdr_consts.DESTINATION_DATASET:
+            dataset_id,
+        cdr_consts.DISPOSITION:
+            bq_consts.WRITE_TRUNCATE
+    } for table in tables]
+
+
+def fake_drop_negative_values(project_id, dataset_id, sandbox_dataset_id):
+    return _rewrite_specs(
+        'SELECT * FROM `{project}.{dataset}.{table}` WHERE value >= 0',
+        project_id, dataset_id)
+
+
+def fake_sandbox_high_values(project_id, dataset_id, sandbox_dataset_id):
+    return [{
+        cdr_consts.QUERY:
+            f'SELECT * FROM `{project_id}.{dataset_id}.observation` '
+            f'WHERE value > 100',
+        cdr_consts.DESTINATION_TABLE: 'observation_high_values',
+        cdr_consts.DESTINATION_DATASET: sandbox_dataset_id,
+        cdr_consts.DISPOSITION: bq_consts.WRITE_TRUNCATE
+    }]
+
+
+def fake_cap_values(project_id, dataset_id, sandbox_dataset_id):
+    return _rewrite_specs(
+        '-- caps values to 100\n'
+        'WITH capped AS (SELECT id, person_id, '
+        'CASE WHEN value > 100 THEN 100 ELSE value END AS value '
+        'FROM `{project}.{dataset}.{table}`) SELECT * FROM capped', project_id,
+        dataset_id)
+
+
+def fake_drop_orphans(project_id, dataset_id, sandbox_dataset_id):
+    return _rewrite_specs(
+        'SELECT * FROM `{project}.{dataset}.{table}` t WHERE t.person_id IN '
+        '(SELECT person_id FROM `{project}.{dataset}.person`) '
+        'AND t.value != 13', project_id, dataset_id)
+
+
+FUSABLE_RULES = [(fake_drop_negative_values,), (fake_sandbox_high_values,),
+                 (fake_cap_values,), (fake_drop_orphans,)]
+
+
+class SqliteClient:
+    """
+    Runs queries on an in-memory SQLite database instead of BigQuery
+
+    Tables are named after their fully qualified BigQuery table ids.
+    """
+
+    def __init__(self, project, dataset_id):
+        self.project = project
+        self.connection = sqlite3.connect(':memory:')
+        self.queries = []
+        for table in FUSABLE_TABLES + ['person']:
+            self.connection.execute(
+                f'CREATE TABLE `{project}.{dataset_id}.{table}` '
+                f'(id INTEGER, person_id INTEGER, value INTEGER)')
+        self.connection.executemany(
+            f'INSERT INTO `{project}.{dataset_id}.person` VALUES (?, ?, ?)',
+            [(i, i, 0) for i in range(1, 5)])
+        for table in FUSABLE_TABLES:
+            self.connection.executemany(
+                f'INSERT INTO `{project}.{dataset_id}.{table}` '
+                f'VALUES (?, ?, ?)',
+                [(i, i % 6, (i * 37) % 150 - 20) for i in range(1, 60)])
+
+    def query(self, query, job_config=None, job_id_prefix=''):
+        self.queries.append(query)
+        destination = job_config.destination
+        table = (f'{destination.project}.{destination.dataset_id}.'
+                 f'{destination.table_id}')
+        self.connection.execute(f'CREATE TABLE temp_results AS {query}')
+        self.connection.execute(f'DROP TABLE IF EXISTS `{table}`')
+        self.connection.execute(f'ALTER TABLE temp_results RENAME TO `{table}`')
+        return mock.Mock(errors=None,
+                         job_id=f'{job_id_prefix}{len(self.queries)}')
+
+    def get_rows(self, table):
+        return sorted(
+            self.connection.execute(f'SELECT * FROM `{table}`').fetchall())
+
+
 class CleanCDREngineTest(TestCase):
 
     @classmethod
@@ -148,3 +286,277 @@ class CleanCDREngineTest(TestCase):
         actual_rule_args = ce.get_rule_args(fake_rule_func)
         actual_param_names = [arg['name'] for arg in actual_rule_args]
         self.assertListEqual(expected_param_names, actual_param_names)
+
+    def test_get_table_accesses(self):
+        references, writes = ce.get_table_accesses({
+            cdr_consts.QUERY:
+                'DELETE FROM `project.dataset.observation` o WHERE EXISTS '
+                '(SELECT 1 FROM [project:sandbox.obs_sandbox] s, '
+                'dataset.fitbit_* f WHERE s.observation_id = o.observation_id)'
+        })
+        self.assertEqual(writes, {'dataset.observation'})
+        self.assertTrue(
+            {'dataset.observation', 'sandbox.obs_sandbox',
+             'dataset.fitbit_*'}.issubset(references))
+
+        references, writes = ce.get_table_accesses({
+            cdr_consts.QUERY: 'SELECT table_name FROM '
+                              '`project.Dataset.INFORMATION_SCHEMA.COLUMNS`',
+            cdr_consts.DESTINATION_TABLE: 'Tables',
+            cdr_consts.DESTINATION_DATASET: 'sandbox'
+        })
+        self.assertEqual(writes, {'sandbox.tables'})
+        self.assertEqual(references, {'dataset.*', 'sandbox.tables'})
+
+    def test_get_query_dependencies(self):
+        accesses = [
+            ({'dataset.observation', 'sandbox.obs'}, {'sandbox.obs'}),
+            ({'dataset.observation', 'sandbox.obs'}, {'dataset.observation'}),
+            ({'dataset.measurement'}, {'dataset.measurement'}),
+            ({'dataset.person'}, set()),
+            ({'dataset.*'}, set()),
+            ({'dataset.fitbit_*', 'dataset.person'}, {'dataset.person'}),
+        ]
+        self.assertEqual(
+            ce.get_query_dependencies(accesses),
+            [set(), {0}, set(), set(), {1, 2}, {3, 4}])
+
+    def test_is_prepared_independently(self):
+        self.assertTrue(ce._is_prepared_independently(FakeRuleClass))
+        self.assertFalse(ce._is_prepared_independently(FakeSetupRuleClass))
+        self.assertFalse(ce._is_prepared_independently(fake_rule_func))
+
+    def test_is_prepared_independently_clean_cdr_rules(self):
+        from cdr_cleaner import clean_cdr
+        from cdr_cleaner.cleaning_rules.clean_height_weight import CleanHeightAndWeight
+        from cdr_cleaner.cleaning_rules.clean_mapping import CleanMappingExtTables
+        from cdr_cleaner.cleaning_rules.null_concept_ids_for_numeric_ppi import NullConceptIDForNumericPPI
+        from cdr_cleaner.cleaning_rules.ppi_branching import PpiBranching
+        from cdr_cleaner.cleaning_rules.unit_normalization import UnitNormalization
+
+        for clazz in [CleanHeightAndWeight, NullConceptIDForNumericPPI]:
+            self.assertTrue(ce._is_prepared_independently(clazz))
+        for clazz in [CleanMappingExtTables, PpiBranching, UnitNormalization]:
+            self.assertFalse(ce._is_prepared_independently(clazz))
+
+        # every class rule configured in clean_cdr can be classified
+        rule_lists = [
+            value for name, value in vars(clean_cdr).items()
+            if name.endswith('_CLEANING_CLASSES')
+        ]
+        for rules in rule_lists:
+            for rule in rules:
+                clazz = rule[0]
+                if inspect.isclass(clazz):
+                    self.assertIsInstance(ce._is_prepared_independently(clazz),
+                                          bool)
+
+    @mock.patch('cdr_cleaner.clean_cdr_engine.bq.get_client')
+    def test_clean_dataset_max_workers(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.project = self.project
+        client.query.side_effect = lambda query, **kwargs: mock.Mock(
+            errors=None, query=query)
+        rules = [(FakeSandboxRuleClass,), (FakeRuleClass,),
+                 (FakeDependentRuleClass,), (fake_rule_func,),
+                 (FakeSetupRuleClass,)]
+
+        jobs = ce.clean_dataset(self.project,
+                                self.dataset_id,
+                                self.sandbox_id,
+                                rules,
+                                max_workers=4)
+
+        # jobs are listed in the order the queries are applied sequentially
+        expected_queries = [
+            query_dict[cdr_consts.QUERY] for query_dict in ce.get_query_list(
+                self.project, self.dataset_id, self.sandbox_id, rules)
+        ]
+        self.assertEqual([job.query for job in jobs], expected_queries)
+        # the setup of a rule runs after the queries of the earlier rules
+        calls = [name for name, _, _ in client.method_calls]
+        self.assertEqual(calls.index('list_tables'), len(expected_queries) - 1)
+        self.assertEqual(client.query.call_count, len(expected_queries))
+
+    @mock.patch('cdr_cleaner.clean_cdr_engine.task_graph.run_tasks')
+    @mock.patch('cdr_cleaner.clean_cdr_engine.bq.get_client')
+    def test_schedule_rules(self, mock_get_client, mock_run_tasks):
+        mock_run_tasks.side_effect = lambda tasks, *args, **kwargs: tasks
+        rules = [(FakeSandboxRuleClass,), (FakeRuleClass,),
+                 (FakeDependentRuleClass,), (fake_rule_func,),
+                 (FakeSetupRuleClass,)]
+
+        ce.clean_dataset(self.project,
+                         self.dataset_id,
+                         self.sandbox_id,
+                         rules,
+                         max_workers=4)
+
+        # class rules are scheduled together, the function rule waits for them
+        self.assertEqual(mock_run_tasks.call_count, 3)
+        tasks, dependencies, _ = mock_run_tasks.call_args_list[0][0]
+        self.assertEqual(len(tasks), 4)
+        self.assertEqual(dependencies, [set(), {0}, set(), {2}])
+        tasks, dependencies, _ = mock_run_tasks.call_args_list[1][0]
+        self.assertEqual(tasks[0][0][cdr_consts.QUERY], fake_rule_func_query)
+
+    @mock.patch('cdr_cleaner.clean_cdr_engine.bq.get_client')
+    def test_clean_dataset_resume(self, mock_get_client):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        manifest_path = os.path.join(temp_dir, 'manifest.jsonl')
+        client = mock_get_client.return_value
+        client.project = self.project
+        failing_query = fake_rule_func_query
+        client.query.side_effect = lambda query, **kwargs: mock.Mock(
+            errors=['error'] if query == failing_query else None,
+            query=query,
+            job_id='fake_job')
+        rules = [(FakeSandboxRuleClass,), (fake_rule_func,), (FakeRuleClass,)]
+
+        self.assertRaises(RuntimeError,
+                          ce.clean_dataset,
+                          self.project,
+                          self.dataset_id,
+                          self.sandbox_id,
+                          rules,
+                          manifest_path=manifest_path)
+        self.assertEqual(client.query.call_count, 3)
+
+        # only the failed query and the ones after it run again
+        client.query.reset_mock()
+        failing_query = None
+        jobs = ce.clean_dataset(self.project,
+                                self.dataset_id,
+                                self.sandbox_id,
+                                rules,
+                                manifest_path=manifest_path,
+                                resume=True)
+        self.assertEqual([job.query for job in jobs],
+                         [fake_rule_func_query, fake_rule_class_query])
+
+    def test_compose_queries(self):
+        query = 'SELECT * FROM `p.dataset.observation` WHERE value > 0;'
+        next_query = (
+            'WITH obs AS (SELECT id FROM p.dataset.person) '
+            'SELECT * FROM obs JOIN `dataset.observation` o USING(id)')
+        self.assertEqual(
+            ce.compose_queries(query, next_query, 'dataset.observation'),
+            'WITH observation AS (\n'
+            'SELECT * FROM `p.dataset.observation` WHERE value > 0\n),\n'
+            'obs AS (SELECT id FROM p.dataset.person) '
+            'SELECT * FROM obs JOIN observation o USING(id)')
+
+        # the second query must read the table through a recognized reference
+        self.assertIsNone(
+            ce.compose_queries(query,
+                               'SELECT * FROM `p`.`dataset`.`observation`',
+                               'dataset.observation'))
+        self.assertIsNone(
+            ce.compose_queries(query, 'SELECT * FROM `p.dataset.person`',
+                               'dataset.observation'))
+        # the first query would run again for each reference to the table
+        self.assertIsNone(
+            ce.compose_queries(
+                query, 'SELECT * FROM dataset.observation WHERE id NOT IN '
+                '(SELECT id FROM dataset.observation WHERE value > 9)',
+                'dataset.observation'))
+        # and might give other results if it is not deterministic
+        self.assertIsNone(
+            ce.compose_queries(
+                'SELECT *, ROW_NUMBER() OVER (PARTITION BY id) AS row_num '
+                'FROM dataset.observation', 'SELECT * FROM dataset.observation',
+                'dataset.observation'))
+
+    def test_fuse_queries_nondeterministic(self):
+        from cdr_cleaner.cleaning_rules.id_deduplicate import get_id_deduplicate_queries
+        from cdr_cleaner.cleaning_rules.negative_ages import get_negative_ages_queries
+
+        tasks = []
+        for rule in [get_id_deduplicate_queries, get_negative_ages_queries]:
+            _, _, rule_info = ce.infer_rule(rule, self.project, self.dataset_id,
+                                            self.sandbox_id)
+            query_list = rule(self.project, self.dataset_id, self.sandbox_id)
+            tasks.extend((query_dict, rule_info, query_no, len(query_list))
+                         for query_no, query_dict in enumerate(query_list))
+        accesses = [ce.get_table_accesses(task[0]) for task in tasks]
+
+        fused_tasks, _, _ = ce.fuse_queries(tasks, accesses,
+                                            [set()] * len(tasks))
+
+        # deduplicated tables are not read through a CTE evaluated again
+        self.assertEqual(len(fused_tasks), len(tasks))
+        self.assertFalse(
+            any(ce_consts.FUSED_QUERIES in rule_info
+                for _, rule_info, _, _ in fused_tasks))
+
+    def test_fuse_queries(self):
+        tasks = []
+        for rule, in FUSABLE_RULES:
+            _, _, rule_info = ce.infer_rule(rule, self.project, self.dataset_id,
+                                            self.sandbox_id)
+            query_list = rule(self.project, self.dataset_id, self.sandbox_id)
+            tasks.extend((query_dict, rule_info, query_no, len(query_list))
+                         for query_no, query_dict in enumerate(query_list))
+        accesses = [ce.get_table_accesses(task[0]) for task in tasks]
+
+        fused_tasks, fused_accesses, depends_on = ce.fuse_queries(
+            tasks, accesses, [set()] * len(tasks))
+
+        # the sandbox query must run between rewrites of observation
+        self.assertEqual([
+            query_dict[cdr_consts.DESTINATION_TABLE]
+            for query_dict, *_ in fused_tasks
+        ], [
+            'observation', 'measurement', 'observation_high_values',
+            'observation'
+        ])
+        self.assertNotIn(ce_consts.FUSED_QUERIES, fused_tasks[0][1])
+        self.assertEqual(fused_tasks[1][1][ce_consts.FUSED_QUERIES], [
+            f'{__name__}.{rule.__name__} query 1' for rule in
+            [fake_drop_negative_values, fake_cap_values, fake_drop_orphans]
+        ])
+        self.assertEqual(len(fused_tasks[3][1][ce_consts.FUSED_QUERIES]), 2)
+        self.assertEqual(len(fused_accesses), 4)
+        self.assertEqual(depends_on, [set()] * 4)
+
+    @mock.patch('cdr_cleaner.clean_cdr_engine.bq.get_client')
+    def test_clean_dataset_fuse(self, mock_get_client):
+        project, dataset_id, sandbox_id = ('fake-project', 'fake_dataset',
+                                           'fake_sandbox')
+        tables = [
+            f'{project}.{dataset_id}.{table}' for table in FUSABLE_TABLES
+        ] + [f'{project}.{sandbox_id}.observation_high_values']
+
+        sequential_client = SqliteClient(project, dataset_id)
+        mock_get_client.return_value = sequential_client
+        ce.clean_dataset(project, dataset_id, sandbox_id, FUSABLE_RULES)
+
+        fused_client = SqliteClient(project, dataset_id)
+        mock_get_client.return_value = fused_client
+        static_rules = [rule for rule, in FUSABLE_RULES]
+        jobs = ce.clean_dataset(project,
+                                dataset_id,
+                                sandbox_id,
+                                FUSABLE_RULES,
+                                fuse=True,
+                                static_rules=static_rules)
+
+        # the fused queries give the same results in fewer passes
+        self.assertEqual(len(sequential_client.queries), 7)
+        self.assertEqual(len(fused_client.queries), 4)
+        self.assertEqual(len(jobs), 4)
+        for table in tables:
+            self.assertEqual(fused_client.get_rows(table),
+                             sequential_client.get_rows(table))
+        self.assertGreater(len(sequential_client.get_rows(tables[0])), 0)
+
+        # legacy rules are not fused unless they generate queries statically
+        unfused_client = SqliteClient(project, dataset_id)
+        mock_get_client.return_value = unfused_client
+        ce.clean_dataset(project,
+                         dataset_id,
+                         sandbox_id,
+                         FUSABLE_RULES,
+                         fuse=True)
+        self.assertEqual(len(unfused_client.queries), 7)
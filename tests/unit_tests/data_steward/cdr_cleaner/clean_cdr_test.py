@@ -93,7 +93,12 @@ class CleanCDRTest(unittest.TestCase):
             'sandbox_dataset_id': self.sandbox_dataset_id,
             'data_stage': DataStage.EHR,
             'console_log': False,
-            'list_queries': False
+            'list_queries': False,
+            'max_workers': 1,
+            'manifest_path': None,
+            'resume': False,
+            'fuse': False,
+            'plan_output': None
         }
         actual_args, actual_kwargs = cc.fetch_args_kwargs(test_args +
                                                           expected_kwargs_list)
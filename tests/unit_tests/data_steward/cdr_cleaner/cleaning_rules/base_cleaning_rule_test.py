@@ -9,7 +9,7 @@ import unittest
 # Third party imports
 import googleapiclient
 import oauth2client
-from mock import patch
+from mock import Mock, patch
 
 # Project imports
 from cdr_cleaner.cleaning_rules.base_cleaning_rule import BaseCleaningRule
@@ -479,3 +479,42 @@ class BaseCleaningRuleTest(unittest.TestCase):
                     'Cannot list queries for Inheritance')
                 self.assertEqual([cm.output[0][:len(expected_msg)]],
                                  [expected_msg])
+
+    def test_get_table_counts(self):
+        """
+        Test row counts are read once per dataset from its metadata.
+        """
+        client = Mock()
+        client.query.return_value.result.side_effect = [[{
+            'table_id': 'observation',
+            'row_count': 10
+        }, {
+            'table_id': 'measurement',
+            'row_count': 20
+        }], [{
+            'table_id': 'observation',
+            'row_count': 4
+        }]]
+        alpha = Inheritance(self.project_id, self.dataset_id,
+                            self.sandbox_dataset_id)
+
+        # test
+        counts = alpha.get_table_counts(client, self.dataset_id,
+                                        ['observation', 'person'])
+        more_counts = alpha.get_table_counts(client, self.dataset_id,
+                                             ['measurement'])
+
+        # post conditions
+        self.assertEqual(counts, {'observation': 10, 'person': 0})
+        self.assertEqual(more_counts, {'measurement': 20})
+        client.query.assert_called_once_with(
+            alpha.TABLE_COUNTS_QUERY.format(project=self.project_id,
+                                            dataset=self.dataset_id))
+        self.assertIn('__TABLES__', client.query.call_args[0][0])
+
+        # counts are read again once cleared
+        alpha.clear_table_counts()
+        counts = alpha.get_table_counts(client, self.dataset_id,
+                                        ['observation'])
+        self.assertEqual(counts, {'observation': 4})
+        self.assertEqual(client.query.call_count, 2)
@@ -0,0 +1,144 @@
+"""
+A unit test class for the curation/data_steward/cdr_cleaner/query_planner module.
+"""
+# Python imports
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party imports
+import mock
+from google.api_core.exceptions import NotFound
+
+# Project imports
+from cdr_cleaner import query_planner
+from cdr_cleaner.cleaning_rules.base_cleaning_rule import BaseCleaningRule
+from constants.cdr_cleaner import clean_cdr as cdr_consts
+from constants.cdr_cleaner import query_planner as planner_consts
+
+SANDBOX_QUERY = 'SELECT * FROM `fake_project.fake_dataset.observation`'
+DELETE_QUERY = 'DELETE FROM `fake_project.fake_dataset.observation` WHERE TRUE'
+MISSING_TABLE_QUERY = 'SELECT * FROM `fake_project.fake_dataset.missing`'
+
+
+class FakeRuleClass(BaseCleaningRule):
+
+    def __init__(self, project_id, dataset_id, sandbox_dataset_id):
+        super().__init__(issue_numbers=[''],
+                         description='',
+                         affected_datasets=[cdr_consts.RDR],
+                         affected_tables=[],
+                         project_id=project_id,
+                         dataset_id=dataset_id,
+                         sandbox_dataset_id=sandbox_dataset_id)
+
+    def get_sandbox_tablenames(self):
+        pass
+
+    def setup_rule(self, client, *args, **keyword_args):
+        raise RuntimeError('setup must not run when planning')
+
+    def setup_validation(self, client, *args, **keyword_args):
+        pass
+
+    def get_query_specs(self, *args, **keyword_args):
+        return [{
+            cdr_consts.QUERY: SANDBOX_QUERY,
+            cdr_consts.DESTINATION_TABLE: 'observation_sandbox',
+            cdr_consts.DESTINATION_DATASET: self.sandbox_dataset_id
+        }, {
+            cdr_consts.QUERY: DELETE_QUERY
+        }]
+
+    def validate_rule(self, client, *args, **keyword_args):
+        pass
+
+
+def fake_rule_func(project_id, dataset_id, sandbox_dataset_id):
+    return [{cdr_consts.QUERY: MISSING_TABLE_QUERY}]
+
+
+class FakeClient:
+    """
+    Returns canned dry run statistics instead of calling BigQuery
+    """
+
+    def __init__(self, bytes_processed):
+        self.project = 'fake_project'
+        self.bytes_processed = bytes_processed
+        self.job_configs = []
+
+    def query(self, query, job_config=None):
+        self.job_configs.append(job_config)
+        if query not in self.bytes_processed:
+            raise NotFound('Table fake_project:fake_dataset.missing not found')
+        return mock.Mock(total_bytes_processed=self.bytes_processed[query])
+
+
+class QueryPlannerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        self.project_id = 'fake_project'
+        self.dataset_id = 'fake_dataset'
+        self.sandbox_dataset_id = 'fake_sandbox'
+        self.rules = [(FakeRuleClass,), (fake_rule_func,)]
+        self.client = FakeClient({
+            SANDBOX_QUERY: 3 * 2**30,
+            DELETE_QUERY: 2**30
+        })
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def test_get_plan(self):
+        plan = query_planner.get_plan(self.client,
+                                      self.project_id,
+                                      self.dataset_id,
+                                      self.sandbox_dataset_id,
+                                      self.rules,
+                                      heavy_count=1)
+
+        self.assertEqual(len(plan), 3)
+        self.assertTrue(
+            all(config.dry_run for config in self.client.job_configs))
+        self.assertEqual(plan[0][planner_consts.RULE], 'FakeRuleClass')
+        self.assertEqual(plan[0][planner_consts.DESTINATION],
+                         'fake_sandbox.observation_sandbox')
+        self.assertEqual(plan[0][planner_consts.GIGABYTES_PROCESSED], 3)
+        self.assertEqual(plan[1][planner_consts.BYTES_PROCESSED], 2**30)
+        # only the heaviest query is flagged
+        self.assertEqual([item[planner_consts.HEAVY] for item in plan],
+                         [True, False, False])
+        # queries which cannot be dry run are reported with their error
+        self.assertEqual(plan[2][planner_consts.RULE], 'fake_rule_func')
+        self.assertIsNone(plan[2][planner_consts.BYTES_PROCESSED])
+        self.assertIn('missing', plan[2][planner_consts.ERROR])
+
+    @mock.patch('cdr_cleaner.query_planner.bq.get_client')
+    def test_plan_dataset(self, mock_get_client):
+        mock_get_client.return_value = self.client
+
+        csv_path = os.path.join(self.temp_dir, 'plan.csv')
+        plan = query_planner.plan_dataset(self.project_id, self.dataset_id,
+                                          self.sandbox_dataset_id, self.rules,
+                                          csv_path)
+        with open(csv_path) as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        self.assertEqual([row[planner_consts.SQL] for row in rows],
+                         [SANDBOX_QUERY, DELETE_QUERY, MISSING_TABLE_QUERY])
+
+        json_path = os.path.join(self.temp_dir, 'plan.json')
+        query_planner.write_plan(json_path, plan)
+        with open(json_path) as json_file:
+            self.assertEqual(json.load(json_file), plan)
+
+        self.assertRaises(RuntimeError, query_planner.write_plan,
+                          os.path.join(self.temp_dir, 'plan.txt'), plan)
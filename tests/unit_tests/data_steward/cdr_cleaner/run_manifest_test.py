@@ -0,0 +1,100 @@
+"""
+A unit test class for the curation/data_steward/cdr_cleaner/run_manifest module.
+"""
+# Python imports
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party imports
+import mock
+
+# Project imports
+from cdr_cleaner import run_manifest
+from cdr_cleaner.run_manifest import RunManifest
+from constants.cdr_cleaner import clean_cdr as cdr_consts
+from constants.cdr_cleaner import clean_cdr_engine as ce_consts
+
+
+class RunManifestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        self.project_id = 'fake_project'
+        self.dataset_id = 'fake_dataset'
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.path = os.path.join(self.temp_dir, 'manifest.jsonl')
+        self.rule_info = {
+            cdr_consts.MODULE_NAME: 'cleaning_rules.fake_rule',
+            cdr_consts.FUNCTION_NAME: 'get_query_specs'
+        }
+        self.query_dicts = [{
+            cdr_consts.QUERY: 'SELECT * FROM `fake_dataset.observation`',
+            cdr_consts.DESTINATION_TABLE: 'observation_sandbox',
+            cdr_consts.DESTINATION_DATASET: 'fake_sandbox'
+        }, {
+            cdr_consts.QUERY:
+                'DELETE FROM `fake_dataset.observation` WHERE TRUE'
+        }]
+
+    def test_record(self):
+        manifest = RunManifest(self.path, self.project_id, self.dataset_id)
+        manifest.record(self.rule_info, 0, self.query_dicts[0],
+                        mock.Mock(job_id='job_0'), ce_consts.STATUS_DONE)
+        manifest.record(self.rule_info, 1, self.query_dicts[1], None,
+                        ce_consts.STATUS_FAILED)
+
+        with open(self.path) as manifest_file:
+            records = [json.loads(line) for line in manifest_file]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0][ce_consts.MANIFEST_JOB_ID], 'job_0')
+        self.assertEqual(records[0][ce_consts.MANIFEST_DESTINATION],
+                         'fake_sandbox.observation_sandbox')
+        self.assertEqual(records[0][ce_consts.MANIFEST_SQL_HASH],
+                         run_manifest.get_sql_hash(self.query_dicts[0]))
+        self.assertEqual(records[1][ce_consts.MANIFEST_STATUS],
+                         ce_consts.STATUS_FAILED)
+        self.assertIsNone(records[1][ce_consts.MANIFEST_DESTINATION])
+
+    def test_resume(self):
+        manifest = RunManifest(self.path, self.project_id, self.dataset_id)
+        manifest.record(self.rule_info, 0, self.query_dicts[0],
+                        mock.Mock(job_id='job_0'), ce_consts.STATUS_DONE)
+        manifest.record(self.rule_info, 1, self.query_dicts[1], None,
+                        ce_consts.STATUS_FAILED)
+
+        manifest = RunManifest(self.path,
+                               self.project_id,
+                               self.dataset_id,
+                               resume=True)
+        self.assertTrue(
+            manifest.is_completed(self.rule_info, 0, self.query_dicts[0]))
+        self.assertFalse(
+            manifest.is_completed(self.rule_info, 1, self.query_dicts[1]))
+        # the same query is run again if its SQL changed
+        changed_query_dict = dict(self.query_dicts[0])
+        changed_query_dict[cdr_consts.QUERY] += ' WHERE TRUE'
+        self.assertFalse(
+            manifest.is_completed(self.rule_info, 0, changed_query_dict))
+
+        # queries completed against another dataset are not skipped
+        manifest = RunManifest(self.path,
+                               self.project_id,
+                               'other_dataset',
+                               resume=True)
+        self.assertFalse(
+            manifest.is_completed(self.rule_info, 0, self.query_dicts[0]))
+
+        # a new run restarts the manifest
+        manifest = RunManifest(self.path, self.project_id, self.dataset_id)
+        self.assertFalse(
+            manifest.is_completed(self.rule_info, 0, self.query_dicts[0]))
+        self.assertEqual(os.path.getsize(self.path), 0)
@@ -1,5 +1,6 @@
 import logging
 import mock
+import threading
 import unittest
 from datetime import datetime, timedelta
 from logging import LogRecord
@@ -12,15 +13,34 @@ from google.protobuf import json_format as gcp_json_format, any_pb2 as gcp_any_p
 import pytz
 
 from curation_logging import curation_gae_handler
-from curation_logging.curation_gae_handler import GCPStackDriverLogger, LogCompletionStatusEnum
+from curation_logging.curation_gae_handler import GCPStackDriverLogger, LogCompletionStatusEnum, LogShipper
 from curation_logging.curation_gae_handler import GAE_LOGGING_MODULE_ID, GAE_LOGGING_VERSION_ID
 
 LOG_BUFFER_SIZE = 3
+LOG_NAME = 'projects/fake_project/logs/fake_log'
 SEVERITY_DEBUG = 100  # 100 is the equivalence of logging.DEBUG
 SEVERITY_INFO = 200  # 200 is the equivalence of logging.INFO
 SEVERITY_ERROR = 300  # 300 is the equivalence of logging.ERROR
 
 
+class StubLoggingClient(object):
+    """
+    Records the log entries written, optionally holding writes until released
+    """
+
+    def __init__(self, hold=False):
+        self.calls = []
+        self.writing = threading.Event()
+        self.released = threading.Event()
+        if not hold:
+            self.released.set()
+
+    def write_log_entries(self, entries, log_name=None):
+        self.writing.set()
+        self.released.wait()
+        self.calls.append((list(entries), log_name))
+
+
 class GCPStackDriverLoggerTest(unittest.TestCase):
 
     @classmethod
@@ -195,6 +215,79 @@ class GCPStackDriverLoggerTest(unittest.TestCase):
         self.assertEqual(self.gcp_stackdriver_logger._request_log_id, None)
         self.assertEqual(self.gcp_stackdriver_logger._trace, None)
 
+    @mock.patch('curation_logging.curation_gae_handler.datetime')
+    def test_gcp_stackdriver_logger_shipper(self, mock_datetime):
+        mock_datetime.now.return_value.isoformat.return_value = self.request_start_time.isoformat(
+        )
+        mock_datetime.utcnow.return_value = self.request_start_time
+        mock_datetime.utcfromtimestamp.return_value = self.log_record_created
+        mock_shipper = MagicMock()
+
+        gcp_stackdriver_logger = GCPStackDriverLogger(LOG_BUFFER_SIZE,
+                                                      shipper=mock_shipper)
+        gcp_stackdriver_logger.setup_from_request(self.request)
+        gcp_stackdriver_logger.log_event(self.info_log_record)
+        gcp_stackdriver_logger.log_event(self.debug_log_record)
+        gcp_stackdriver_logger.log_event(self.error_log_record)
+        gcp_stackdriver_logger.log_event(self.info_log_record)
+        gcp_stackdriver_logger.finalize()
+
+        # entries are handed to the shipper instead of being written
+        self.assertEqual(mock_shipper.submit.call_count, 2)
+        _, log_name = mock_shipper.submit.call_args[0]
+        self.assertEqual(
+            log_name,
+            curation_gae_handler.LOG_NAME_TEMPLATE.format(
+                project_id=self.project_id))
+        self.mock_logging_service_client.return_value.write_log_entries.assert_not_called(
+        )
+
+    def test_log_shipper(self):
+        logging_client = StubLoggingClient(hold=True)
+        shipper = LogShipper(logging_client, queue_size=10, batch_size=3)
+
+        # entries queue up while a write is in progress
+        shipper.submit('entry_0', LOG_NAME)
+        self.assertTrue(logging_client.writing.wait(5))
+        for i in range(1, 8):
+            self.assertTrue(shipper.submit(f'entry_{i}', LOG_NAME))
+        self.assertFalse(shipper.flush(timeout=0.1))
+
+        logging_client.released.set()
+        self.assertTrue(shipper.flush(timeout=5))
+
+        entries = [
+            entry for batch, _ in logging_client.calls for entry in batch
+        ]
+        self.assertEqual(entries, [f'entry_{i}' for i in range(8)])
+        # queued entries are written in batches
+        self.assertEqual([len(batch) for batch, _ in logging_client.calls],
+                         [1, 3, 3, 1])
+        self.assertEqual({log_name for _, log_name in logging_client.calls},
+                         {LOG_NAME})
+
+    def test_log_shipper_full_queue(self):
+        logging_client = StubLoggingClient(hold=True)
+        shipper = LogShipper(logging_client,
+                             queue_size=2,
+                             batch_size=3,
+                             put_timeout=0.01)
+
+        shipper.submit('entry_0', LOG_NAME)
+        self.assertTrue(logging_client.writing.wait(5))
+        # entries are dropped once the queue is full
+        self.assertEqual(
+            [shipper.submit(f'entry_{i}', LOG_NAME) for i in range(1, 5)],
+            [True, True, False, False])
+        self.assertEqual(shipper.dropped_count, 2)
+
+        logging_client.released.set()
+        shipper.shutdown()
+        entries = [
+            entry for batch, _ in logging_client.calls for entry in batch
+        ]
+        self.assertEqual(entries, ['entry_0', 'entry_1', 'entry_2'])
+
     @mock.patch('curation_logging.curation_gae_handler.get_gcp_logger')
     def test_initialize_logging(self, mock_get_gcp_logger):
         with patch.dict('os.environ', {'GAE_ENV': ''}):
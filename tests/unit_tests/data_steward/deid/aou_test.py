@@ -0,0 +1,415 @@
+"""
+Unit test for the deid.aou module
+
+Ensures presses sharing a run context set up the lookup tables, check the
+age limit and create the output dataset only once per run, that jobs are
+waited for with backoff, a timeout and pipelined appends, and that the plans
+of tables are compiled once and reused.
+"""
+# Python imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party imports
+import pandas as pd
+from google.cloud import bigquery
+from mock import patch
+
+# Project imports
+import bq_utils
+from deid import aou, press
+from resources import DEID_PATH, fields_for
+
+
+class FakeJob(object):
+
+    def __init__(self, job_id, state='DONE', error_result=None):
+        self.job_id = job_id
+        self.state = state
+        self.error_result = error_result
+
+
+class FakeClient(object):
+    """
+    A BigQuery client whose jobs go through scripted states
+
+    Each statement may be scripted with the list of states its job reports
+    when polled, the last state being repeated once reached.
+    """
+
+    def __init__(self, scripted_states=None, error_results=None):
+        self.scripted_states = scripted_states or {}
+        self.error_results = error_results or {}
+        self.jobs = {}
+        self.events = []
+        self.created_datasets = []
+
+    def list_datasets(self):
+        self.events.append(('list_datasets',))
+        return []
+
+    def dataset(self, dataset_id):
+        return bigquery.DatasetReference('fake_project', dataset_id)
+
+    def create_dataset(self, dataset):
+        self.created_datasets.append(dataset.dataset_id)
+
+    def query(self, sql, location=None, job_config=None):
+        if job_config is not None and job_config.dry_run:
+            self.events.append(('dry_run', sql))
+            return FakeJob(None)
+        job_id = f'job_{len(self.jobs)}'
+        self.jobs[job_id] = (sql, list(self.scripted_states.get(sql, ['DONE'])))
+        self.events.append(('query', sql))
+        return FakeJob(job_id, state='PENDING')
+
+    def get_job(self, job_id):
+        sql, states = self.jobs[job_id]
+        state = states.pop(0) if len(states) > 1 else states[0]
+        self.events.append(('get_job', sql, state))
+        error_result = self.error_results.get(sql) if state == 'DONE' else None
+        return FakeJob(job_id, state, error_result)
+
+
+class FakeClock(object):
+    """
+    A monotonic clock only advancing when sleeping
+    """
+
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class AouTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        for name in [
+                'deid.press.set_up_logging', 'deid.aou.service_account',
+                'deid.aou.bq.Client'
+        ]:
+            patcher = patch(name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.log_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_path)
+        self.input_dataset = 'foo_input'
+        self.output_dataset = 'foo_output_deid'
+        self.private_key = 'fake/SA/file/path.json'
+        self.config_path = os.path.join(DEID_PATH, 'config', 'ids')
+        self.context = aou.RunContext(self.private_key)
+
+        self.clock = FakeClock()
+        for name in ['monotonic', 'sleep']:
+            patcher = patch(f'deid.aou.time.{name}',
+                            side_effect=getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _create_press(self, table, action='submit', **kwargs):
+        return aou.AOU(idataset=self.input_dataset,
+                       odataset=self.output_dataset,
+                       private_key=self.private_key,
+                       table=os.path.join(self.config_path, 'tables',
+                                          table + '.json'),
+                       rules=os.path.join(self.config_path, 'config.json'),
+                       logs=self.log_path,
+                       action=action,
+                       context=self.context,
+                       **kwargs)
+
+    def test_run_once(self):
+        calls = []
+
+        def setup():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(self.context.run_once('step', setup), 1)
+        self.assertEqual(self.context.run_once('step', setup), 1)
+        self.assertEqual(self.context.run_once('other_step', setup), 2)
+        self.assertEqual(len(calls), 2)
+
+    @patch('deid.aou.Press.initialize')
+    @patch('deid.aou.create_person_id_src_hpo_map')
+    @patch('deid.aou.create_allowed_states_table')
+    @patch('deid.aou.create_concept_id_lookup_table')
+    @patch('deid.aou.AOU.map_questionnaire_response_ids')
+    @patch('deid.aou.AOU.get_dataframe')
+    def test_initialize(self, mock_get_dataframe, mock_map_responses,
+                        mock_concept_lookup, mock_allowed_states,
+                        mock_src_hpo_map, mock_press_initialize):
+        mock_get_dataframe.return_value = pd.DataFrame({
+            'person_id': [1, 2],
+            'age': [30, 40]
+        })
+        presses = [
+            self._create_press(table)
+            for table in ['person', 'observation', 'measurement']
+        ]
+
+        results = [press.initialize(age_limit=89) for press in presses]
+
+        # lookups are built and the age limit is checked once for the run
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(mock_press_initialize.call_count, 3)
+        mock_concept_lookup.assert_called_once_with(self.input_dataset,
+                                                    self.context.credentials)
+        mock_allowed_states.assert_called_once_with(self.input_dataset,
+                                                    self.context.credentials)
+        mock_map_responses.assert_called_once_with(1000000)
+        mock_src_hpo_map.assert_called_once_with(self.input_dataset,
+                                                 self.context.credentials)
+        self.assertEqual(mock_get_dataframe.call_count, 1)
+
+        # age ineligible participants fail every press of the run
+        self.context = aou.RunContext(self.private_key)
+        mock_get_dataframe.return_value = pd.DataFrame({
+            'person_id': [1, 2],
+            'age': [30, 90]
+        })
+        presses = [
+            self._create_press(table) for table in ['person', 'measurement']
+        ]
+        results = [press.initialize(age_limit=89) for press in presses]
+        self.assertEqual(results, [False, False])
+
+    @patch('deid.aou.bq_utils.create_standard_table')
+    def test_submit(self, mock_create_table):
+        client = FakeClient()
+        self.context.client = client
+
+        for table in ['person', 'measurement']:
+            press = self._create_press(table)
+            press.submit(f'SELECT * FROM {table}', True)
+            press.submit(f'SELECT * FROM {table}', False)
+
+        # the run's client is used and the output dataset created once
+        aou.bq.Client.from_service_account_json.assert_called_once_with(
+            self.private_key)
+        self.assertEqual(client.events.count(('list_datasets',)), 1)
+        self.assertEqual(client.created_datasets, [self.output_dataset])
+        # a dry run and a query for each statement
+        self.assertEqual(len(client.jobs), 4)
+        self.assertEqual(mock_create_table.call_count, 2)
+        # jobs done when first polled are not slept on
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_wait_for_jobs(self):
+        client = FakeClient(scripted_states={
+            'q1': ['PENDING', 'RUNNING', 'RUNNING', 'RUNNING', 'DONE'],
+            'q2': ['RUNNING', 'DONE'],
+            'q3': ['RUNNING'],
+            'q4': ['DONE']
+        },
+                            error_results={'q4': {
+                                'message': 'fake failure'
+                            }})
+        press = self._create_press('person')
+        job_ids = [
+            client.query(q, job_config=bigquery.QueryJobConfig()).job_id
+            for q in ['q1', 'q2', 'q3', 'q4']
+        ]
+
+        # polling intervals double until all jobs are done
+        press.wait_for_jobs(client, job_ids[:2])
+        self.assertEqual(self.clock.sleeps, [1, 2, 4, 8])
+
+        # jobs which do not finish in time fail instead of hanging
+        self.clock.sleeps = []
+        press.job_timeout = 100
+        with self.assertRaises(bq_utils.BigQueryJobWaitError) as cm:
+            press.wait(client, job_ids[2])
+        self.assertIn(job_ids[2], str(cm.exception))
+        self.assertEqual(sum(self.clock.sleeps), 100)
+        self.assertEqual(max(self.clock.sleeps), aou.JOB_POLL_MAX_SECONDS)
+
+        # failed jobs are reported
+        with self.assertRaises(bq_utils.BigQueryJobWaitError) as cm:
+            press.wait(client, job_ids[3])
+        self.assertIn('fake failure', str(cm.exception))
+
+    @patch('deid.aou.bq_utils.create_standard_table')
+    def test_submit_statements(self, mock_create_table):
+        client = FakeClient(
+            scripted_states={
+                'create': ['RUNNING', 'DONE'],
+                'append_1': ['RUNNING', 'RUNNING', 'DONE'],
+                'append_2': ['DONE']
+            })
+        self.context.client = client
+        press = self._create_press('observation')
+
+        press.submit_statements(['create', 'append_1', 'append_2'],
+                                ['dml_1', 'dml_2'])
+
+        queries = [event for event in client.events if event[0] == 'query']
+        self.assertEqual(
+            queries,
+            [('query', q)
+             for q in ['create', 'append_1', 'append_2', 'dml_1', 'dml_2']])
+        events = client.events
+
+        def position(event):
+            return events.index(event)
+
+        # appends start once the table is created and run concurrently
+        self.assertLess(position(('get_job', 'create', 'DONE')),
+                        position(('dry_run', 'append_1')))
+        self.assertLess(position(('query', 'append_2')),
+                        position(('get_job', 'append_1', 'RUNNING')))
+        # dml statements run after all appends, one after the other
+        self.assertLess(position(('get_job', 'append_1', 'DONE')),
+                        position(('dry_run', 'dml_1')))
+        self.assertLess(position(('get_job', 'dml_1', 'DONE')),
+                        position(('dry_run', 'dml_2')))
+        mock_create_table.assert_called_once_with(
+            'observation',
+            'observation',
+            drop_existing=True,
+            dataset_id=self.output_dataset)
+
+    @patch('deid.aou.create_person_id_src_hpo_map')
+    @patch('deid.aou.create_allowed_states_table')
+    @patch('deid.aou.AOU.get_dataframe')
+    def test_append_questionnaire_response_ids(self, mock_get_dataframe,
+                                               mock_allowed_states,
+                                               mock_src_hpo_map):
+        client = FakeClient()
+        self.context.client = client
+        press = self._create_press('observation',
+                                   map_responses_in_warehouse=True)
+
+        press.create_observation_lookup_tables()
+
+        # responses are mapped by queries and never downloaded
+        mock_get_dataframe.assert_not_called()
+        queries = [sql for sql, _ in client.jobs.values()]
+        self.assertEqual(len(queries), 2)
+        map_table = f'{self.input_dataset}._deid_questionnaire_response_map'
+        self.assertIn(f'CREATE TABLE IF NOT EXISTS `{map_table}`', queries[0])
+        self.assertIn(f'INSERT INTO `{map_table}`', queries[1])
+        self.assertIn(f'FROM `{self.input_dataset}.observation`', queries[1])
+        self.assertIn('IFNULL(MAX(research_response_id) + 1, 1000000)',
+                      queries[1])
+        mock_allowed_states.assert_called_once_with(self.input_dataset,
+                                                    self.context.credentials)
+        mock_src_hpo_map.assert_called_once_with(self.input_dataset,
+                                                 self.context.credentials)
+
+    def test_append_questionnaire_response_ids_failed_job(self):
+        map_table = f'{self.input_dataset}._deid_questionnaire_response_map'
+        append_query = aou.APPEND_RESPONSE_MAP_QUERY.render(
+            map_table=map_table,
+            input_dataset=self.input_dataset,
+            lower_bound=1000000)
+        client = FakeClient(
+            error_results={append_query: {
+                'message': 'fake error'
+            }})
+        self.context.client = client
+        press = self._create_press('observation',
+                                   map_responses_in_warehouse=True)
+
+        # a failed mapping job is raised to the caller creating the press
+        with self.assertRaises(bq_utils.BigQueryJobWaitError):
+            press.append_questionnaire_response_ids(1000000)
+        self.assertEqual([sql for sql, _ in client.jobs.values()][-1],
+                         append_query)
+
+    @patch('deid.press.bq_utils.get_table_info')
+    def test_get_plan(self, mock_get_table_info):
+        mock_get_table_info.side_effect = lambda table, dataset_id: {
+            'schema': {
+                'fields': fields_for(table)
+            }
+        }
+        submitted = []
+
+        def run_press(action='submit'):
+            handle = self._create_press('observation', action=action)
+            handle.submit_statements = lambda sql, dml_sql: submitted.append(
+                (sql, dml_sql))
+            handle.simulate = lambda info: submitted.append(info)
+            press.Press.initialize(handle)
+            with patch.object(handle, 'compile_plan',
+                              wraps=handle.compile_plan) as mock_compile:
+                handle.do()
+            return handle, mock_compile
+
+        # the schema is fetched once however many statements are generated
+        handle, mock_compile = run_press()
+        self.assertEqual(mock_get_table_info.call_count, 1)
+        mock_compile.assert_called_once_with()
+        sql, dml_sql = submitted[0]
+        self.assertGreater(len(sql), 1)
+        self.assertEqual(len(dml_sql), 1)
+        plan_path = handle.get_plan_path(handle.get_plan_key())
+        self.assertTrue(os.path.exists(plan_path))
+
+        # later runs reuse the plan, from memory or from the saved file
+        for clear_memory in [False, True]:
+            if clear_memory:
+                press._PLAN_CACHE.clear()
+            mock_get_table_info.reset_mock()
+            handle, mock_compile = run_press()
+            mock_compile.assert_not_called()
+            self.assertEqual(mock_get_table_info.call_count, 1)
+            self.assertEqual(submitted[-1], (sql, dml_sql))
+            self.assertIn('dml_statements', handle.pipeline)
+
+        # simulations reuse the plan too
+        handle, mock_compile = run_press(action='simulate')
+        mock_compile.assert_not_called()
+
+        # a truncated plan is compiled and saved again
+        with open(plan_path) as plan_file:
+            contents = plan_file.read()
+        for broken_contents in [contents[:len(contents) // 2], '{}']:
+            with open(plan_path, 'w') as plan_file:
+                plan_file.write(broken_contents)
+            press._PLAN_CACHE.clear()
+            handle, mock_compile = run_press()
+            mock_compile.assert_called_once_with()
+            self.assertEqual(submitted[-1], (sql, dml_sql))
+            with open(plan_path) as plan_file:
+                self.assertEqual(plan_file.read(), contents)
+        # plans are written to temporary files moved into place
+        self.assertEqual(os.listdir(os.path.dirname(plan_path)),
+                         [os.path.basename(plan_path)])
+
+        # the plan is compiled again if the table schema changes
+        mock_get_table_info.side_effect = lambda table, dataset_id: {
+            'schema': {
+                'fields': fields_for(table)[:-1]
+            }
+        }
+        handle, mock_compile = run_press()
+        mock_compile.assert_called_once_with()
+        self.assertNotEqual(handle.get_plan_path(handle.get_plan_key()),
+                            plan_path)
+
+        # plans saved by another version of the code are not reused
+        plan_key = handle.get_plan_key()
+        with patch.object(press, 'PLAN_FORMAT_VERSION',
+                          press.PLAN_FORMAT_VERSION + 1):
+            self.assertNotEqual(handle.get_plan_key(), plan_key)
+        with patch.dict(press._SOURCE_HASHES, {'deid.rules': 'changed'}):
+            self.assertNotEqual(handle.get_plan_key(), plan_key)
+        self.assertEqual(handle.get_plan_key(), plan_key)
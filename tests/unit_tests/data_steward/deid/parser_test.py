@@ -65,6 +65,7 @@ class ParserTest(unittest.TestCase):
         # setting correct_parameter_dict values not set in setUp function
         correct_parameter_dict['cluster'] = False
         correct_parameter_dict['age_limit'] = MAX_AGE
+        correct_parameter_dict['map_responses_in_warehouse'] = False
 
         # Test if correct parameters are given
         results_dict = parse_args(self.correct_parameter_list)
@@ -1,6 +1,8 @@
 import json
 import mock
 import os
+import shutil
+import tempfile
 import unittest
 
 import common
@@ -96,8 +98,13 @@ class ResourcesTest(unittest.TestCase):
 
         self.assertEqual(actual_fields, expected_fields)
 
-    @mock.patch('resources.os.walk')
-    def test_fields_for_duplicate_files(self, mock_walk):
+    def _write_fields(self, root_path, file_name, fields):
+        path = os.path.join(root_path, 'fields', file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            json.dump(fields, fp)
+
+    def test_fields_for_duplicate_files(self):
         """
         Testing that fields for works as expected with sub-directory structures.
 
@@ -108,23 +115,63 @@ class ResourcesTest(unittest.TestCase):
         """
         # preconditions
         sub_dir = 'baz'
-        # mocks result tuples for os.walk
-        walk_results = [(os.path.join('resource_files', 'fields'), [sub_dir],
-                         ['duplicate.json', 'unique1.json']),
-                        (os.path.join('resource_files', 'fields', sub_dir), [],
-                         ['duplicate.json', 'unique2.json'])]
-
-        mock_walk.return_value = walk_results
+        root_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root_path)
+        json_data = [{"id": "fake id desc", "type": "fake type"}]
+        self._write_fields(root_path, 'duplicate.json', [])
+        self._write_fields(root_path, 'unique1.json', [])
+        self._write_fields(root_path, os.path.join(sub_dir, 'duplicate.json'),
+                           json_data)
+        self._write_fields(root_path, os.path.join(sub_dir, 'unique2.json'), [])
+        registry = resources.ResourceRegistry(root_path)
+
+        with mock.patch('resources.get_registry', return_value=registry):
+            # test
+            self.assertRaises(RuntimeError, resources.fields_for, 'duplicate')
+
+            # test
+            actual_fields = resources.fields_for('duplicate', sub_dir)
+            self.assertEqual(actual_fields, json_data)
+
+            # callers get their own copy of the fields
+            actual_fields.append({})
+            self.assertEqual(resources.fields_for('duplicate', sub_dir),
+                             json_data)
+
+    def test_registry_snapshot(self):
+        """
+        Testing that parsed files are loaded from an up-to-date snapshot
+        """
+        # preconditions
+        root_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root_path)
+        snapshot_path = os.path.join(tempfile.mkdtemp(), 'resources.pickle')
+        self.addCleanup(shutil.rmtree, os.path.dirname(snapshot_path))
+        self._write_fields(root_path, 'person.json', [{'name': 'person_id'}])
+        csv_path = os.path.join(root_path, 'cdm.csv')
+        with open(csv_path, 'w') as fp:
+            fp.write('table_name,column_name\nperson,person_id\n')
+        resources.ResourceRegistry(root_path).write_snapshot(snapshot_path)
 
         # test
-        self.assertRaises(RuntimeError, resources.fields_for, 'duplicate')
+        registry = resources.ResourceRegistry(root_path,
+                                              snapshot_path=snapshot_path)
+        with mock.patch('resources.open', side_effect=AssertionError):
+            self.assertEqual(
+                registry.get_schema(registry.schema_paths['person'][0]), [{
+                    'name': 'person_id'
+                }])
+            self.assertEqual(registry.get_csv(csv_path), [{
+                'table_name': 'person',
+                'column_name': 'person_id'
+            }])
 
-        # test
-        data = '[{"id": "fake id desc", "type": "fake type"}]'
-        json_data = json.loads(data)
-        with mock.patch('resources.open',
-                        mock.mock_open(read_data=data)) as mock_file:
-            with mock.patch('resources.json.load') as mock_json:
-                mock_json.return_value = json_data
-                actual_fields = resources.fields_for('duplicate', sub_dir)
-                self.assertEqual(actual_fields, json_data)
+        # post conditions
+        # the snapshot is ignored once the files change
+        self._write_fields(root_path, 'person.json', [{'name': 'id'}])
+        registry = resources.ResourceRegistry(root_path,
+                                              snapshot_path=snapshot_path)
+        self.assertEqual(
+            registry.get_schema(registry.schema_paths['person'][0]), [{
+                'name': 'id'
+            }])
@@ -1,5 +1,6 @@
 import unittest
 import mock
+from googleapiclient.errors import HttpError
 
 import bq_utils
 import cdm
@@ -183,3 +184,138 @@ class RetractDataBqTest(unittest.TestCase):
             q[retract_data_bq.DEST_TABLE] for q in qs + mqs)
         expected_dest_tables = set(existing_table_ids) - set(ignored_tables)
         self.assertSetEqual(expected_dest_tables, actual_dest_tables)
+
+    def _query_dicts(self, tables):
+        return [{
+            retract_data_bq.QUERY: f'DELETE FROM {table} WHERE TRUE',
+            retract_data_bq.DEST_DATASET: self.combined_dataset_id,
+            retract_data_bq.DEST_TABLE: table
+        } for table in tables]
+
+    @mock.patch('retraction.retract_data_bq.bq_utils.JobTracker')
+    @mock.patch('retraction.retract_data_bq.bq_utils.query')
+    def test_retraction_query_runner(self, mock_query, mock_job_tracker):
+        submissions = []
+
+        def query(q, batch=None):
+            table = q.split()[2]
+            submissions.append(table)
+            if table == 'observation' and submissions.count(table) == 1:
+                raise HttpError(mock.Mock(status=503), b'')
+            return {
+                'jobReference': {
+                    'jobId': f'job_{table}'
+                },
+                'jobComplete': table != 'measurement',
+                'numDmlAffectedRows': '5'
+            }
+
+        mock_query.side_effect = query
+        mock_job_tracker.return_value.wait.return_value = []
+        mock_job_tracker.return_value.job_resources = {
+            'job_measurement': {
+                'status': {
+                    'state': 'DONE'
+                },
+                'statistics': {
+                    'query': {
+                        'numDmlAffectedRows': '7'
+                    }
+                }
+            }
+        }
+        rows_removed = dict()
+
+        retract_data_bq.retraction_query_runner(self._query_dicts(
+            ['person', 'observation', 'measurement']),
+                                                max_workers=2,
+                                                rows_removed=rows_removed)
+
+        # only the failed query is run again
+        self.assertCountEqual(
+            submissions,
+            ['person', 'observation', 'measurement', 'observation'])
+        self.assertEqual(
+            rows_removed, {
+                self.combined_dataset_id: {
+                    'person': 5,
+                    'observation': 5,
+                    'measurement': 7
+                }
+            })
+        # only jobs which did not complete within the request are waited on
+        mock_job_tracker.return_value.wait.assert_called_once_with(
+            ['job_measurement'])
+
+    @mock.patch('retraction.retract_data_bq.bq_utils.JobTracker')
+    @mock.patch('retraction.retract_data_bq.bq_utils.query')
+    def test_retraction_query_runner_failure(self, mock_query,
+                                             mock_job_tracker):
+        mock_query.return_value = {
+            'jobReference': {
+                'jobId': 'job_person'
+            },
+            'jobComplete': False
+        }
+        mock_job_tracker.return_value.wait.return_value = []
+        mock_job_tracker.return_value.job_resources = {
+            'job_person': {
+                'status': {
+                    'state': 'DONE',
+                    'errorResult': {
+                        'message': 'fake error'
+                    }
+                }
+            }
+        }
+
+        with self.assertRaises(bq_utils.BigQueryJobWaitError):
+            retract_data_bq.retraction_query_runner(self._query_dicts(
+                ['person']),
+                                                    max_retries=1)
+        self.assertEqual(mock_query.call_count, 2)
+
+    @mock.patch('retraction.retract_data_bq.retraction_query_runner')
+    @mock.patch('retraction.retract_data_bq.list_existing_tables')
+    @mock.patch('retraction.retract_data_bq.bq_utils.get_dataset_id_from_obj')
+    @mock.patch('retraction.retract_data_bq.bq_utils.list_datasets')
+    def test_run_bq_retraction(self, mock_list_datasets,
+                               mock_get_dataset_id_from_obj,
+                               mock_list_existing_tables, mock_query_runner):
+        dataset_ids = [
+            self.combined_dataset_id, self.unioned_dataset_id,
+            'combined20190801_deid', 'other_dataset'
+        ]
+        mock_list_datasets.return_value = dataset_ids
+        mock_get_dataset_id_from_obj.side_effect = lambda dataset: dataset
+        mock_list_existing_tables.return_value = [
+            common.OBSERVATION,
+            ehr_union.mapping_table_for(common.OBSERVATION)
+        ]
+
+        retract_data_bq.run_bq_retraction(self.project_id,
+                                          self.sandbox_dataset_id,
+                                          self.project_id,
+                                          self.pid_table_id,
+                                          self.hpo_id,
+                                          'all_datasets',
+                                          self.retraction_type,
+                                          max_workers=3)
+
+        # tables are listed once per dataset to retract from
+        self.assertCountEqual(
+            [call[0][1] for call in mock_list_existing_tables.call_args_list],
+            dataset_ids[:3])
+        # mapping tables of all datasets are retracted from first
+        (mapping_queries,), _ = mock_query_runner.call_args_list[0]
+        (queries,), _ = mock_query_runner.call_args_list[1]
+        self.assertEqual(
+            {(q[retract_data_bq.DEST_DATASET], q[retract_data_bq.DEST_TABLE])
+             for q in mapping_queries},
+            {(dataset_id, ehr_union.mapping_table_for(common.OBSERVATION))
+             for dataset_id in dataset_ids[:3]})
+        self.assertEqual(
+            {(q[retract_data_bq.DEST_DATASET], q[retract_data_bq.DEST_TABLE])
+             for q in queries},
+            {(dataset_id, common.OBSERVATION) for dataset_id in dataset_ids[:3]
+            })
@@ -0,0 +1,143 @@
+"""
+A unit test class for the curation/data_steward/retraction/retract_data_gcs module.
+"""
+# Python imports
+import unittest
+
+# Third party imports
+import mock
+
+# Project imports
+from retraction import retract_data_gcs as rd
+
+
+class FakeGcs(object):
+    """
+    An in-memory bucket serving objects in small chunks
+    """
+
+    def __init__(self, objects, chunk_size=7):
+        self.objects = dict(objects)
+        self.chunk_size = chunk_size
+        self.uploads = []
+
+    def get_object_chunks(self, bucket, name):
+        contents = self.objects[(bucket, name)]
+        for start in range(0, len(contents), self.chunk_size):
+            yield contents[start:start + self.chunk_size]
+
+    def upload_object(self, bucket, name, fp, resumable=False):
+        self.objects[(bucket, name)] = fp.read()
+        self.uploads.append(name)
+        return {'name': name, 'resumable': resumable}
+
+
+class RetractDataGcsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        self.bucket = 'fake_bucket'
+        self.folder_prefix = 'fake_hpo/fake_site_bucket/2019-01-01-v1/'
+        self.pids = [17, 20]
+        self.fake_gcs = FakeGcs({
+            (self.bucket, self.folder_prefix + 'person.csv'):
+                b'person_id,gender_concept_id\n'
+                b'17,8507\n'
+                b'18,8532\r\n'
+                b'\n'
+                b'twenty,8507\n'
+                b'20,8532\n',
+            (self.bucket, self.folder_prefix + 'observation.csv'):
+                b'observation_id,person_id,observation_concept_id\n'
+                b'1,17,100\n'
+                b'2,18,100\n'
+                b'3\n'
+                b'4,20,100',
+            (self.bucket, self.folder_prefix + 'measurement.csv'):
+                b'measurement_id,person_id\n'
+                b'1,18\n',
+            (self.bucket, self.folder_prefix + 'care_site.csv'):
+                b'care_site_id,care_site_name\n'
+                b'17,clinic\n'
+        })
+        for name in ['get_object_chunks', 'upload_object']:
+            patcher = mock.patch(
+                f'retraction.retract_data_gcs.gcs_utils.{name}',
+                side_effect=getattr(self.fake_gcs, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _read(self, file_name):
+        return self.fake_gcs.objects[(self.bucket,
+                                      self.folder_prefix + file_name)]
+
+    def test_retract(self):
+        lines_removed = dict()
+        found_files = [
+            'person.csv', 'observation.csv', 'measurement.csv', 'care_site.csv'
+        ]
+
+        result = rd.retract(self.pids,
+                            self.bucket,
+                            found_files,
+                            self.folder_prefix,
+                            True,
+                            max_workers=3,
+                            lines_removed=lines_removed)
+
+        # only files with lines removed are rewritten, with resumable uploads
+        self.assertEqual(result, [{
+            'name': self.folder_prefix + 'person.csv',
+            'resumable': True
+        }, {
+            'name': self.folder_prefix + 'observation.csv',
+            'resumable': True
+        }])
+        self.assertEqual(
+            lines_removed, {
+                self.folder_prefix + 'person.csv': 2,
+                self.folder_prefix + 'observation.csv': 2,
+                self.folder_prefix + 'measurement.csv': 0,
+                self.folder_prefix + 'care_site.csv': 0
+            })
+        # empty lines are dropped and ill-formed lines are kept
+        self.assertEqual(
+            self._read('person.csv'), b'person_id,gender_concept_id\n'
+            b'18,8532\n'
+            b'twenty,8507\n')
+        self.assertEqual(
+            self._read('observation.csv'),
+            b'observation_id,person_id,observation_concept_id\n'
+            b'2,18,100\n'
+            b'3\n')
+        self.assertEqual(self._read('care_site.csv'),
+                         b'care_site_id,care_site_name\n'
+                         b'17,clinic\n')
+
+    @mock.patch('retraction.retract_data_gcs.get_response')
+    def test_retract_prompt(self, mock_get_response):
+        mock_get_response.side_effect = ['n', 'Y']
+
+        result = rd.retract(self.pids, self.bucket,
+                            ['person.csv', 'observation.csv'],
+                            self.folder_prefix, False)
+
+        self.assertEqual(self.fake_gcs.uploads,
+                         [self.folder_prefix + 'observation.csv'])
+        self.assertEqual(len(result), 1)
+        self.assertIn(b'17,8507', self._read('person.csv'))
+
+    def test_split_lines(self):
+        contents = b'a,b\n1,2\n\n3,4'
+        for chunk_size in [1, 3, len(contents)]:
+            chunks = [
+                contents[start:start + chunk_size]
+                for start in range(0, len(contents), chunk_size)
+            ]
+            self.assertEqual(list(rd._split_lines(chunks)),
+                             contents.split(b'\n'))
@@ -11,13 +11,19 @@ Original Issue: DC-744
 
 import os
 # Python imports
+import json
+import shutil
+import tempfile
+import threading
 import unittest
 
 # Third party imports
+import google
 from mock import patch
 
 from resources import DEID_PATH
 # Project imports
+import bq_utils
 from tools import run_deid
 
 
@@ -80,6 +86,8 @@ class RunDeidTest(unittest.TestCase):
         # setting correct_parameter_dict values not set in setUp function
         correct_parameter_dict['console_log'] = False
         correct_parameter_dict['interactive_mode'] = False
+        correct_parameter_dict['max_workers'] = run_deid.DEFAULT_MAX_WORKERS
+        correct_parameter_dict['map_responses_in_warehouse'] = False
         correct_parameter_dict['input_dataset'] = self.input_dataset
 
         # need to delete idataset argument from correct_parameter_dict because input_dataset argument is returned
@@ -93,14 +101,15 @@ class RunDeidTest(unittest.TestCase):
         # Post conditions
         self.assertEqual(correct_parameter_dict, results_dict)
 
+    @patch('deid.aou.RunContext')
     @patch('tools.run_deid.fields_for')
     @patch('tools.run_deid.copy_suppressed_table_schemas')
-    @patch('deid.aou.main')
+    @patch('deid.aou.create_press')
     @patch('tools.run_deid.copy_deid_map_table')
     @patch('tools.run_deid.load_deid_map_table')
     @patch('tools.run_deid.get_output_tables')
-    def test_main(self, mock_tables, mock_load, mock_copy, mock_main,
-                  mock_suppressed, mock_fields):
+    def test_main(self, mock_tables, mock_load, mock_copy, mock_create_press,
+                  mock_suppressed, mock_fields, mock_context):
         # Tests if incorrect parameters are given
         self.assertRaises(SystemExit, run_deid.main,
                           self.incorrect_parameter_list)
@@ -113,14 +122,19 @@ class RunDeidTest(unittest.TestCase):
         run_deid.main(self.correct_parameter_list)
 
         # Post conditions
-        mock_main.assert_called_once_with([
-            '--rules',
-            os.path.join(DEID_PATH, 'config', 'ids', 'config.json'),
-            '--private_key', self.private_key, '--table', 'fake1', '--action',
-            self.action, '--idataset', self.input_dataset, '--log', 'LOGS',
-            '--odataset', self.output_dataset, '--age-limit', self.max_age
-        ])
-        self.assertEqual(mock_main.call_count, 1)
+        mock_create_press.assert_called_once_with(
+            [
+                '--rules',
+                os.path.join(DEID_PATH, 'config', 'ids',
+                             'config.json'), '--private_key', self.private_key,
+                '--table', 'fake1', '--action', self.action, '--idataset',
+                self.input_dataset, '--log', 'LOGS', '--odataset',
+                self.output_dataset, '--age-limit', self.max_age
+            ],
+            context=mock_context.return_value)
+        self.assertEqual(mock_create_press.call_count, 1)
+        mock_context.assert_called_once_with(self.private_key)
+        mock_create_press.return_value.do.assert_called_once_with()
 
     @patch('tools.run_deid.os.walk')
     def test_known_tables(self, mock_walk):
@@ -185,3 +199,90 @@ class RunDeidTest(unittest.TestCase):
                 drop_existing=True,
                 dataset_id=dest_dataset), None)
         self.assertEqual(mock_bq_utils.create_table.call_count, 1)
+
+    def test_get_table_dependencies(self):
+        # pre-conditions
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        rules_path = os.path.join(config_path, 'config.json')
+        with open(rules_path, 'w') as rules_file:
+            json.dump([{
+                '_id': 'dml_statements',
+                'observation': {
+                    'statement': ['DELETE FROM :odataset.observation']
+                },
+                'measurement': {
+                    'statement': [
+                        'DELETE FROM :odataset.measurement WHERE person_id ',
+                        'NOT IN (SELECT person_id FROM :odataset.person)'
+                    ]
+                }
+            }], rules_file)
+        with open(os.path.join(config_path, 'death.json'), 'w') as table_file:
+            json.dump({'on': 'SELECT person_id FROM :odataset.observation'},
+                      table_file)
+        tables = ['person', 'observation', 'measurement', 'death']
+
+        # test
+        result = run_deid.get_table_dependencies(tables, ['death'], config_path,
+                                                 rules_path)
+
+        # post conditions
+        self.assertEqual(result, [set(), set(), {0}, {1}])
+
+        # tables of the current configuration are independent
+        deid_config_path = os.path.join(DEID_PATH, 'config', 'ids')
+        tables_path = os.path.join(deid_config_path, 'tables')
+        result = run_deid.get_table_dependencies(
+            run_deid.DEID_TABLES, run_deid.get_known_tables(tables_path),
+            tables_path, os.path.join(deid_config_path, 'config.json'))
+        self.assertEqual(result, [set()] * len(run_deid.DEID_TABLES))
+
+    @patch('deid.aou.create_press')
+    def test_run_presses(self, mock_create_press):
+        # pre-conditions
+        tables = [
+            'person', 'observation', 'measurement', 'death', 'specimen',
+            'survey_conduct'
+        ]
+        dependencies = [set(), set(), {0}, {1}, set(), set()]
+        setup_thread = threading.current_thread()
+        done = []
+
+        class FakePress(object):
+
+            def __init__(self, table):
+                self.table = table
+
+            def do(self):
+                if self.table == 'observation':
+                    raise google.api_core.exceptions.BadRequest('fake')
+                done.append(self.table)
+
+        def create_press(parameter_list, context=None):
+            # presses are created one at a time before any of them runs
+            self.assertIs(threading.current_thread(), setup_thread)
+            self.assertEqual(done, [])
+            table = parameter_list[1]
+            if table == 'specimen':
+                raise google.api_core.exceptions.NotFound('fake')
+            if table == 'survey_conduct':
+                # e.g. a lookup table job failed while creating the press
+                raise bq_utils.BigQueryJobWaitError(['fake_job'], 'fake error')
+            return FakePress(table)
+
+        mock_create_press.side_effect = create_press
+
+        # test
+        successes, exceptions, elapsed_times = run_deid.run_presses(
+            tables, [['--table', table] for table in tables],
+            dependencies,
+            max_workers=3)
+
+        # post conditions
+        self.assertEqual(successes, ['person', 'measurement'])
+        # death is skipped because observation failed
+        self.assertEqual(exceptions,
+                         ['observation', 'death', 'specimen', 'survey_conduct'])
+        self.assertCountEqual(done, ['person', 'measurement'])
+        self.assertEqual(set(elapsed_times.keys()), set(tables))
@@ -19,12 +19,14 @@ import unittest
 
 # Third-party imports
 from google.cloud import bigquery
+import jinja2
 
 # Project imports
 import resources
 from utils.bq import (define_dataset, update_labels_and_tags,
                       get_create_or_replace_table_ddl, _to_standard_sql_type,
-                      get_table_schema)
+                      get_table_schema, TemplateRegistry)
+from constants.utils import bq as consts
 
 
 def _get_all_field_types() -> typing.FrozenSet[str]:
@@ -158,3 +160,62 @@ class BqTest(unittest.TestCase):
                 f'CREATE OR REPLACE TABLE `{self.project_id}.{self.dataset_id}.observation`'
             ))
         self.assertTrue(ddl.endswith(fake_as_query))
+
+    def test_template_registry(self):
+        registry = TemplateRegistry()
+        source = 'SELECT * FROM `{{project_id}}.{{dataset_id}}.{{table_id}}`'
+        source_key = TemplateRegistry.get_source_key(source)
+
+        # templates are compiled once however many times they are rendered
+        for table_id in ['person', 'observation', 'measurement']:
+            self.assertEqual(
+                registry.render(source,
+                                project_id=self.project_id,
+                                dataset_id=self.dataset_id,
+                                table_id=table_id),
+                f'SELECT * FROM `{self.project_id}.{self.dataset_id}.{table_id}`'
+            )
+        stats = registry.get_stats()[source_key]
+        self.assertEqual(stats[consts.COMPILES], 1)
+        self.assertEqual(stats[consts.CACHE_HITS], 2)
+        self.assertEqual(stats[consts.RENDERS], 3)
+        self.assertGreaterEqual(stats[consts.RENDER_SECONDS], 0)
+
+        # templates can be rendered by name
+        registered = registry.register('count_query', 'SELECT COUNT(*) {{x}}')
+        self.assertIs(registry.get_template('count_query'), registered)
+        self.assertEqual(registry.render('count_query', x=1),
+                         'SELECT COUNT(*) 1')
+        self.assertIs(registry.register('count_query', 'SELECT COUNT(*) {{x}}'),
+                      registered)
+        self.assertRaises(ValueError, registry.register, 'count_query',
+                          'SELECT 1')
+
+        # undefined variables are not rendered as empty strings
+        self.assertRaises(jinja2.UndefinedError,
+                          registry.render,
+                          source,
+                          project_id=self.project_id,
+                          dataset_id=self.dataset_id)
+
+        registry.clear()
+        self.assertEqual(registry.get_stats(), dict())
+
+    def test_template_registry_max_unnamed(self):
+        registry = TemplateRegistry(max_unnamed=2)
+        registered = registry.register('count_query', 'SELECT COUNT(*) {{x}}')
+        sources = [f'SELECT {i}, {{{{x}}}}' for i in range(3)]
+        registry.render(sources[0], x=1)
+        registry.render(sources[1], x=1)
+        # rendering a template again makes it the most recently used
+        registry.render(sources[0], x=1)
+        registry.render(sources[2], x=1)
+
+        # the least recently used unnamed template is evicted
+        stats = registry.get_stats()
+        source_keys = [TemplateRegistry.get_source_key(s) for s in sources]
+        self.assertEqual(stats[source_keys[0]][consts.COMPILES], 1)
+        self.assertNotIn(source_keys[1], stats)
+        self.assertIn(source_keys[2], stats)
+        # named templates are never evicted
+        self.assertIs(registry.get_template('count_query'), registered)
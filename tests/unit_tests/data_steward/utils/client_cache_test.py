@@ -0,0 +1,106 @@
+"""
+A unit test class for the curation/data_steward/utils/client_cache module.
+"""
+# Python imports
+import threading
+import unittest
+
+# Third party imports
+import mock
+
+# Project imports
+import bq_utils
+import gcs_utils
+from utils import bq, client_cache
+
+
+class ClientCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        client_cache.invalidate()
+        self.addCleanup(client_cache.invalidate)
+
+    def test_get(self):
+        factory = mock.Mock(side_effect=lambda: object())
+        build_count = client_cache.get_build_count('fake')
+
+        client = client_cache.get(('fake', 'project_a'), factory)
+        self.assertIs(client, client_cache.get(('fake', 'project_a'), factory))
+        self.assertEqual(factory.call_count, 1)
+
+        other_client = client_cache.get(('fake', 'project_b'), factory)
+        self.assertIsNot(client, other_client)
+        self.assertEqual(factory.call_count, 2)
+        self.assertEqual(client_cache.get_build_count('fake'), build_count + 2)
+
+        # clients are rebuilt once the cache is invalidated
+        client_cache.invalidate()
+        self.assertIsNot(client, client_cache.get(('fake', 'project_a'),
+                                                  factory))
+        self.assertEqual(factory.call_count, 3)
+
+    def test_get_per_thread(self):
+        factory = mock.Mock(side_effect=lambda: object())
+        key = ('fake_service', 'v1')
+        clients = []
+
+        def get_client():
+            clients.append(client_cache.get(key, factory, per_thread=True))
+            clients.append(client_cache.get(key, factory, per_thread=True))
+
+        thread = threading.Thread(target=get_client)
+        thread.start()
+        thread.join()
+        get_client()
+
+        # each thread reuses its own instance
+        self.assertIs(clients[0], clients[1])
+        self.assertIs(clients[2], clients[3])
+        self.assertIsNot(clients[0], clients[2])
+        self.assertEqual(factory.call_count, 2)
+
+    def test_get_builds_outside_lock(self):
+        building = threading.Event()
+        release = threading.Event()
+        slow_factory = mock.Mock(
+            side_effect=lambda: building.set() or release.wait(5) or object())
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(
+            client_cache.get(('fake', 'slow'), slow_factory)))
+        thread.start()
+        self.assertTrue(building.wait(5))
+
+        # other keys are served while a client is being built
+        client_cache.get(('fake', 'fast'), object)
+        # a client built before the cache is invalidated is not cached
+        client_cache.invalidate()
+        release.set()
+        thread.join()
+        self.assertIsNot(client_cache.get(('fake', 'slow'), object), clients[0])
+        self.assertEqual(slow_factory.call_count, 1)
+
+    @mock.patch('gcs_utils.googleapiclient.discovery.build')
+    @mock.patch('bq_utils.build')
+    def test_create_service(self, mock_bq_build, mock_gcs_build):
+        mock_bq_build.side_effect = lambda *args, **kwargs: mock.Mock()
+        mock_gcs_build.side_effect = lambda *args, **kwargs: mock.Mock()
+
+        self.assertIs(bq_utils.create_service(), bq_utils.create_service())
+        self.assertEqual(mock_bq_build.call_count, 1)
+        self.assertIs(gcs_utils.create_service(), gcs_utils.create_service())
+        self.assertEqual(mock_gcs_build.call_count, 1)
+
+    @mock.patch('utils.bq.bigquery.Client')
+    def test_get_client(self, mock_client):
+        mock_client.side_effect = lambda *args, **kwargs: mock.Mock()
+
+        client = bq.get_client('project_a')
+        self.assertIs(client, bq.get_client('project_a'))
+        self.assertIsNot(client, bq.get_client('project_b'))
+        self.assertEqual(mock_client.call_count, 2)
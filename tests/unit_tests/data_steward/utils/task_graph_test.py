@@ -0,0 +1,65 @@
+"""
+A unit test class for the curation/data_steward/utils/task_graph module.
+"""
+# Python imports
+import threading
+import time
+import unittest
+
+# Project imports
+from utils import task_graph
+
+
+class TaskGraphTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def test_run_tasks(self):
+        tasks = ['a', 'b', 'c', 'd', 'e']
+        dependencies = [set(), set(), {0}, {0, 1}, {2, 3}]
+        finished = []
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def run_task(task):
+            with lock:
+                running.append(task)
+                max_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(task)
+                finished.append(task)
+            return task.upper()
+
+        results = task_graph.run_tasks(tasks,
+                                       dependencies,
+                                       run_task,
+                                       max_workers=2)
+
+        # results are returned in the order of the tasks
+        self.assertEqual(results, ['A', 'B', 'C', 'D', 'E'])
+        self.assertLessEqual(max(max_running), 2)
+        for i, task_dependencies in enumerate(dependencies):
+            for j in task_dependencies:
+                self.assertLess(finished.index(tasks[j]),
+                                finished.index(tasks[i]))
+
+    def test_run_tasks_error(self):
+        tasks = ['a', 'b', 'c']
+        dependencies = [set(), {0}, set()]
+        started = []
+
+        def run_task(task):
+            started.append(task)
+            if task == 'a':
+                raise RuntimeError('fake error')
+
+        with self.assertRaises(RuntimeError):
+            task_graph.run_tasks(tasks, dependencies, run_task, max_workers=2)
+        # tasks depending on the failed task are not started
+        self.assertNotIn('b', started)
@@ -36,3 +36,30 @@ class AchillesTest(unittest.TestCase):
         for command in commands:
             is_temp = sql_wrangle.is_to_temp_table(command)
             self.assertFalse(is_temp, command)
+
+    def test_get_single_pass_commands(self):
+        commands = achilles._get_run_analysis_commands(self.hpo_id)
+        single_pass_commands = achilles._get_single_pass_commands(self.hpo_id)
+
+        # analyses are combined into fewer queries
+        self.assertLess(len(single_pass_commands), len(commands))
+
+        # every analysis query is run exactly once
+        for command in commands:
+            _, _, query = sql_wrangle.get_insert_parts(command)
+            self.assertEqual(
+                sum(
+                    single_pass_command.count(query)
+                    for single_pass_command in single_pass_commands), 1, query)
+
+        # combined queries populate every column of the results tables
+        for command in single_pass_commands:
+            table_id, column_names, query = sql_wrangle.get_insert_parts(
+                command)
+            expected_columns = [
+                field['name']
+                for field in achilles._get_results_fields(table_id)
+            ]
+            self.assertEqual(column_names, expected_columns)
+            self.assertEqual(sql_wrangle.get_output_columns(query),
+                             expected_columns)
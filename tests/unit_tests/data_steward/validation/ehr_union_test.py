@@ -0,0 +1,273 @@
+"""
+A unit test class for the curation/data_steward/validation/ehr_union module.
+"""
+# Python imports
+import unittest
+
+# Third party imports
+import mock
+
+# Project imports
+from validation import ehr_union
+
+
+class EhrUnionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        self.project_id = 'fake_project'
+        self.input_dataset_id = 'fake_input'
+        self.output_dataset_id = 'fake_output'
+        self.hpo_ids = ['nyc', 'pitt']
+        self.fingerprints = {
+            ('nyc', 'person'): (1000, 5),
+            ('nyc', 'measurement'): (1000, 50),
+            ('pitt', 'person'): (2000, 3)
+        }
+        self.union_state = (dict(self.fingerprints),
+                            ehr_union.get_hpo_offsets(self.hpo_ids))
+
+    @mock.patch('validation.ehr_union.bq_utils.query')
+    def test_get_table_fingerprints(self, mock_query):
+        mock_query.return_value = {
+            'schema': {
+                'fields': [{
+                    'name': 'table_id',
+                    'type': 'STRING'
+                }, {
+                    'name': 'last_modified_time',
+                    'type': 'INTEGER'
+                }, {
+                    'name': 'row_count',
+                    'type': 'INTEGER'
+                }]
+            },
+            'rows': [{
+                'f': [{
+                    'v': 'nyc_person'
+                }, {
+                    'v': '1000'
+                }, {
+                    'v': '5'
+                }]
+            }, {
+                'f': [{
+                    'v': 'nyc_not_a_cdm_table'
+                }, {
+                    'v': '1000'
+                }, {
+                    'v': '1'
+                }]
+            }]
+        }
+
+        fingerprints = ehr_union.get_table_fingerprints(self.hpo_ids,
+                                                        self.input_dataset_id,
+                                                        self.project_id)
+
+        self.assertEqual(fingerprints, {('nyc', 'person'): (1000, 5)})
+        self.assertIn('fake_project.fake_input.__TABLES__',
+                      mock_query.call_args[0][0])
+
+    def test_get_changed_hpo_ids(self):
+        # full union if nothing was saved
+        self.assertIsNone(
+            ehr_union.get_changed_hpo_ids(self.hpo_ids, self.fingerprints,
+                                          None))
+
+        # nothing changed
+        self.assertEqual(
+            ehr_union.get_changed_hpo_ids(self.hpo_ids, self.fingerprints,
+                                          self.union_state), [])
+
+        # resubmitted and new tables
+        fingerprints = dict(self.fingerprints)
+        fingerprints[('pitt', 'person')] = (3000, 4)
+        self.assertEqual(
+            ehr_union.get_changed_hpo_ids(self.hpo_ids, fingerprints,
+                                          self.union_state), ['pitt'])
+        fingerprints[('nyc', 'observation')] = (3000, 10)
+        self.assertEqual(
+            ehr_union.get_changed_hpo_ids(self.hpo_ids, fingerprints,
+                                          self.union_state), ['nyc', 'pitt'])
+
+        # new HPOs added after the existing ones keep their ids
+        self.assertEqual(
+            ehr_union.get_changed_hpo_ids(self.hpo_ids + ['chs'],
+                                          self.fingerprints, self.union_state),
+            [])
+
+        # full union if the id offsets of HPOs changed
+        self.assertIsNone(
+            ehr_union.get_changed_hpo_ids(['chs'] + self.hpo_ids,
+                                          self.fingerprints, self.union_state))
+
+    @mock.patch('validation.ehr_union.bq_utils.delete_table')
+    @mock.patch('validation.ehr_union.bq_utils.table_exists')
+    def test_delete_union_state(self, mock_table_exists, mock_delete_table):
+        mock_table_exists.return_value = False
+        ehr_union.delete_union_state(self.output_dataset_id)
+        mock_delete_table.assert_not_called()
+
+        mock_table_exists.return_value = True
+        ehr_union.delete_union_state(self.output_dataset_id)
+        mock_delete_table.assert_called_once_with('_union_state',
+                                                  self.output_dataset_id)
+
+    @mock.patch('validation.ehr_union.query')
+    def test_save_union_state(self, mock_query):
+        ehr_union.save_union_state(self.fingerprints,
+                                   ehr_union.get_hpo_offsets(self.hpo_ids),
+                                   self.output_dataset_id)
+
+        q, table_id, dataset_id, write_disposition = mock_query.call_args[0]
+        self.assertIn("('nyc', 'measurement', 3000000000000000, 1000, 50)", q)
+        self.assertIn("('pitt', 'person', 4000000000000000, 2000, 3)", q)
+        self.assertEqual(table_id, '_union_state')
+        self.assertEqual(dataset_id, self.output_dataset_id)
+        self.assertEqual(write_disposition, 'WRITE_TRUNCATE')
+
+    @mock.patch('validation.ehr_union.save_union_state')
+    @mock.patch('validation.ehr_union.incremental_union')
+    @mock.patch('validation.ehr_union.get_union_state')
+    @mock.patch('validation.ehr_union.get_table_fingerprints')
+    @mock.patch('validation.ehr_union.mapping')
+    @mock.patch('validation.ehr_union.load')
+    def test_main_incremental(self, mock_load, mock_mapping,
+                              mock_get_table_fingerprints, mock_get_union_state,
+                              mock_incremental_union, mock_save_union_state):
+        fingerprints = dict(self.fingerprints)
+        fingerprints[('pitt', 'person')] = (3000, 4)
+        mock_get_table_fingerprints.return_value = fingerprints
+        mock_get_union_state.return_value = self.union_state
+
+        ehr_union.main(self.input_dataset_id,
+                       self.output_dataset_id,
+                       self.project_id,
+                       hpo_ids=self.hpo_ids,
+                       incremental=True)
+
+        # only the changed HPO is unioned again
+        mock_incremental_union.assert_called_once_with(['pitt'], self.hpo_ids,
+                                                       fingerprints,
+                                                       self.input_dataset_id,
+                                                       self.output_dataset_id,
+                                                       self.project_id)
+        mock_save_union_state.assert_called_once_with(
+            fingerprints, ehr_union.get_hpo_offsets(self.hpo_ids),
+            self.output_dataset_id)
+        mock_mapping.assert_not_called()
+        mock_load.assert_not_called()
+
+        # nothing to do if nothing changed
+        mock_incremental_union.reset_mock()
+        mock_save_union_state.reset_mock()
+        mock_get_table_fingerprints.return_value = self.fingerprints
+        ehr_union.main(self.input_dataset_id,
+                       self.output_dataset_id,
+                       self.project_id,
+                       hpo_ids=self.hpo_ids,
+                       incremental=True)
+        mock_incremental_union.assert_not_called()
+        mock_save_union_state.assert_not_called()
+
+    @mock.patch('validation.ehr_union.move_ehr_person_to_observation')
+    @mock.patch('validation.ehr_union.map_ehr_person_to_observation')
+    @mock.patch('validation.ehr_union.bq_utils.create_standard_table')
+    @mock.patch('validation.ehr_union.mapping')
+    @mock.patch('validation.ehr_union.load')
+    @mock.patch('validation.ehr_union.run_dml')
+    def test_incremental_union(self, mock_run_dml, mock_load, mock_mapping,
+                               mock_create_standard_table, mock_map_pto,
+                               mock_move_pto):
+        ehr_union.incremental_union(['nyc'], self.hpo_ids, self.fingerprints,
+                                    self.input_dataset_id,
+                                    self.output_dataset_id, self.project_id)
+
+        queries = [call[0][0] for call in mock_run_dml.call_args_list]
+        self.assertTrue(
+            any('fake_output._mapping_measurement' in q and
+                "src_hpo_id IN UNNEST(['nyc'])" in q for q in queries))
+        self.assertTrue(
+            any('fake_output.unioned_ehr_measurement' in q and
+                'measurement_id >= 3000000000000000 AND '
+                'measurement_id < 4000000000000000' in q for q in queries))
+
+        # records of the changed HPO are mapped and appended
+        mock_mapping.assert_any_call('measurement', ['nyc'],
+                                     self.input_dataset_id,
+                                     self.output_dataset_id,
+                                     self.project_id,
+                                     hpo_offsets=ehr_union.get_hpo_offsets(
+                                         self.hpo_ids),
+                                     write_disposition='WRITE_APPEND')
+        mock_load.assert_any_call('measurement', ['nyc'], self.input_dataset_id,
+                                  self.output_dataset_id)
+        # tables whose records cannot be attributed are unioned from all HPOs
+        mock_load.assert_any_call('person', self.hpo_ids, self.input_dataset_id,
+                                  self.output_dataset_id)
+        mock_map_pto.assert_called_once_with(self.output_dataset_id)
+        mock_move_pto.assert_called_once_with(self.output_dataset_id)
+
+    def test_get_union_tasks(self):
+        tasks, dependencies = ehr_union.get_union_tasks(self.hpo_ids,
+                                                        self.input_dataset_id,
+                                                        self.output_dataset_id,
+                                                        self.project_id)
+        descriptions = [description for description, _ in tasks]
+
+        def depends_on(description):
+            index = descriptions.index(description)
+            return {descriptions[i] for i in dependencies[index]}
+
+        # mapping tables do not depend on anything
+        self.assertEqual(depends_on('Mapping measurement'), set())
+        # loads depend on their output table and the mapping tables they join
+        self.assertEqual(
+            depends_on('Creating union of table visit_occurrence'), {
+                'Creating fake_output.unioned_ehr_visit_occurrence',
+                'Mapping visit_occurrence', 'Mapping care_site',
+                'Mapping provider'
+            })
+        self.assertIn('Mapping measurement',
+                      depends_on('Creating union of table fact_relationship'))
+        self.assertIn('Mapping visit_occurrence',
+                      depends_on('Creating union of table measurement'))
+        self.assertEqual(depends_on('Moving EHR person records to observation'),
+                         {
+                             'Creating union of table person',
+                             'Creating union of table observation'
+                         })
+        # every task comes after the tasks it depends on
+        for i, task_dependencies in enumerate(dependencies):
+            self.assertTrue(all(j < i for j in task_dependencies))
+
+    @mock.patch('validation.ehr_union.delete_union_state')
+    @mock.patch('validation.ehr_union.move_ehr_person_to_observation')
+    @mock.patch('validation.ehr_union.map_ehr_person_to_observation')
+    @mock.patch('validation.ehr_union.bq_utils.create_standard_table')
+    @mock.patch('validation.ehr_union.mapping')
+    @mock.patch('validation.ehr_union.load')
+    def test_main(self, mock_load, mock_mapping, mock_create_standard_table,
+                  mock_map_pto, mock_move_pto, mock_delete_union_state):
+        ehr_union.main(self.input_dataset_id,
+                       self.output_dataset_id,
+                       self.project_id,
+                       hpo_ids=self.hpo_ids,
+                       max_workers=4)
+
+        self.assertEqual(mock_create_standard_table.call_count,
+                         len(ehr_union.resources.CDM_TABLES))
+        self.assertEqual(mock_load.call_count,
+                         len(ehr_union.resources.CDM_TABLES))
+        self.assertEqual(mock_mapping.call_count,
+                         len(ehr_union.cdm.tables_to_map()) + 1)
+        mock_map_pto.assert_called_once_with(self.output_dataset_id)
+        mock_move_pto.assert_called_once_with(self.output_dataset_id)
+        # a full union invalidates the state saved by an incremental union
+        mock_delete_union_state.assert_called_once_with(self.output_dataset_id)
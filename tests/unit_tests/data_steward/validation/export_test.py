@@ -0,0 +1,118 @@
+"""
+A unit test class for the curation/data_steward/validation/export module.
+"""
+# Python imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party imports
+import mock
+
+# Project imports
+from validation import export
+
+
+def _query_response(sql):
+    """
+    Get a query response with a single row holding the query text
+    """
+    return {
+        'totalRows': '1',
+        'schema': {
+            'fields': [{
+                'name': 'query',
+                'type': 'STRING'
+            }]
+        },
+        'rows': [{
+            'f': [{
+                'v': sql
+            }]
+        }]
+    }
+
+
+class ExportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_path)
+        self._write_sql('person.sql',
+                        'SELECT 1 FROM @results_database_schema.person')
+        self._write_sql(os.path.join('person', 'gender.sql'), 'gender')
+        self._write_sql(os.path.join('person', 'race.sql'), 'race')
+        self._write_sql(os.path.join('death', 'death.sql'), 'death')
+        self._write_sql(os.path.join('death', 'age', 'decile.sql'), 'decile')
+
+    def _write_sql(self, file_name, sql):
+        path = os.path.join(self.export_path, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(sql)
+
+    def test_list_query_paths(self):
+        paths = export.list_query_paths(self.export_path)
+        self.assertCountEqual(paths, [
+            os.path.join(self.export_path, file_name) for file_name in [
+                'person.sql',
+                os.path.join('person', 'gender.sql'),
+                os.path.join('person', 'race.sql'),
+                os.path.join('death', 'death.sql'),
+                os.path.join('death', 'age', 'decile.sql')
+            ]
+        ])
+
+    @mock.patch('utils.task_graph.flush_thread_logs')
+    @mock.patch('validation.export.bq_utils.get_dataset_id')
+    @mock.patch('validation.export.bq_utils.query')
+    @mock.patch('validation.export.is_hpo_id')
+    def test_export_from_path(self, mock_is_hpo_id, mock_query, mock_dataset_id,
+                              mock_flush_thread_logs):
+        mock_is_hpo_id.return_value = True
+        mock_query.side_effect = _query_response
+        mock_dataset_id.return_value = 'fake_dataset'
+        query_times = dict()
+
+        result = export.export_from_path(self.export_path,
+                                         'fake',
+                                         max_workers=3,
+                                         query_times=query_times)
+
+        # payloads are nested as per the directory tree
+        self.assertEqual(
+            result, {
+                'PERSON': {
+                    'QUERY': 'SELECT 1 FROM fake_dataset.fake_person',
+                    'GENDER': {
+                        'QUERY': 'gender'
+                    },
+                    'RACE': {
+                        'QUERY': 'race'
+                    }
+                },
+                'DEATH': {
+                    'DEATH': {
+                        'QUERY': 'death'
+                    },
+                    'AGE': {
+                        'DECILE': {
+                            'QUERY': 'decile'
+                        }
+                    }
+                }
+            })
+        # the site is looked up once and each query runs once
+        mock_is_hpo_id.assert_called_once_with('fake')
+        self.assertEqual(mock_query.call_count, 5)
+        self.assertCountEqual(query_times.keys(),
+                              export.list_query_paths(self.export_path))
+        # the worker threads flush their logs after each query
+        self.assertEqual(mock_flush_thread_logs.call_count, 5)
@@ -3,6 +3,8 @@ Unit test components of data_steward.validation.main
 """
 import datetime
 import re
+import threading
+import time
 from unittest import TestCase, mock
 
 import googleapiclient.errors
@@ -199,12 +201,95 @@ class ValidationMainTest(TestCase):
 
         mock_perform_validation_on_file.side_effect = perform_validation_on_file
 
-        actual_result = main.validate_submission(self.hpo_id, self.hpo_bucket,
-                                                 folder_items, folder_prefix)
+        actual_result = main.validate_submission(self.hpo_id,
+                                                 self.hpo_bucket,
+                                                 folder_items,
+                                                 folder_prefix,
+                                                 batch_load=False)
         self.assertCountEqual(expected_results, actual_result.get('results'))
         self.assertCountEqual(expected_errors, actual_result.get('errors'))
         self.assertCountEqual(expected_warnings, actual_result.get('warnings'))
 
+    @mock.patch('bq_utils.create_service')
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils.get_jobs_details')
+    @mock.patch('bq_utils.load_from_csv')
+    @mock.patch('bq_utils.create_standard_table')
+    @mock.patch('api_util.check_cron')
+    def test_validate_submission_batch_load(self, mock_check_cron,
+                                            mock_create_standard_table,
+                                            mock_load_from_csv,
+                                            mock_get_jobs_details, mock_sleeper,
+                                            mock_create_service):
+        """
+        Checks that batch loading waits on all load jobs together and
+        summarizes them in the same order as loading one file at a time
+        """
+        folder_prefix = '2019-01-01/'
+        folder_items = [
+            'person.csv', 'visit_occurrence.csv', 'pii_name.csv',
+            'invalid_file.csv'
+        ]
+
+        def load_from_csv(hpo_id, table_name, source_folder_prefix):
+            return {'jobReference': {'jobId': f'job_{table_name}'}}
+
+        running_job_ids = []
+
+        def get_job_details(job_id):
+            if job_id in running_job_ids:
+                return {'status': {'state': 'RUNNING'}}
+            if job_id == 'job_visit_occurrence':
+                return {
+                    'status': {
+                        'state': 'DONE',
+                        'errorResult': {
+                            'message': 'Fake parsing error'
+                        },
+                        'errors': [{
+                            'message': 'Fake parsing error'
+                        }]
+                    }
+                }
+            return {'status': {'state': 'DONE'}}
+
+        def get_jobs_details(job_ids, project_id=None, bq_service=None):
+            return {job_id: get_job_details(job_id) for job_id in job_ids}
+
+        mock_load_from_csv.side_effect = load_from_csv
+        mock_get_jobs_details.side_effect = get_jobs_details
+
+        expected_results = []
+        for file_name in sorted(resources.CDM_FILES) + sorted(common.PII_FILES):
+            if file_name in ['person.csv', 'pii_name.csv']:
+                result = (file_name, 1, 1, 1)
+            elif file_name == 'visit_occurrence.csv':
+                result = (file_name, 1, 0, 0)
+            else:
+                result = (file_name, 0, 0, 0)
+            if file_name in common.SUBMISSION_FILES:
+                expected_results.append(result)
+        expected_errors = [('visit_occurrence.csv', 'Fake parsing error')]
+        expected_warnings = [('invalid_file.csv', 'Unknown file')]
+
+        actual_result = main.validate_submission(self.hpo_id, self.hpo_bucket,
+                                                 folder_items, folder_prefix)
+        self.assertEqual(expected_results, actual_result.get('results'))
+        self.assertEqual(expected_errors, actual_result.get('errors'))
+        self.assertEqual(expected_warnings, actual_result.get('warnings'))
+
+        # all load jobs are waited on at once
+        mock_get_jobs_details.assert_called_once()
+        self.assertCountEqual(
+            ['job_person', 'job_visit_occurrence', 'job_pii_name'],
+            mock_get_jobs_details.call_args[0][0])
+
+        # incomplete load jobs abort the validation
+        running_job_ids.append('job_person')
+        self.assertRaises(main.InternalValidationError,
+                          main.validate_submission, self.hpo_id,
+                          self.hpo_bucket, folder_items, folder_prefix)
+
     @mock.patch('validation.main.gcs_utils.get_hpo_bucket')
     @mock.patch('bq_utils.get_hpo_info')
     @mock.patch('validation.main.list_bucket')
@@ -224,6 +309,76 @@ class ValidationMainTest(TestCase):
                 f"HTTP error: {http_error_string}")
             self.assertIn(expected_call, mock_logging_error.mock_calls)
 
+    @mock.patch('validation.main.process_hpo')
+    def test_validate_hpos(self, mock_process_hpo):
+        hpo_ids = ['hpo_a', 'hpo_b', 'hpo_c', 'hpo_d']
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def process_hpo(hpo_id):
+            with lock:
+                running.append(hpo_id)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(hpo_id)
+            if hpo_id == 'hpo_b':
+                raise ValueError('fake error')
+
+        mock_process_hpo.side_effect = process_hpo
+
+        summary = main.validate_hpos(hpo_ids, max_workers=2)
+
+        # every site is processed despite the failure of hpo_b
+        self.assertCountEqual(
+            hpo_ids, [c[0][0] for c in mock_process_hpo.call_args_list])
+        self.assertEqual(hpo_ids, [item['hpo_id'] for item in summary])
+        self.assertEqual([
+            main_consts.HPO_STATUS_DONE, main_consts.HPO_STATUS_FAILED,
+            main_consts.HPO_STATUS_DONE, main_consts.HPO_STATUS_DONE
+        ], [item['status'] for item in summary])
+        self.assertIn('fake error', summary[1]['error'])
+        self.assertIsNone(summary[0]['error'])
+        for item in summary:
+            self.assertGreater(item['elapsed'], 0)
+
+        # no more than max_workers sites are processed at the same time
+        self.assertLessEqual(max(max_running), 2)
+
+    @mock.patch.dict('os.environ', {main_consts.VALIDATION_MAX_WORKERS: '7'})
+    def test_get_validation_max_workers(self):
+        self.assertEqual(main.get_validation_max_workers(), 7)
+
+    @mock.patch.dict('os.environ', {main_consts.ACHILLES_MAX_WORKERS: '3'})
+    def test_get_achilles_max_workers(self):
+        self.assertEqual(main.get_achilles_max_workers(), 3)
+
+    @mock.patch('utils.task_graph.flush_thread_logs')
+    @mock.patch('validation.main.save_datasources_json')
+    @mock.patch('gcs_utils.upload_object')
+    @mock.patch('validation.main.export.export_from_path')
+    def test_run_export(self, mock_export_from_path, mock_upload,
+                        mock_save_datasources_json, mock_flush_thread_logs):
+        mock_export_from_path.return_value = {}
+        mock_upload.side_effect = lambda bucket, path, fp: path
+        mock_save_datasources_json.return_value = 'datasources.json'
+
+        results = main.run_export(datasource_id=self.hpo_id,
+                                  folder_prefix=self.folder_prefix,
+                                  target_bucket=self.hpo_bucket)
+
+        # each report is uploaded once and the results keep the report order
+        report_paths = [
+            self.folder_prefix + common.ACHILLES_EXPORT_PREFIX_STRING +
+            self.hpo_id + '/' + export_name + '.json'
+            for export_name in common.ALL_REPORTS
+        ]
+        self.assertEqual(results, report_paths + ['datasources.json'])
+        # the upload threads flush their logs
+        self.assertEqual(mock_flush_thread_logs.call_count,
+                         len(common.ALL_REPORTS))
+
     def test_extract_date_from_rdr(self):
         rdr_dataset_id = 'rdr20200201'
         bad_rdr_dataset_id = 'ehr2019-02-01'
@@ -82,7 +82,7 @@ class ReadersTest(unittest.TestCase):
                 batch=True), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_ehr_person_values_with_duplicate_keys(self, mock_query,
                                                        mock_response,
@@ -136,7 +136,7 @@ class ReadersTest(unittest.TestCase):
                                                 field=column_name)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_ehr_person_values(self, mock_query, mock_response,
                                    mock_fields):
@@ -181,7 +181,7 @@ class ReadersTest(unittest.TestCase):
                                                 field=column_name)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_rdr_match_values(self, mock_query, mock_response, mock_fields):
         # pre conditions
@@ -223,7 +223,7 @@ class ReadersTest(unittest.TestCase):
                                                      field_value=12345)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_rdr_match_values_with_duplicates(self, mock_query,
                                                   mock_response, mock_fields):
@@ -274,7 +274,7 @@ class ReadersTest(unittest.TestCase):
                                                      field_value=12345)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_pii_values(self, mock_query, mock_response, mock_fields):
         # pre conditions
@@ -317,7 +317,7 @@ class ReadersTest(unittest.TestCase):
                                          field=12345)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_pii_values_with_duplicates(self, mock_query, mock_response,
                                             mock_fields):
@@ -370,7 +370,7 @@ class ReadersTest(unittest.TestCase):
                                          field=12345)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_location_pii(self, mock_query, mock_response, mock_fields):
         # pre conditions
@@ -426,7 +426,7 @@ class ReadersTest(unittest.TestCase):
                                                   id_list='85, 90, 115')), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_ehr_person_values_birthdates(self, mock_query, mock_response,
                                               mock_fields):
@@ -471,7 +471,7 @@ class ReadersTest(unittest.TestCase):
                                                 field=column_name)), None)
 
     @patch('validation.participants.readers.rc.fields_for')
-    @patch('validation.participants.readers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.readers.bq_utils.iter_query_rows')
     @patch('validation.participants.readers.bq_utils.query')
     def test_get_ehr_person_values_bytes(self, mock_query, mock_response,
                                          mock_fields):
@@ -154,7 +154,7 @@ class WritersTest(unittest.TestCase):
         self.assertEqual(actual, expected)
 
     @patch('validation.participants.writers.gcs_utils.upload_object')
-    @patch('validation.participants.writers.bq_utils.large_response_to_rowlist')
+    @patch('validation.participants.writers.bq_utils.iter_query_rows')
     @patch('validation.participants.writers.bq_utils.query')
     @patch('validation.participants.writers.StringIO')
     def test_create_site_validation_report(self, mock_report_file, mock_query,
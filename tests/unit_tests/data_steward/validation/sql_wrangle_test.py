@@ -1,8 +1,11 @@
 # Python imports
 import os
+import threading
+import time
 import unittest
 
 # Third party imports
+import mock
 
 # Project imports
 from validation import sql_wrangle
@@ -196,5 +199,130 @@ class SQLWrangleTest(unittest.TestCase):
                                        hpo_id='pitt_temple')
         self.assertEqual(r, 'pitt_temple_achilles_results')
 
+    def test_get_table_accesses(self):
+        accesses = sql_wrangle.get_table_accesses(
+            'insert into fake_achilles_results (analysis_id, count_value) '
+            'select 1 as analysis_id, COUNT(distinct person_id) '
+            'from fake_person p join fake_observation_period op '
+            'on p.person_id = op.person_id')
+        self.assertEqual(
+            accesses, {
+                'fake_achilles_results': {sql_wrangle.APPEND},
+                'fake_person': {sql_wrangle.READ},
+                'fake_observation_period': {sql_wrangle.READ}
+            })
+
+        accesses = sql_wrangle.get_table_accesses(
+            sql_wrangle.qualify_tables(self.query_2, hpo_id='fake'))
+        self.assertEqual(accesses['fake_temp_rawdata_1006'],
+                         {sql_wrangle.WRITE})
+        self.assertEqual(accesses['fake_person'], {sql_wrangle.READ})
+
+        self.assertEqual(
+            sql_wrangle.get_table_accesses('truncate table fake_temp_t'),
+            {'fake_temp_t': {sql_wrangle.WRITE}})
+        self.assertEqual(
+            sql_wrangle.get_table_accesses('drop table fake_temp_t'),
+            {'fake_temp_t': {sql_wrangle.WRITE}})
+
+    def test_get_insert_parts(self):
+        table_name, column_names, query = sql_wrangle.get_insert_parts(
+            '-- 1 Number of persons\n'
+            'insert into fake_ACHILLES_results (analysis_id, count_value)\n'
+            'select 1 as analysis_id, COUNT(distinct person_id) as count_value '
+            'from fake_person')
+        self.assertEqual(table_name, 'fake_achilles_results')
+        self.assertEqual(column_names, ['analysis_id', 'count_value'])
+        self.assertTrue(query.startswith('select 1 as analysis_id'))
+
+        self.assertIsNone(sql_wrangle.get_insert_parts(self.query_1))
+
+    def test_get_output_columns(self):
+        self.assertEqual(
+            sql_wrangle.get_output_columns(
+                'select 1 as analysis_id, CAST(p.gender_concept_id AS STRING) '
+                'as stratum_1, p.count_value from fake_person p'),
+            ['analysis_id', 'stratum_1', 'count_value'])
+
+        # names come from the main query of a WITH clause or a set operation
+        self.assertEqual(
+            sql_wrangle.get_output_columns(
+                sql_wrangle.get_temp_table_query(self.query_1))[:4],
+            ['analysis_id', 'count_value', 'min_value', 'max_value'])
+        self.assertEqual(
+            sql_wrangle.get_output_columns(
+                '(select 2 as analysis_id, COUNT(1) as count_value '
+                'from fake_person) UNION ALL '
+                '(select 3 as analysis_id, COUNT(1) as count_value '
+                'from fake_death)'), ['analysis_id', 'count_value'])
+
+        # unnamed expressions
+        self.assertIsNone(
+            sql_wrangle.get_output_columns(
+                'select 1 as analysis_id, COUNT(1) from fake_person'))
+
+    def test_get_command_dependencies(self):
+        commands = [
+            'insert into results (id) select 1 from person',
+            'insert into results (id) select 2 from person',
+            'INTO temp_t select count(*) as n from results',
+            'insert into derived (id) select n from temp_t',
+            'truncate table temp_t', 'drop table temp_t',
+            'insert into results (id) select 3 from visit'
+        ]
+        dependencies = sql_wrangle.get_command_dependencies(commands)
+        self.assertEqual(
+            dependencies,
+            [set(), set(), {0, 1}, {2}, {2, 3}, {2, 3, 4}, {2}])
+
+    def test_run_commands(self):
+        commands = [
+            'INTO temp_a select 1 from person',
+            'INTO temp_b select 1 from person',
+            'insert into results (id) select 1 from temp_a',
+            'insert into results (id) select 2 from temp_b',
+            'drop table temp_a', 'drop table temp_b'
+        ]
+        finished = []
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def run_command(command):
+            with lock:
+                running.append(command)
+                max_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(command)
+                finished.append(command)
+
+        sql_wrangle.run_commands(commands, run_command, max_workers=2)
+        self.assertCountEqual(finished, commands)
+        self.assertLessEqual(max(max_running), 2)
+        # every command finishes after the ones it depends on
+        dependencies = sql_wrangle.get_command_dependencies(commands)
+        for i, command_dependencies in enumerate(dependencies):
+            for j in command_dependencies:
+                self.assertLess(finished.index(commands[j]),
+                                finished.index(commands[i]))
+
+        # commands run sequentially in the original order by default
+        finished.clear()
+        sql_wrangle.run_commands(commands, run_command)
+        self.assertEqual(finished, commands)
+
+    def test_run_commands_error(self):
+        commands = [
+            'INTO temp_a select 1 from person',
+            'insert into results (id) select 1 from temp_a'
+        ]
+        run_command = mock.Mock(side_effect=RuntimeError('fake error'))
+
+        with self.assertRaises(RuntimeError):
+            sql_wrangle.run_commands(commands, run_command, max_workers=2)
+        # dependent commands are not started after a failure
+        run_command.assert_called_once_with(commands[0])
+
     def tearDown(self):
         pass